@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2017, The MITRE Corporation
+# For license information, see the LICENSE.txt file
+
+"""
+Compares the libtaxii binary Message Binding with the TAXII 1.1 XML Message
+Binding, for a large Poll Response and Inbox Message.
+
+Each message is built once, then serialized and parsed repeatedly. Parsing
+the binary binding leaves Content Block content unparsed, so the "relay"
+figures (parse, then serialize again) show the cost of passing a message on.
+
+Usage:
+    python benchmarks/binary_binding.py [--blocks 10000] [--repeat 3]
+"""
+
+from __future__ import print_function
+
+import argparse
+import timeit
+
+import libtaxii.messages_11 as tm11
+
+from parse_poll_response import make_poll_response
+
+
+def make_inbox_message(num_blocks):
+    """Build an Inbox Message with the Content Blocks of a Poll Response."""
+    poll_response = make_poll_response(num_blocks)
+    return tm11.InboxMessage(message_id=tm11.generate_message_id(), destination_collection_names=['benchmark'],
+                             content_blocks=poll_response.content_blocks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TAXII 1.1 binary Message Binding benchmark')
+    parser.add_argument('--blocks', type=int, default=10000, help='Number of Content Blocks. Defaults to 10000.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs. Defaults to 3.')
+    args = parser.parse_args()
+
+    def time(run):
+        return min(timeit.repeat(run, number=1, repeat=args.repeat))
+
+    for name, message in (('Poll Response', make_poll_response(args.blocks)),
+                          ('Inbox Message', make_inbox_message(args.blocks))):
+        # Serialized first, as to_xml() moves the content into the message's
+        # XML, and the content then carries its namespace declarations
+        binary = message.to_binary()
+        xml = message.to_xml()
+        print('%s: %s Content Blocks, %.1f MB as XML, %.1f MB as binary'
+              % (name, args.blocks, len(xml) / 1e6, len(binary) / 1e6))
+        print('  serialize  XML: %.3fs  binary: %.3fs' % (time(message.to_xml), time(message.to_binary)))
+        print('  parse      XML: %.3fs  binary: %.3fs'
+              % (time(lambda: tm11.get_message_from_xml(xml)), time(lambda: tm11.get_message_from_binary(binary))))
+        print('  relay      XML: %.3fs  binary: %.3fs'
+              % (time(lambda: tm11.get_message_from_xml(xml).to_xml()),
+                 time(lambda: tm11.get_message_from_binary(binary).to_binary())))
+
+
+if __name__ == '__main__':
+    main()
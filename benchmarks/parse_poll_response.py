@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2017, The MITRE Corporation
+# For license information, see the LICENSE.txt file
+
+"""
+Measures how fast a large TAXII 1.1 Poll Response is parsed.
+
+Usage:
+    python benchmarks/parse_poll_response.py [--blocks 10000] [--repeat 3]
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import timeit
+
+from dateutil.tz import tzutc
+
+import libtaxii.messages_11 as tm11
+from libtaxii.constants import *
+
+STIX_CONTENT = ('<stix:STIX_Package xmlns:stix="http://stix.mitre.org/stix-1" id="example:Package-%s" version="1.1.1">'
+                '<stix:STIX_Header><stix:Title>Benchmark package %s</stix:Title></stix:STIX_Header>'
+                '</stix:STIX_Package>')
+
+
+def make_poll_response(num_blocks):
+    """Build a Poll Response with ``num_blocks`` STIX Content Blocks."""
+    timestamp = datetime.datetime(2014, 5, 8, 9, 0, 0, tzinfo=tzutc())
+    content_blocks = []
+    for i in range(num_blocks):
+        content_blocks.append(tm11.ContentBlock(
+            content_binding=tm11.ContentBinding(CB_STIX_XML_111),
+            content=STIX_CONTENT % (i, i),
+            timestamp_label=timestamp + datetime.timedelta(seconds=i),
+            message='Block %s' % i))
+
+    return tm11.PollResponse(
+        message_id=tm11.generate_message_id(),
+        in_response_to=tm11.generate_message_id(),
+        collection_name='benchmark',
+        more=False,
+        result_part_number=1,
+        record_count=tm11.RecordCount(num_blocks),
+        content_blocks=content_blocks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TAXII 1.1 Poll Response parse benchmark')
+    parser.add_argument('--blocks', type=int, default=10000, help='Number of Content Blocks. Defaults to 10000.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs. Defaults to 3.')
+    args = parser.parse_args()
+
+    xml = make_poll_response(args.blocks).to_xml()
+
+    def run():
+        tm11.get_message_from_xml(xml)
+
+    best = min(timeit.repeat(run, number=1, repeat=args.repeat))
+    print('Poll Response: %s Content Blocks, %.1f MB' % (args.blocks, len(xml) / 1e6))
+    print('get_message_from_xml: best of %s = %.3fs (%.0f blocks/s, %.1f MB/s)'
+          % (args.repeat, best, args.blocks / best, len(xml) / 1e6 / best))
+
+
+if __name__ == '__main__':
+    main()
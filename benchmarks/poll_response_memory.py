@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2017, The MITRE Corporation
+# For license information, see the LICENSE.txt file
+
+"""
+Measures how much memory a large parsed TAXII 1.1 Poll Response takes.
+
+Usage:
+    python benchmarks/poll_response_memory.py [--blocks 100000]
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import tracemalloc
+
+import libtaxii.messages_11 as tm11
+
+from parse_poll_response import make_poll_response
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TAXII 1.1 Poll Response memory benchmark')
+    parser.add_argument('--blocks', type=int, default=100000, help='Number of Content Blocks. Defaults to 100000.')
+    args = parser.parse_args()
+
+    xml = make_poll_response(args.blocks).to_xml()
+    gc.collect()
+
+    tracemalloc.start()
+    poll_response = tm11.get_message_from_xml(xml)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # lxml allocates the parsed trees outside of the Python allocator, so this
+    # only counts the Python objects (messages, Content Blocks, bindings, ...)
+    print('Poll Response: %s Content Blocks, %.1f MB' % (len(poll_response.content_blocks), len(xml) / 1e6))
+    print('Python heap: %.1f MB retained (%.0f bytes/block), %.1f MB peak'
+          % (current / 1e6, float(current) / args.blocks, peak / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2017, The MITRE Corporation
+# For license information, see the LICENSE.txt file
+
+"""
+Measures how fast a large TAXII 1.1 Poll Response is written as JSON, with
+to_json() and with write_json() and each available JSON encoder.
+
+Usage:
+    python benchmarks/write_json.py [--blocks 10000] [--repeat 3]
+"""
+
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import timeit
+
+from libtaxii.common import set_json_dumps
+
+from parse_poll_response import make_poll_response
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TAXII 1.1 Poll Response JSON benchmark')
+    parser.add_argument('--blocks', type=int, default=10000, help='Number of Content Blocks. Defaults to 10000.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs. Defaults to 3.')
+    args = parser.parse_args()
+
+    poll_response = make_poll_response(args.blocks)
+
+    def time(run):
+        return min(timeit.repeat(run, number=1, repeat=args.repeat))
+
+    print('Poll Response: %s Content Blocks' % args.blocks)
+    print('to_json: best of %s = %.3fs' % (args.repeat, time(poll_response.to_json)))
+
+    encoders = [('default', None), ('json', json.dumps)]
+    try:
+        import orjson
+        encoders.append(('orjson', orjson.dumps))
+    except ImportError:
+        pass
+
+    for name, json_dumps in encoders:
+        set_json_dumps(json_dumps)
+        best = time(lambda: poll_response.write_json(io.BytesIO()))
+        print('write_json (%s): best of %s = %.3fs' % (name, args.repeat, best))
+    set_json_dumps()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,9 @@
 The main libtaxii module
 """
 
+import codecs
+import functools
+
 import six
 from six.moves import urllib
 
@@ -49,6 +52,128 @@ def get_message_from_http_response(http_response, in_response_to):
         raise ValueError('Unsupported response type: %s.' % http_response.__class__.__name__)
 
 
+def _get_message_from_binary(body, encoding):
+    """Parse a message in the libtaxii binary Message Binding. The binding
+    has no text to decode, so ``encoding`` is ignored."""
+    return tm11.get_message_from_binary(body)
+
+
+# Parsers for the supported Message Bindings, by X-TAXII-Content-Type
+_MESSAGE_PARSERS = {
+    VID_TAXII_XML_10: tm10.get_message_from_xml,
+    VID_TAXII_XML_11: tm11.get_message_from_xml,
+    VID_CERT_EU_JSON_10: tm10.get_message_from_json,
+    VID_LIBTAXII_BINARY_11: _get_message_from_binary,
+}
+
+
+def _get_charset(params):
+    """Return the charset of a parsed Content-Type header, or UTF-8 if it is
+    missing or not one that Python knows."""
+    charset = params.get('charset', 'utf-8')
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        return 'utf-8'
+    return charset
+
+
+def _get_message_from_body(taxii_content_type, response_body, encoding):
+    """Parse the raw bytes of an HTTP response body into a TAXII message.
+
+    The body is handed to the parser undecoded, so that UTF-8 XML can be
+    parsed by lxml without an intermediate unicode copy.
+    """
+    parser = _MESSAGE_PARSERS.get(taxii_content_type)
+    if parser is None:
+        raise ValueError('Unsupported X-TAXII-Content-Type: %s' % taxii_content_type)
+
+    return parser(response_body, encoding)
+
+
+def _read_body(http_response, content_encoding):
+    """Read the whole body of an HTTP response, decompressing it if it has a
+    supported Content-Encoding.
+
+    The :py:class:`libtaxii.clients.CompressionStats` of a compressed body
+    are set as ``http_response.compression_stats``.
+    """
+    if content_encoding is not None:
+        content_encoding = content_encoding.strip().lower()
+    if content_encoding not in tc.SUPPORTED_CONTENT_ENCODINGS:
+        return http_response.read()
+
+    reader = tc._DecompressingReader(http_response, content_encoding)
+    body = reader.read()
+    http_response.compression_stats = reader.stats
+    return body
+
+
+def iter_message_from_http_response(http_response, in_response_to, detach_content=True):
+    """Incrementally create a TAXII message from an HTTP response, as its
+    body is received.
+
+    The response body is parsed in chunks as they arrive, so parsing
+    overlaps with the download. This works like
+    :py:func:`libtaxii.messages_11.iter_poll_response`: for a Poll
+    Response or Inbox Message with an XML Message Binding, the first item
+    yielded is the message with an empty ``content_blocks`` list, carrying
+    the header fields, and every following item is a Content Block. The
+    message is available as soon as the elements before the first Content
+    Block have arrived. Messages with the CERT EU JSON Message Binding are
+    parsed the same way, by
+    :py:func:`libtaxii.messages_10.iter_poll_response_json`. On Python 2,
+    where HTTP responses have no ``read1()``, each chunk is only parsed once
+    it has arrived in full.
+
+    Any other message is yielded as the only item, as created by
+    :py:func:`get_message_from_http_response`.
+
+    Args:
+        http_response: The HTTP response to parse (any response type
+            supported by :py:func:`get_message_from_http_response`)
+        in_response_to (str): the default value for in_response_to
+        detach_content (bool): Whether to move the XML content of each
+            Content Block into a document of its own (see
+            :py:meth:`libtaxii.messages_11.ContentBlock.detach`). Defaults
+            to True.
+
+    Example:
+        .. code-block:: python
+
+            items = libtaxii.iter_message_from_http_response(http_response, poll_request.message_id)
+            poll_response = next(items)
+            for content_block in items:
+                handle(content_block)
+    """
+    info = http_response.info() if hasattr(http_response, 'info') else http_response
+    get_header = getattr(info, 'getheader', None) or info.get
+    taxii_content_type = get_header('X-TAXII-Content-Type')
+
+    if taxii_content_type == VID_TAXII_XML_11:
+        iter_poll_response = functools.partial(tm11.iter_poll_response, detach_content=detach_content)
+    elif taxii_content_type == VID_TAXII_XML_10:
+        iter_poll_response = functools.partial(tm10.iter_poll_response, detach_content=detach_content)
+    elif taxii_content_type == VID_CERT_EU_JSON_10:
+        _, params = cgi.parse_header(get_header('Content-Type') or '')
+        iter_poll_response = functools.partial(tm10.iter_poll_response_json,
+                                               encoding=_get_charset(params))
+    else:  # Not TAXII, or a binding that can't be parsed incrementally
+        yield get_message_from_http_response(http_response, in_response_to)
+        return
+
+    source = http_response
+    content_encoding = get_header('Content-Encoding')
+    if content_encoding is not None:
+        content_encoding = content_encoding.strip().lower()
+    if content_encoding in tc.SUPPORTED_CONTENT_ENCODINGS:
+        source = tc._DecompressingReader(http_response, content_encoding)
+        http_response.compression_stats = source.stats
+
+    for item in iter_poll_response(source):
+        yield item
+
+
 def get_message_from_urllib2_httperror(http_response, in_response_to):
     """ This function should not be called by libtaxii users directly. """
     info = http_response.info()
@@ -56,24 +181,20 @@ def get_message_from_urllib2_httperror(http_response, in_response_to):
     if hasattr(info, 'getheader'):
         taxii_content_type = info.getheader('X-TAXII-Content-Type')
         _, params = cgi.parse_header(info.getheader('Content-Type'))
+        content_encoding = info.getheader('Content-Encoding')
     else:
         taxii_content_type = info.get('X-TAXII-Content-Type')
         _, params = cgi.parse_header(info.get('Content-Type'))
+        content_encoding = info.get('Content-Encoding')
 
-    encoding = params.get('charset', 'utf-8')
-    response_message = six.ensure_text(http_response.read(), errors='replace')
+    encoding = _get_charset(params)
+    response_body = _read_body(http_response, content_encoding)
 
     if taxii_content_type is None:
-        m = str(http_response) + '\r\n' + str(http_response.info()) + '\r\n' + response_message
+        m = str(http_response) + '\r\n' + str(http_response.info()) + '\r\n' + six.ensure_text(response_body, errors='replace')
         return tm11.StatusMessage(message_id='0', in_response_to=in_response_to, status_type=ST_FAILURE, message=m)
-    elif taxii_content_type == VID_TAXII_XML_10:  # It's a TAXII XML 1.0 message
-        return tm10.get_message_from_xml(response_message, encoding)
-    elif taxii_content_type == VID_TAXII_XML_11:  # It's a TAXII XML 1.1 message
-        return tm11.get_message_from_xml(response_message, encoding)
-    elif taxii_content_type == VID_CERT_EU_JSON_10:
-        return tm10.get_message_from_json(response_message, encoding)
-    else:
-        raise ValueError('Unsupported X-TAXII-Content-Type: %s' % taxii_content_type)
+
+    return _get_message_from_body(taxii_content_type, response_body, encoding)
 
 
 def get_message_from_urllib_addinfourl(http_response, in_response_to):
@@ -83,12 +204,14 @@ def get_message_from_urllib_addinfourl(http_response, in_response_to):
     if hasattr(info, 'getheader'):
         taxii_content_type = info.getheader('X-TAXII-Content-Type')
         _, params = cgi.parse_header(info.getheader('Content-Type'))
+        content_encoding = info.getheader('Content-Encoding')
     else:
         taxii_content_type = info.get('X-TAXII-Content-Type')
         _, params = cgi.parse_header(info.get('Content-Type'))
+        content_encoding = info.get('Content-Encoding')
 
-    encoding = params.get('charset', 'utf-8')
-    response_message = six.ensure_text(http_response.read(), errors='replace')
+    encoding = _get_charset(params)
+    response_body = _read_body(http_response, content_encoding)
 
     if taxii_content_type is None:  # Treat it as a Failure Status Message, per the spec
 
@@ -97,20 +220,13 @@ def get_message_from_urllib_addinfourl(http_response, in_response_to):
         for k, v in header_dict:
             message.append(k + ': ' + v + '\r\n')
         message.append('\r\n')
-        message.append(response_message)
+        message.append(six.ensure_text(response_body, errors='replace'))
 
         m = ''.join(message)
 
         return tm11.StatusMessage(message_id='0', in_response_to=in_response_to, status_type=ST_FAILURE, message=m)
 
-    elif taxii_content_type == VID_TAXII_XML_10:  # It's a TAXII XML 1.0 message
-        return tm10.get_message_from_xml(response_message, encoding)
-    elif taxii_content_type == VID_TAXII_XML_11:  # It's a TAXII XML 1.1 message
-        return tm11.get_message_from_xml(response_message, encoding)
-    elif taxii_content_type == VID_CERT_EU_JSON_10:
-        return tm10.get_message_from_json(response_message, encoding)
-    else:
-        raise ValueError('Unsupported X-TAXII-Content-Type: %s' % taxii_content_type)
+    return _get_message_from_body(taxii_content_type, response_body, encoding)
 
 
 def get_message_from_httplib_http_response(http_response, in_response_to):
@@ -118,12 +234,14 @@ def get_message_from_httplib_http_response(http_response, in_response_to):
     if hasattr(http_response, 'getheader'):
         taxii_content_type = http_response.getheader('X-TAXII-Content-Type')
         _, params = cgi.parse_header(http_response.getheader('Content-Type'))
+        content_encoding = http_response.getheader('Content-Encoding')
     else:
         taxii_content_type = http_response.get('X-TAXII-Content-Type')
         _, params = cgi.parse_header(http_response.get('Content-Type'))
+        content_encoding = http_response.get('Content-Encoding')
 
-    encoding = params.get('charset', 'utf-8')
-    response_message = six.ensure_text(http_response.read(), errors='replace')
+    encoding = _get_charset(params)
+    response_body = _read_body(http_response, content_encoding)
 
     if taxii_content_type is None:  # Treat it as a Failure Status Message, per the spec
 
@@ -132,15 +250,10 @@ def get_message_from_httplib_http_response(http_response, in_response_to):
         for k, v in header_tuples:
             message.append(k + ': ' + v + '\r\n')
         message.append('\r\n')
-        message.append(response_message)
+        message.append(six.ensure_text(response_body, errors='replace'))
 
         m = ''.join(message)
 
         return tm11.StatusMessage(message_id='0', in_response_to=in_response_to, status_type=ST_FAILURE, message=m)
 
-    elif taxii_content_type == VID_TAXII_XML_10:  # It's a TAXII XML 1.0 message
-        return tm10.get_message_from_xml(response_message, encoding)
-    elif taxii_content_type == VID_TAXII_XML_11:  # It's a TAXII XML 1.1 message
-        return tm11.get_message_from_xml(response_message, encoding)
-    else:
-        raise ValueError('Unsupported X-TAXII-Content-Type: %s' % taxii_content_type)
+    return _get_message_from_body(taxii_content_type, response_body, encoding)
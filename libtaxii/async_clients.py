@@ -0,0 +1,530 @@
+# Copyright (c) 2017, The MITRE Corporation
+# For license information, see the LICENSE.txt file
+
+"""
+asyncio TAXII Clients
+
+This module requires Python 3.5 or later.
+"""
+import asyncio
+import cgi
+import collections
+import io
+import socket
+
+from six.moves import urllib
+
+import libtaxii
+import libtaxii.messages_10 as tm10
+import libtaxii.messages_11 as tm11
+from libtaxii.clients import (SUPPORTED_CONTENT_ENCODINGS, HttpClient, StatusMessageError, _DecompressingReader,
+                              _is_streamed_body, get_ssl_context)
+from libtaxii.common import IncrementalMessageParser
+from libtaxii.constants import *
+
+# Response bodies smaller than this are decompressed and parsed on the event
+# loop; handing them to a worker thread would cost more than parsing them.
+_EXECUTOR_THRESHOLD = 64 * 1024
+
+# The most bytes of a response body read at a time
+_READ_SIZE = 64 * 1024
+
+# Message modules by the XML Message Bindings whose Poll Responses are parsed
+# as they arrive
+_INCREMENTAL_BINDINGS = {
+    VID_TAXII_XML_10: tm10,
+    VID_TAXII_XML_11: tm11,
+}
+
+
+class AsyncHttpResponse(object):
+
+    """A fully read HTTP response returned by
+    :py:meth:`AsyncHttpClient.call_taxii_service2`.
+
+    :param int status: The HTTP status code.
+    :param str reason: The HTTP reason phrase.
+    :param list headers: ``(name, value)`` tuples, in the order received.
+    :param bytes body: The response body, as received.
+
+    If the body is compressed, :py:meth:`AsyncHttpClient.get_message_from_response`
+    sets a ``compression_stats`` attribute
+    (:py:class:`libtaxii.clients.CompressionStats`).
+    """
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def getheader(self, name, default=None):
+        """Return the value of the named header, or ``default``."""
+        name = name.lower()
+        for k, v in self.headers:
+            if k.lower() == name:
+                return v
+        return default
+
+    def getheaders(self):
+        return list(self.headers)
+
+
+class AsyncHttpClient(HttpClient):
+
+    """An asyncio version of :py:class:`libtaxii.clients.HttpClient`.
+
+    Authentication, proxy and server verification settings are configured
+    the same way as for :py:class:`libtaxii.clients.HttpClient`. Requests
+    are made over asyncio streams, one connection per request, and large
+    responses are parsed in ``executor`` (the event loop's default executor
+    if None) so that they don't block the event loop. Poll Responses in an
+    XML Message Binding are instead parsed in ``executor`` a piece at a
+    time as they arrive (see :py:meth:`poll_content_blocks`).
+
+    :param executor: The ``concurrent.futures.Executor`` used to parse
+        responses.
+
+    Example:
+        .. code-block:: python
+
+            client = AsyncHttpClient()
+            discovery_response = await client.send_taxii_message(
+                'hailataxii.com', '/taxii-discovery-service/', tm11.DiscoveryRequest(generate_message_id()))
+
+            async for content_block in client.poll_content_blocks(host, '/taxii-data', poll_request):
+                print(content_block.content)
+    """
+
+    def __init__(self, auth_type=HttpClient.AUTH_NONE, auth_credentials=None, use_https=False, executor=None):
+        super(AsyncHttpClient, self).__init__(auth_type, auth_credentials, use_https)
+        self.executor = executor
+
+    async def _open_connection(self, config, host, port):
+        scheme = 'https' if config.use_https else 'http'
+        proxy = self._get_proxy(config, scheme, host)
+
+        if not config.use_https:
+            if proxy:
+                return (await asyncio.open_connection(*proxy)), True
+            return (await asyncio.open_connection(host, port)), False
+
+        key_file, cert_file, key_password = self._get_cert(config) or (None, None, None)
+        ssl_context = get_ssl_context(config.verify_server, config.ca_file, cert_file, key_file, key_password)
+        if not proxy:
+            return (await asyncio.open_connection(host, port, ssl=ssl_context, server_hostname=host)), False
+
+        # Tunnel through the proxy with CONNECT, then start TLS on that socket
+        loop = asyncio.get_event_loop()
+        sock = await _connect_socket(loop, proxy)
+        try:
+            await loop.sock_sendall(sock, ('CONNECT %s:%s HTTP/1.1\r\nHost: %s:%s\r\n\r\n'
+                                           % (host, port, host, port)).encode('latin-1'))
+            reply = b''
+            while b'\r\n\r\n' not in reply:
+                data = await loop.sock_recv(sock, 4096)
+                if not data:
+                    raise OSError('Proxy closed the connection')
+                reply += data
+            status_line = reply.split(b'\r\n', 1)[0].decode('latin-1')
+            if status_line.split(None, 2)[1] != '200':
+                raise OSError('Tunnel connection failed: %s' % status_line)
+            streams = await asyncio.open_connection(sock=sock, ssl=ssl_context, server_hostname=host)
+        except BaseException:
+            sock.close()
+            raise
+        return streams, False
+
+    async def _send_request(self, host, path, message_binding, post_data, port=None, get_params_dict=None,
+                            content_type=None, headers=None, user_agent=None):
+        """Send a request, and read the status line and headers of the response.
+
+        :return: A ``(response, body, writer)`` tuple: the
+            :py:class:`AsyncHttpResponse` (without its body), a
+            ``_BodyReader`` for the body, and the ``StreamWriter`` of the
+            connection, which the caller must close.
+        """
+        config = self._get_config()
+        header_dict = self._get_header_dict(config, message_binding, content_type, headers, user_agent)
+
+        if port is None:  # If the caller did not specify a port, use the default
+            port = 443 if config.use_https else 80
+
+        if get_params_dict is not None:
+            path += '?' + urllib.parse.urlencode(get_params_dict)
+
+        if isinstance(post_data, str):
+            post_data = post_data.encode('utf-8')
+        post_data = self._encode_body(config, post_data, header_dict)
+
+        (reader, writer), absolute_uri = await self._open_connection(config, host, port)
+        try:
+            if absolute_uri:  # Plain HTTP requests through a proxy use the absolute URL
+                path = 'http://%s:%s%s' % (host, port, path)
+
+            lines = ['POST %s HTTP/1.1' % path,
+                     'Host: %s:%s' % (host, port),
+                     'Connection: close']
+            streamed = _is_streamed_body(post_data)
+            if not streamed:
+                lines.append('Content-Length: %s' % len(post_data))
+            for k, v in header_dict.items():
+                if isinstance(v, bytes):
+                    v = v.decode('latin-1')
+                lines.append('%s: %s' % (k, v))
+            lines.append('\r\n')
+            writer.write('\r\n'.join(lines).encode('latin-1'))
+            if not streamed:
+                writer.write(post_data)
+            else:
+                chunked = 'Transfer-Encoding' in header_dict
+                for chunk in post_data:
+                    if chunked:
+                        writer.write(b'%X\r\n' % len(chunk))
+                    writer.write(chunk)
+                    if chunked:
+                        writer.write(b'\r\n')
+                    # Wait for each chunk to be sent, so only one is buffered
+                    await writer.drain()
+                if chunked:
+                    writer.write(b'0\r\n\r\n')
+            await writer.drain()
+
+            response = await _read_response_head(reader)
+        except BaseException:
+            writer.close()
+            raise
+        return response, _BodyReader(reader, response), writer
+
+    async def _request(self, *args, **kwargs):
+        response, body, writer = await self._send_request(*args, **kwargs)
+        try:
+            response.body = await body.read_all()
+        finally:
+            writer.close()
+        return response
+
+    async def call_taxii_service2(self, host, path, message_binding, post_data, port=None, get_params_dict=None,
+                                  content_type=None, headers=None, user_agent=None, timeout=None):
+        """Call a TAXII service.
+
+        The arguments are the same as for
+        :py:meth:`libtaxii.clients.HttpClient.call_taxii_service2`.
+        ``timeout`` applies to the whole request, including reading the
+        response. A streamed ``post_data`` is read on the event loop, so
+        it should not block for long.
+
+        :return: :class:`AsyncHttpResponse`, for any HTTP status code
+        """
+        return await asyncio.wait_for(self._request(host, path, message_binding, post_data, port, get_params_dict,
+                                                    content_type, headers, user_agent), timeout)
+
+    async def get_message_from_response(self, response, in_response_to):
+        """Create a TAXII message from an :py:class:`AsyncHttpResponse`.
+
+        This behaves like :py:func:`libtaxii.get_message_from_http_response`.
+        """
+        if len(response.body) < _EXECUTOR_THRESHOLD:
+            return self._get_message_from_response(response, in_response_to)
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, self._get_message_from_response, response, in_response_to)
+
+    def _get_message_from_response(self, response, in_response_to):
+        body = response.body
+        content_encoding = (response.getheader('Content-Encoding') or '').strip().lower()
+        if content_encoding in SUPPORTED_CONTENT_ENCODINGS:
+            reader = _DecompressingReader(io.BytesIO(body), content_encoding)
+            body = reader.read()
+            response.compression_stats = reader.stats
+
+        taxii_content_type = response.getheader('X-TAXII-Content-Type')
+        if taxii_content_type is None:  # Treat it as a Failure Status Message, per the spec
+            message = []
+            for k, v in response.getheaders():
+                message.append(k + ': ' + v + '\r\n')
+            message.append('\r\n')
+            message.append(body.decode('utf-8', 'replace'))
+
+            m = ''.join(message)
+
+            return tm11.StatusMessage(message_id='0', in_response_to=in_response_to, status_type=ST_FAILURE, message=m)
+
+        _, params = cgi.parse_header(response.getheader('Content-Type', ''))
+        encoding = libtaxii._get_charset(params)
+        return libtaxii._get_message_from_body(taxii_content_type, body, encoding)
+
+    async def send_taxii_message(self, host, path, message, port=None, headers=None, user_agent=None,
+                                 timeout=None):
+        """Send a TAXII message and return the parsed response message.
+
+        :param message: A :py:mod:`libtaxii.messages_11` or
+            :py:mod:`libtaxii.messages_10` message. It is sent with the
+            matching XML Message Binding.
+        :return: The TAXII message in the response. As with
+            :py:func:`libtaxii.get_message_from_http_response`, a response
+            that is not a TAXII message becomes a Failure Status Message.
+        """
+        response = await self.call_taxii_service2(host, path, message.version, message.to_xml(), port=port,
+                                                  headers=headers, user_agent=user_agent, timeout=timeout)
+        return await self.get_message_from_response(response, message.message_id)
+
+    async def send_inbox_message(self, host, path, inbox_message, content_blocks=None, port=None, headers=None,
+                                 user_agent=None, timeout=None):
+        """Send an Inbox Message and return the parsed response message.
+
+        This behaves like :py:meth:`libtaxii.clients.HttpClient.send_inbox_message`:
+        the message is serialized one Content Block at a time while it is
+        sent. Content Blocks are serialized on the event loop.
+        """
+        body = inbox_message.iter_xml_chunks(content_blocks=content_blocks)
+        response = await self.call_taxii_service2(host, path, inbox_message.version, body, port=port,
+                                                  headers=headers, user_agent=user_agent, timeout=timeout)
+        return await self.get_message_from_response(response, inbox_message.message_id)
+
+    def poll_content_blocks(self, host, path, poll_request, port=None, headers=None, user_agent=None,
+                            timeout=None, detach_content=True):
+        """Send a Poll Request and iterate over the Content Blocks it returns.
+
+        A Poll Response in an XML Message Binding is parsed (in the
+        client's ``executor``) as it is received, so each Content Block is
+        returned as soon as it has arrived, and the whole response is never
+        held in memory. For TAXII
+        1.1, if the server splits the result into several parts, the
+        remaining parts are requested with Poll Fulfillment Requests as the
+        iteration reaches them.
+
+        Use it with ``async for``. A :py:class:`libtaxii.clients.StatusMessageError`
+        is raised if the server responds with a Status Message. Call
+        ``aclose()`` on the iterator to close the connection if the
+        iteration is stopped early.
+
+        :param poll_request: A :py:class:`libtaxii.messages_11.PollRequest` or
+            :py:class:`libtaxii.messages_10.PollRequest`.
+        :param float timeout: The timeout for sending each request and
+            receiving the response headers, and for each read of the
+            response body.
+        :param bool detach_content: Whether to move the XML content of each
+            Content Block into a document of its own as it is returned (see
+            :py:meth:`libtaxii.messages_11.ContentBlock.detach`).
+        """
+        return _ContentBlockIterator(self, host, path, poll_request,
+                                     dict(port=port, headers=headers, user_agent=user_agent), timeout,
+                                     detach_content)
+
+
+class _ContentBlockIterator(object):
+
+    """The asynchronous iterator returned by :py:meth:`AsyncHttpClient.poll_content_blocks`."""
+
+    def __init__(self, client, host, path, poll_request, kwargs, timeout=None, detach_content=True):
+        self.client = client
+        self.host = host
+        self.path = path
+        self.next_request = poll_request
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.detach_content = detach_content
+        # Parsed messages and Content Blocks that have not been handled yet
+        self.items = collections.deque()
+        # The response being parsed as it arrives
+        self.body = None
+        self.writer = None
+        self.parser = None
+        self.decompressor = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            if self.items:
+                item = self.items.popleft()
+                if isinstance(item, (tm10.ContentBlock, tm11.ContentBlock)):
+                    return item
+                self._handle_message(item)
+                continue
+
+            if self.body is not None:
+                await self._read_body()
+                continue
+
+            if self.next_request is None:
+                raise StopAsyncIteration
+
+            request, self.next_request = self.next_request, None
+            await self._send(request)
+
+    async def aclose(self):
+        """Stop the iteration, and close the connection of the response
+        being read, if any."""
+        self.next_request = None
+        self.items.clear()
+        self._close()
+
+    def _close(self):
+        self.body = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def _send(self, request):
+        response, body, writer = await asyncio.wait_for(
+            self.client._send_request(self.host, self.path, request.version, request.to_xml(), **self.kwargs),
+            self.timeout)
+        self.body, self.writer = body, writer
+
+        module = _INCREMENTAL_BINDINGS.get(response.getheader('X-TAXII-Content-Type'))
+        if module is None:  # Not TAXII, or a binding that can't be parsed as it arrives
+            try:
+                response.body = await asyncio.wait_for(body.read_all(), self.timeout)
+            finally:
+                self._close()
+            message = await self.client.get_message_from_response(response, request.message_id)
+            self.items.append(message)
+            if self.detach_content and message.message_type == MSG_POLL_RESPONSE:
+                for content_block in message.content_blocks:
+                    content_block.detach()
+            return
+
+        self.parser = IncrementalMessageParser(module._ITER_MESSAGE_CLASSES, module.ContentBlock,
+                                               module._get_message_from_etree, self.detach_content)
+        self.decompressor = None
+        content_encoding = (response.getheader('Content-Encoding') or '').strip().lower()
+        if content_encoding in SUPPORTED_CONTENT_ENCODINGS:
+            self.decompressor = _DecompressingReader(None, content_encoding)
+
+    async def _read_body(self):
+        try:
+            data = await asyncio.wait_for(self.body.read(), self.timeout)
+            # Any piece of the body may complete a large Content Block, so
+            # every piece is parsed in the executor
+            items = await asyncio.get_event_loop().run_in_executor(self.client.executor, self._parse, data)
+            if not data:
+                self._close()
+            self.items.extend(items)
+        except BaseException:
+            self._close()
+            raise
+
+    def _parse(self, data):
+        """Decompress and parse the next piece of the response body (empty
+        at the end), and return the items that have become complete."""
+        end = not data
+        if self.decompressor is not None:
+            data = self.decompressor.feed(data)
+        items = []
+        if data:
+            items.extend(self.parser.feed(data))
+        if end:
+            items.extend(self.parser.close())
+        return items
+
+    def _handle_message(self, message):
+        if message.message_type != MSG_POLL_RESPONSE:
+            self.next_request = None
+            self._close()
+            if message.message_type == MSG_STATUS_MESSAGE:
+                raise StatusMessageError(message)
+            raise ValueError('Unexpected response to a Poll Request: %s' % message.message_type)
+
+        # The Content Blocks of a message that was parsed as a whole
+        self.items.extend(message.content_blocks)
+        if isinstance(message, tm11.PollResponse) and message.more:
+            self.next_request = tm11.PollFulfillmentRequest(
+                message_id=tm11.generate_message_id(),
+                collection_name=message.collection_name,
+                result_id=message.result_id,
+                result_part_number=message.result_part_number + 1)
+
+
+async def _connect_socket(loop, address):
+    """Open a non-blocking TCP socket to a ``(host, port)`` address, trying
+    each IPv4 or IPv6 address that the host resolves to."""
+    error = None
+    for family, type_, proto, _, sockaddr in await loop.getaddrinfo(address[0], address[1],
+                                                                     type=socket.SOCK_STREAM):
+        sock = socket.socket(family, type_, proto)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, sockaddr)
+        except OSError as e:
+            sock.close()
+            error = e
+            continue
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+    raise error or OSError('Could not resolve %s' % address[0])
+
+
+async def _read_response_head(reader):
+    """Read the status line and headers of an HTTP response.
+
+    :return: An :py:class:`AsyncHttpResponse` with an empty body.
+    """
+    status_line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+    parts = status_line.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+        raise ValueError('Invalid HTTP status line: %r' % status_line)
+    status = int(parts[1])
+    reason = parts[2] if len(parts) > 2 else ''
+
+    headers = []
+    while True:
+        line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers.append((name.strip(), value.strip()))
+    return AsyncHttpResponse(status, reason, headers, b'')
+
+
+class _BodyReader(object):
+
+    """Reads the body of an HTTP response from a ``StreamReader`` as it arrives."""
+
+    def __init__(self, reader, response):
+        self.reader = reader
+        self.chunked = (response.getheader('Transfer-Encoding') or '').lower() == 'chunked'
+        length = response.getheader('Content-Length')
+        # The bytes left in the body (or in the current chunk, if chunked);
+        # None if the body ends when the connection is closed
+        self.remaining = None if self.chunked or length is None else int(length)
+        self.done = False
+
+    async def read(self):
+        """Return the next piece of the body, or ``b''`` at its end."""
+        if self.done:
+            return b''
+
+        if self.chunked and not self.remaining:
+            if self.remaining == 0:
+                await self.reader.readline()  # The end of the previous chunk
+            self.remaining = int((await self.reader.readline()).split(b';', 1)[0], 16)
+            if self.remaining == 0:
+                while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):  # Trailers
+                    pass
+        if self.remaining == 0:
+            self.done = True
+            return b''
+
+        data = await self.reader.read(_READ_SIZE if self.remaining is None else min(self.remaining, _READ_SIZE))
+        if self.remaining is None:
+            self.done = not data
+        elif not data:
+            raise asyncio.IncompleteReadError(b'', self.remaining)
+        else:
+            self.remaining -= len(data)
+            if not self.chunked and self.remaining == 0:
+                self.done = True
+        return data
+
+    async def read_all(self):
+        """Return the rest of the body."""
+        chunks = []
+        while True:
+            data = await self.read()
+            if not data:
+                return b''.join(chunks)
+            chunks.append(data)
@@ -0,0 +1,199 @@
+# Copyright (c) 2017, The MITRE Corporation
+# For license information, see the LICENSE.txt file
+
+"""
+The libtaxii binary Message Binding.
+"""
+import datetime
+import struct
+
+import six
+
+from libtaxii.common import TAXIIBase, parse_datetime_string
+
+# The libtaxii binary Message Binding (VID_LIBTAXII_BINARY_11) encodes the
+# dict representation of a message (see TAXIIBase.to_dict). Each value is a
+# one-byte type tag, followed by:
+#   N, T, F: nothing (None, True, False)
+#   I: a signed 64-bit integer; D: a 64-bit float
+#   S: a 32-bit length and that many bytes of UTF-8 text
+#   B: a 32-bit length and that many raw bytes (e.g., Content Block content)
+#   L: a 32-bit item count and the items
+#   M: a 32-bit entry count and a key and a value for each entry
+#   K: a 32-bit index into the text dict keys of the message, in the order
+#      they first appear (as S values), so repeated keys are not repeated
+#   A: a datetime, as an S value holding its ISO 8601 string
+#   O: a TAXII object that to_dict() left as it is (e.g., a ContentBinding
+#      in a Status Detail), as an S value holding its class name and an M
+#      value holding its dict representation
+# All numbers are big-endian. A message starts with _BINARY_MAGIC.
+_BINARY_MAGIC = b'TXB\x01'
+_UINT32 = struct.Struct('>I')
+_INT64 = struct.Struct('>q')
+_DOUBLE = struct.Struct('>d')
+
+# The most levels of L, M, A and O values that are decoded inside each other
+_BINARY_MAX_DEPTH = 100
+
+_RecursionError = getattr(six.moves.builtins, 'RecursionError', RuntimeError)
+
+
+def encode_binary(value):
+    """Encode a dict representation of a message (see ``to_dict()``) in the
+    libtaxii binary Message Binding.
+
+    libtaxii users should not need to use this function directly.
+    """
+    encoder = _BinaryEncoder()
+    encoder.encode(value)
+    return b''.join(encoder.parts)
+
+
+def decode_binary(data, object_types=None):
+    """Decode a value encoded with :py:func:`encode_binary`.
+
+    libtaxii users should not need to use this function directly.
+
+    :param object_types: A dict of class name to the ``from_dict`` function
+        of each TAXII class that may be found in the value.
+    :raises ValueError: If ``data`` is not a complete, valid encoding, or
+        is nested more than ``_BINARY_MAX_DEPTH`` levels deep.
+    """
+    if not data.startswith(_BINARY_MAGIC):
+        raise ValueError('Not a message in the libtaxii binary Message Binding')
+    decoder = _BinaryDecoder(data, object_types)
+    try:
+        value = decoder.decode()
+    except (struct.error, IndexError, KeyError, TypeError, AttributeError, OverflowError, _RecursionError):
+        # e.g., an unhashable map key, a TAXII object with missing fields, or
+        # a timestamp too large for a datetime
+        raise ValueError('Truncated or invalid binary message')
+    if decoder.pos != len(data):
+        raise ValueError('Extra data after the binary message')
+    return value
+
+
+class _BinaryEncoder(object):
+
+    def __init__(self):
+        self.parts = [_BINARY_MAGIC]
+        self._keys = {}
+
+    def encode(self, value):
+        parts = self.parts
+        if isinstance(value, six.text_type):
+            data = value.encode('utf-8')
+            parts.append(b'S' + _UINT32.pack(len(data)))
+            parts.append(data)
+        elif isinstance(value, six.binary_type):
+            parts.append(b'B' + _UINT32.pack(len(value)))
+            parts.append(value)
+        elif isinstance(value, dict):
+            parts.append(b'M' + _UINT32.pack(len(value)))
+            keys = self._keys
+            for k, v in six.iteritems(value):
+                index = keys.get(k)
+                if index is not None:
+                    parts.append(b'K' + _UINT32.pack(index))
+                else:
+                    if isinstance(k, six.text_type):
+                        keys[k] = len(keys)
+                    self.encode(k)
+                self.encode(v)
+        elif isinstance(value, (list, tuple)):
+            parts.append(b'L' + _UINT32.pack(len(value)))
+            for item in value:
+                self.encode(item)
+        elif value is None:
+            parts.append(b'N')
+        elif value is True:
+            parts.append(b'T')
+        elif value is False:
+            parts.append(b'F')
+        elif isinstance(value, six.integer_types):
+            parts.append(b'I' + _INT64.pack(value))
+        elif isinstance(value, float):
+            parts.append(b'D' + _DOUBLE.pack(value))
+        elif isinstance(value, datetime.datetime):
+            parts.append(b'A')
+            self.encode(value.isoformat())
+        elif isinstance(value, TAXIIBase):
+            parts.append(b'O')
+            self.encode(type(value).__name__)
+            self.encode(value.to_dict())
+        else:
+            raise TypeError('Can not encode a %s in the binary Message Binding' % type(value).__name__)
+
+
+class _BinaryDecoder(object):
+
+    def __init__(self, data, object_types=None):
+        self.data = data
+        self.pos = len(_BINARY_MAGIC)
+        self._object_types = object_types or {}
+        self._keys = []
+
+    def _read_bytes(self):
+        start = self.pos + 4
+        self.pos = start + self._read_count(1)
+        return self.data[start:self.pos]
+
+    def _read_uint32(self):
+        value, = _UINT32.unpack_from(self.data, self.pos)
+        self.pos += 4
+        return value
+
+    def _read_count(self, item_size):
+        """Read a length or an item count, and check that the rest of the
+        data can hold that many items of at least ``item_size`` bytes, before
+        anything is allocated for them."""
+        count = self._read_uint32()
+        if count * item_size > len(self.data) - self.pos:
+            raise IndexError('Truncated value')
+        return count
+
+    def decode(self, depth=0):
+        if depth > _BINARY_MAX_DEPTH:
+            raise ValueError('Binary message is nested too deeply')
+        tag = self.data[self.pos:self.pos + 1]
+        self.pos += 1
+        if tag == b'S':
+            return self._read_bytes().decode('utf-8')
+        if tag == b'B':
+            return self._read_bytes()
+        if tag == b'M':
+            value = {}
+            keys = self._keys
+            # Each entry is at least a K tag and index, and a one-byte value
+            for _ in six.moves.range(self._read_count(2)):
+                if self.data[self.pos:self.pos + 1] == b'K':
+                    self.pos += 1
+                    k = keys[self._read_uint32()]
+                else:
+                    k = self.decode(depth + 1)
+                    if isinstance(k, six.text_type):
+                        keys.append(k)
+                value[k] = self.decode(depth + 1)
+            return value
+        if tag == b'L':
+            return [self.decode(depth + 1) for _ in six.moves.range(self._read_count(1))]
+        if tag == b'I':
+            value, = _INT64.unpack_from(self.data, self.pos)
+            self.pos += 8
+            return value
+        if tag == b'D':
+            value, = _DOUBLE.unpack_from(self.data, self.pos)
+            self.pos += 8
+            return value
+        if tag == b'A':
+            return parse_datetime_string(self.decode(depth + 1))
+        if tag == b'O':
+            name = self.decode(depth + 1)
+            d = self.decode(depth + 1)
+            if name not in self._object_types:
+                raise ValueError('Unknown type in binary message: %s' % name)
+            return self._object_types[name](d)
+        return _BINARY_CONSTANTS[tag]
+
+
+_BINARY_CONSTANTS = {b'N': None, b'T': True, b'F': False}
@@ -6,16 +6,84 @@ TAXII Clients
 """
 import sys
 import base64
+import collections
+import errno
+import io
+import os
 import socket
 import ssl
+import threading
+import time
 import warnings
+import zlib
 from libtaxii.constants import *
 import six
 from six.moves import urllib
 
 
+class StatusMessageError(Exception):
+
+    """Raised when a TAXII server answers with a Status Message where a
+    different response was expected.
+
+    :param status_message: The Status Message returned by the server.
+    """
+
+    def __init__(self, status_message):
+        super(StatusMessageError, self).__init__(
+            '%s: %s' % (status_message.status_type, status_message.message))
+        self.status_message = status_message
+
+
+class DecompressedSizeError(ValueError):
+
+    """Raised when a compressed HTTP response body decompresses to more than
+    the limit set with :py:func:`set_max_decompressed_size`.
+
+    :param max_size: The limit, in bytes.
+    """
+
+    def __init__(self, max_size):
+        super(DecompressedSizeError, self).__init__(
+            'The decompressed response body is larger than %s bytes' % max_size)
+        self.max_size = max_size
+
+
+# The settings of an HttpClient that a request is made with
+_ClientConfig = collections.namedtuple(
+    '_ClientConfig', ['use_https', 'auth_type', 'auth_credentials', 'proxy_string', 'verify_server', 'ca_file',
+                      'accept_compressed', 'compress_requests', 'accept_binary'])
+
+# Request bodies smaller than this are not worth compressing
+_COMPRESS_MIN_SIZE = 1024
+
+# The size of the blocks read from a file-like request body
+_BODY_BLOCK_SIZE = 64 * 1024
+
+# Older versions of httplib can only send a request body given as a string
+_CAN_STREAM_BODY = sys.version_info >= (3, 6)
+
+
+def _basic_auth_header(auth_credentials):
+    credentials = '{}:{}'.format(
+            auth_credentials['username'],
+            auth_credentials['password']
+        ).encode('utf-8')
+    return b'Basic ' + base64.b64encode(credentials)
+
+
 class HttpClient(object):
 
+    """A TAXII HTTP/HTTPS client.
+
+    An HttpClient can be shared by several threads. Each call takes a
+    snapshot of the client's settings when it starts, so changing the
+    settings with the ``set_*`` methods only affects calls made afterwards.
+    Calls do not change any global state, such as the ``urllib`` opener.
+    Assigning to the attributes directly instead of using the ``set_*``
+    methods is not thread-safe.
+    """
+
     # Constants for authentication types
     AUTH_NONE = 0  #: Do not offer any authentication credentials to the server
     AUTH_BASIC = 1  #: Offer HTTP Basic authentication credentials to the server
@@ -39,6 +107,7 @@ class HttpClient(object):
     HEADER_X_TAXII_SERVICES = 'x-taxii-services'
 
     def __init__(self, auth_type=AUTH_NONE, auth_credentials=None, use_https=False):
+        self._config_lock = threading.Lock()
         self.use_https = use_https
         self.auth_type = auth_type
         self.auth_credentials = {}
@@ -48,27 +117,22 @@ class HttpClient(object):
         self.proxy_string = None
         self.verify_server = False
         self.ca_file = None
+        self.accept_compressed = False
+        self.compress_requests = False
+        self.accept_binary = False
 
     def set_auth_type(self, auth_type):
         """Set the authentication type for this client.
 
         :param string auth_type: Must be one of :attr:`AUTH_NONE`, :attr:`AUTH_BASIC`, or :attr:`AUTH_CERT`
         """
-        # If this isn't a change, don't do anything
-        if self.auth_type == auth_type:
-            return
-
-        if auth_type == HttpClient.AUTH_NONE:
-            self.auth_type = HttpClient.AUTH_NONE
-        elif auth_type == HttpClient.AUTH_BASIC:
-            self.auth_type = HttpClient.AUTH_BASIC
-        elif auth_type == HttpClient.AUTH_CERT:
-            self.auth_type = HttpClient.AUTH_CERT
-        elif auth_type == HttpClient.AUTH_CERT_BASIC:
-            self.auth_type = HttpClient.AUTH_CERT_BASIC
-        else:
+        if auth_type not in (HttpClient.AUTH_NONE, HttpClient.AUTH_BASIC,
+                             HttpClient.AUTH_CERT, HttpClient.AUTH_CERT_BASIC):
             raise Exception('Invalid auth_type specified. Must be one of HttpClient AUTH_NONE, AUTH_BASIC, or AUTH_CERT')
 
+        with self._config_lock:
+            self.auth_type = auth_type
+
     def set_verify_server(self, verify_server=False, ca_file=None):
         """
         Tell libtaxii whether to verify the server's ssl certificate
@@ -79,17 +143,14 @@ class HttpClient(object):
         if verify_server and ca_file is None:
             raise ValueError('If verify_server is True, ca_file must not be None.')
 
-        self.verify_server = verify_server
-        self.ca_file = ca_file
+        with self._config_lock:
+            self.verify_server = verify_server
+            self.ca_file = ca_file
 
     @property
     def basic_auth_header(self):
         """Returns a Base64-encoded HTTP Basic Authorization Header."""
-        credentials = '{}:{}'.format(
-                self.auth_credentials['username'],
-                self.auth_credentials['password']
-            ).encode('utf-8')
-        return b'Basic ' + base64.b64encode(credentials)
+        return _basic_auth_header(self.auth_credentials)
 
     def set_proxy(self, proxy_string=None):
         """
@@ -97,20 +158,51 @@ class HttpClient(object):
 
         :param string proxy_string: Proxy address formatted like http://proxy.example.com:80. Set to :attr:`SYSTEM_PROXY` to use the system proxy; set to :attr:`NO_PROXY` to use no proxy.
         """
-        self.proxy_string = proxy_string
+        with self._config_lock:
+            self.proxy_string = proxy_string
+
+    def set_compression(self, accept_compressed=True, compress_requests=False):
+        """Set whether HTTP compression is used.
+
+        :param bool accept_compressed: Send an ``Accept-Encoding: gzip, deflate``
+            header, so the server may compress its responses.
+            :py:func:`libtaxii.get_message_from_http_response` decompresses them.
+        :param bool compress_requests: gzip request bodies (e.g., Inbox
+            Messages) of 1 KiB or more, and send them with
+            ``Content-Encoding: gzip``. Only enable this if the server accepts
+            compressed requests.
+        """
+        with self._config_lock:
+            self.accept_compressed = accept_compressed
+            self.compress_requests = compress_requests
+
+    def set_accept_binary(self, accept_binary=True):
+        """Set whether the client offers to receive responses in the libtaxii
+        binary Message Binding.
+
+        :param bool accept_binary: When a TAXII 1.1 XML message is sent, and
+            the ``Accept`` and ``X-TAXII-Accept`` headers are not given, list
+            :py:data:`VID_LIBTAXII_BINARY_11
+            <libtaxii.constants.VID_LIBTAXII_BINARY_11>` before the XML
+            Message Binding in them. A server that supports it may then
+            answer in the binary binding, which
+            :py:func:`libtaxii.get_message_from_http_response` parses; other
+            servers answer in XML as usual.
+        """
+        with self._config_lock:
+            self.accept_binary = accept_binary
 
     def set_use_https(self, bool_):
         """Indicate whether the HttpClient should use HTTP or HTTPs. The default is HTTP.
 
         :param bool bool: The new use_https value.
         """
-        if bool_ is True:
-            self.use_https = True
-        elif bool_ is False:
-            self.use_https = False
-        else:
+        if bool_ is not True and bool_ is not False:
             raise Exception('Invalid argument value. Must be a boolean value of \'True\' or \'False\'.')
 
+        with self._config_lock:
+            self.use_https = bool_
+
     def set_auth_credentials(self, auth_credentials_dict):
         """Set the authentication credentials used later when making a request.
 
@@ -122,19 +214,51 @@ class HttpClient(object):
             - {'username': 'abc', 'password': 'xyz'}
             - Or both, if both username/password and certificate based auth are used
         """
-        if self.auth_type == HttpClient.AUTH_NONE:
-            req_fields = []
-        elif self.auth_type == HttpClient.AUTH_BASIC:
-            req_fields = ['username', 'password']
-        elif self.auth_type == HttpClient.AUTH_CERT:
-            req_fields = ['key_file', 'cert_file']
-        elif self.auth_type == HttpClient.AUTH_CERT_BASIC:
-            req_fields = ['key_file', 'cert_file', 'username', 'password']
-
-        for k in req_fields:
-            if k not in auth_credentials_dict:
-                raise Exception('Invalid auth credentials. Field %s is not present' % k)
-        self.auth_credentials = auth_credentials_dict
+        with self._config_lock:
+            if self.auth_type == HttpClient.AUTH_NONE:
+                req_fields = []
+            elif self.auth_type == HttpClient.AUTH_BASIC:
+                req_fields = ['username', 'password']
+            elif self.auth_type == HttpClient.AUTH_CERT:
+                req_fields = ['key_file', 'cert_file']
+            elif self.auth_type == HttpClient.AUTH_CERT_BASIC:
+                req_fields = ['key_file', 'cert_file', 'username', 'password']
+
+            for k in req_fields:
+                if k not in auth_credentials_dict:
+                    raise Exception('Invalid auth credentials. Field %s is not present' % k)
+            self.auth_credentials = auth_credentials_dict
+
+    def _get_config(self):
+        """Return a snapshot of this client's settings for a request."""
+        with self._config_lock:
+            return _ClientConfig(self.use_https, self.auth_type, dict(self.auth_credentials),
+                                 self.proxy_string, self.verify_server, self.ca_file,
+                                 self.accept_compressed, self.compress_requests, self.accept_binary)
+
+    @staticmethod
+    def _get_cert(config):
+        """Return the (key_file, cert_file, key_password) to offer the server,
+        or None if certificate authentication is not used."""
+        if config.auth_type in (HttpClient.AUTH_CERT, HttpClient.AUTH_CERT_BASIC):
+            return (config.auth_credentials['key_file'], config.auth_credentials['cert_file'],
+                    config.auth_credentials.get('key_password'))
+        return None
+
+    def _get_proxy(self, config, scheme, host):
+        """Return the (host, port) of the proxy to use, or None."""
+        if config.proxy_string == HttpClient.NO_PROXY:
+            return None
+        if config.proxy_string is not None:
+            proxy_url = config.proxy_string
+        else:  # SYSTEM_PROXY
+            if urllib.request.proxy_bypass(host):
+                return None
+            proxy_url = urllib.request.getproxies().get(scheme)
+            if not proxy_url:
+                return None
+        parsed = urllib.parse.urlparse(proxy_url)
+        return parsed.hostname, parsed.port or 80
 
     def call_taxii_service(self, host, path, message_binding, post_data, port=None, get_params_dict=None):
         """ **DEPRECATED.** May be removed in the next version of `libtaxii`.
@@ -193,16 +317,8 @@ class HttpClient(object):
 
         return response
 
-    def call_taxii_service2(self, host, path, message_binding, post_data, port=None, get_params_dict=None,
-                            content_type=None, headers=None, user_agent=None, timeout=None):
-        """Call a TAXII service.
-
-        **Note:** this uses urllib2 instead of httplib, and therefore returns
-        a different kind of object than :func:`call_taxii_service`.
-
-        :return: :class:`urllib2.Response`
-        """
-
+    def _get_header_dict(self, config, message_binding, content_type=None, headers=None, user_agent=None):
+        """Build the HTTP headers for a TAXII request made with this client."""
         header_dict = {}
 
         if headers is not None:
@@ -218,7 +334,8 @@ class HttpClient(object):
 
         content_type_map = {VID_TAXII_XML_10: 'application/xml',
                             VID_TAXII_XML_11: 'application/xml',
-                            VID_CERT_EU_JSON_10: 'application/json'}
+                            VID_CERT_EU_JSON_10: 'application/json',
+                            VID_LIBTAXII_BINARY_11: 'application/octet-stream'}
 
         if content_type is not None:  # Set the content type to the user-provided value
             header_dict[HttpClient.HEADER_CONTENT_TYPE] = content_type
@@ -244,7 +361,8 @@ class HttpClient(object):
         #      Accept = Content-Type and
         #      X-TAXII-Accept = X-TAXII-Content-Type.
         #      This means that the client will only accept messages
-        #      in the same format that was sent.
+        #      in the same format that was sent. If the client accepts the
+        #      binary Message Binding, it is offered first for TAXII 1.1 XML.
         #
         # 5. Users of libtaxii that wish to accept everything should set the
         #    Accept header to '*/*'.
@@ -255,38 +373,105 @@ class HttpClient(object):
         if not accept_set and not x_taxii_accept_set:
             header_dict[HttpClient.HEADER_ACCEPT] = header_dict[HttpClient.HEADER_CONTENT_TYPE]
             header_dict[HttpClient.HEADER_X_TAXII_ACCEPT] = header_dict[HttpClient.HEADER_X_TAXII_CONTENT_TYPE]
+            if config.accept_binary and message_binding == VID_TAXII_XML_11:
+                header_dict[HttpClient.HEADER_ACCEPT] = '%s, %s' % (content_type_map[VID_LIBTAXII_BINARY_11],
+                                                                   header_dict[HttpClient.HEADER_ACCEPT])
+                header_dict[HttpClient.HEADER_X_TAXII_ACCEPT] = '%s, %s' % (VID_LIBTAXII_BINARY_11,
+                                                                           VID_TAXII_XML_11)
 
         # If the X-TAXII-Services header is not set by the user,
         # Attempt to use the library's default mapping
         services_map = {VID_TAXII_XML_10: VID_TAXII_SERVICES_10,
                         VID_TAXII_XML_11: VID_TAXII_SERVICES_11,
-                        VID_CERT_EU_JSON_10: VID_TAXII_SERVICES_10}
+                        VID_CERT_EU_JSON_10: VID_TAXII_SERVICES_10,
+                        VID_LIBTAXII_BINARY_11: VID_TAXII_SERVICES_11}
         if header_dict.get(HttpClient.HEADER_X_TAXII_SERVICES) is None:  # The X-TAXII-Services header was not set by the user
             if message_binding not in services_map:
                 raise ValueError('x-taxii-services header not specified, and the message_binding is unrecognized')
             header_dict[HttpClient.HEADER_X_TAXII_SERVICES] = services_map[message_binding]
 
-        handler_list = []
-
-        if self.use_https:
+        if config.use_https:
             header_dict[HttpClient.HEADER_X_TAXII_PROTOCOL] = VID_TAXII_HTTPS_10
+        else:
+            header_dict[HttpClient.HEADER_X_TAXII_PROTOCOL] = VID_TAXII_HTTP_10
 
-            if (self.auth_type == HttpClient.AUTH_CERT or
-                    self.auth_type == HttpClient.AUTH_CERT_BASIC):
-                key_file = self.auth_credentials['key_file']
-                cert_file = self.auth_credentials['cert_file']
-                key_password = self.auth_credentials.get('key_password')
-            else:
-                key_file = None
-                cert_file = None
-                key_password = None
+        if (config.auth_type == HttpClient.AUTH_BASIC or
+                config.auth_type == HttpClient.AUTH_CERT_BASIC):
+            header_dict['Authorization'] = _basic_auth_header(config.auth_credentials)
 
-            if (self.auth_type == HttpClient.AUTH_BASIC or
-                    self.auth_type == HttpClient.AUTH_CERT_BASIC):
-                header_dict['Authorization'] = self.basic_auth_header
+        if config.accept_compressed and 'accept-encoding' not in header_dict:
+            header_dict['Accept-Encoding'] = 'gzip, deflate'
+
+        return header_dict
+
+    def _encode_body(self, config, post_data, header_dict):
+        """Return the request body to send, gzipped if the client compresses
+        requests. Sets the Content-Encoding header if it is.
+
+        A streamed body (see :py:func:`_is_streamed_body`) is returned as an
+        iterator of byte strings, and the Content-Length or
+        ``Transfer-Encoding: chunked`` header is set for it. Where that
+        can't be sent, the body is read into a string instead.
+        """
+        if _is_streamed_body(post_data):
+            if _CAN_STREAM_BODY:
+                return self._encode_streamed_body(config, post_data, header_dict)
+            post_data = b''.join(_iter_body(post_data))
+        if not config.compress_requests or 'content-encoding' in header_dict:
+            return post_data
+        if isinstance(post_data, six.text_type):
+            post_data = post_data.encode('utf-8')
+        if len(post_data) < _COMPRESS_MIN_SIZE:
+            return post_data
+
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip format
+        header_dict['Content-Encoding'] = 'gzip'
+        header_dict.pop('content-length', None)  # The length of the uncompressed body
+        return compressor.compress(post_data) + compressor.flush()
+
+    def _encode_streamed_body(self, config, post_data, header_dict):
+        chunks = _iter_body(post_data)
+        if config.compress_requests and 'content-encoding' not in header_dict:
+            header_dict['Content-Encoding'] = 'gzip'
+            header_dict.pop('content-length', None)  # The length of the uncompressed body
+            chunks = _gzip_chunks(chunks)
+        elif 'content-length' not in header_dict:
+            length = _get_body_length(post_data)
+            if length is not None:
+                header_dict['Content-Length'] = str(length)
+
+        if 'content-length' not in header_dict and 'Content-Length' not in header_dict:
+            header_dict['Transfer-Encoding'] = 'chunked'
+        return chunks
+
+    def call_taxii_service2(self, host, path, message_binding, post_data, port=None, get_params_dict=None,
+                            content_type=None, headers=None, user_agent=None, timeout=None):
+        """Call a TAXII service.
+
+        **Note:** this uses urllib2 instead of httplib, and therefore returns
+        a different kind of object than :func:`call_taxii_service`.
 
-            verify_server = self.verify_server
-            ca_file = self.ca_file
+        ``post_data`` can be a string, or, for large requests, an iterable
+        of byte strings or a file-like object opened in binary mode. Those
+        are sent as they are read, with the Content-Length from the
+        ``headers`` if it is given there (or, for a regular file, from the
+        file's size), and with chunked transfer encoding otherwise. Before
+        Python 3.6, such a body is read into memory before it is sent.
+
+        :return: :class:`urllib2.Response`
+        """
+
+        config = self._get_config()
+        header_dict = self._get_header_dict(config, message_binding, content_type, headers, user_agent)
+        post_data = self._encode_body(config, post_data, header_dict)
+
+        handler_list = []
+
+        if config.use_https:
+            key_file, cert_file, key_password = self._get_cert(config) or (None, None, None)
+
+            verify_server = config.verify_server
+            ca_file = config.ca_file
 
             handler_list.append(LibtaxiiHTTPSHandler(
                 key_file=key_file,
@@ -296,40 +481,36 @@ class HttpClient(object):
                 key_password=key_password))
 
         else:  # Not using https
-            header_dict[HttpClient.HEADER_X_TAXII_PROTOCOL] = VID_TAXII_HTTP_10
-
-            if self.auth_type == HttpClient.AUTH_NONE:
+            if config.auth_type == HttpClient.AUTH_NONE:
                 handler_list.append(urllib.request.HTTPHandler())
-            elif self.auth_type == HttpClient.AUTH_BASIC:
-                header_dict['Authorization'] = self.basic_auth_header
-            elif self.auth_type == HttpClient.AUTH_CERT:
-                k = self.auth_credentials['key_file']
-                c = self.auth_credentials['cert_file']
+            elif config.auth_type == HttpClient.AUTH_CERT:
+                k = config.auth_credentials['key_file']
+                c = config.auth_credentials['cert_file']
                 handler_list.append(HTTPClientAuthHandler(k, c))
-            elif self.auth_type == HttpClient.AUTH_CERT_BASIC:
-                header_dict['Authorization'] = self.basic_auth_header
-                k = self.auth_credentials['key_file']
-                c = self.auth_credentials['cert_file']
+            elif config.auth_type == HttpClient.AUTH_CERT_BASIC:
+                k = config.auth_credentials['key_file']
+                c = config.auth_credentials['cert_file']
                 handler_list.append(HTTPSClientAuthHandler(k, c))
             handler_list.append(urllib.request.HTTPHandler())
 
-        if self.proxy_string is not None:
-            if self.proxy_string == 'noproxy':
+        if config.proxy_string is not None:
+            if config.proxy_string == 'noproxy':
                 # Dont use any proxy, including the system-specified proxy
                 handler_list.append(urllib.request.ProxyHandler({}))
             else:  # Use a specific proxy
-                handler_list.append(urllib.request.ProxyHandler({self.PROXY_HTTP: self.proxy_string, self.PROXY_HTTPS: self.proxy_string}))
+                handler_list.append(urllib.request.ProxyHandler({self.PROXY_HTTP: config.proxy_string, self.PROXY_HTTPS: config.proxy_string}))
 
+        # The opener is only used for this request; installing it globally
+        # would affect other threads.
         opener = urllib.request.build_opener(*handler_list)
-        urllib.request.install_opener(opener)
 
         if port is None:  # If the caller did not specify a port, use the default
-            if self.use_https:
+            if config.use_https:
                 port = 443
             else:
                 port = 80
 
-        if self.use_https:
+        if config.use_https:
             scheme = 'https://'
         else:
             scheme = 'http://'
@@ -337,17 +518,45 @@ class HttpClient(object):
         url = scheme + host + ':' + str(port) + path
         if get_params_dict is not None:
             url += '?' + urllib.parse.urlencode(get_params_dict)
+        # On Python 2, a unicode URL makes httplib build the request as
+        # unicode, which can't be joined with a binary (e.g. gzipped) body.
+        url = str(url)
 
         req = urllib.request.Request(url, post_data, header_dict)
         try:
             if timeout is not None:
-                response = urllib.request.urlopen(req, timeout=timeout)
+                response = opener.open(req, timeout=timeout)
             else:  # Defaults to socket.getdefaulttimeout()
-                response = urllib.request.urlopen(req)
+                response = opener.open(req)
             return response
         except urllib.error.HTTPError as error:
             return error
 
+    def send_inbox_message(self, host, path, inbox_message, content_blocks=None, port=None, headers=None,
+                           user_agent=None, timeout=None):
+        """Send an Inbox Message and return the parsed response message.
+
+        The message is serialized one Content Block at a time while it is
+        sent (see :py:meth:`libtaxii.messages_11.InboxMessage.iter_xml_chunks`),
+        so the request body is never held in memory as a whole. Pass a
+        generator as ``content_blocks`` to upload more content than fits in
+        memory.
+
+        :param inbox_message: A :py:class:`libtaxii.messages_11.InboxMessage`
+            or :py:class:`libtaxii.messages_10.InboxMessage`. It is sent with
+            the matching XML Message Binding.
+        :param content_blocks: The Content Blocks to send instead of
+            ``inbox_message.content_blocks``.
+        :return: The TAXII message in the response, as returned by
+            :py:func:`libtaxii.get_message_from_http_response`.
+        """
+        from libtaxii import get_message_from_http_response
+
+        body = inbox_message.iter_xml_chunks(content_blocks=content_blocks)
+        http_response = self.call_taxii_service2(host, path, inbox_message.version, body, port=port,
+                                                 headers=headers, user_agent=user_agent, timeout=timeout)
+        return get_message_from_http_response(http_response, inbox_message.message_id)
+
     # Backwards compatibility
     setAuthType = set_auth_type
     setVerifyServer = set_verify_server
@@ -358,6 +567,558 @@ class HttpClient(object):
     callTaxiiService2 = call_taxii_service2
 
 
+class CompressionStats(object):
+
+    """How much a compressed HTTP response body was compressed.
+
+    :py:func:`libtaxii.get_message_from_http_response` sets this as the
+    ``compression_stats`` attribute of a compressed response.
+    """
+
+    def __init__(self, encoding):
+        #: The Content-Encoding of the response (``gzip`` or ``deflate``).
+        self.encoding = encoding
+        #: The number of bytes received.
+        self.compressed_bytes = 0
+        #: The number of bytes after decompression.
+        self.uncompressed_bytes = 0
+
+    @property
+    def ratio(self):
+        """The uncompressed size divided by the compressed size."""
+        if not self.compressed_bytes:
+            return None
+        return float(self.uncompressed_bytes) / self.compressed_bytes
+
+    @property
+    def bytes_saved(self):
+        """The number of bytes that compression saved."""
+        return self.uncompressed_bytes - self.compressed_bytes
+
+    def __repr__(self):
+        return 'CompressionStats(%r, compressed_bytes=%r, uncompressed_bytes=%r)' % (
+            self.encoding, self.compressed_bytes, self.uncompressed_bytes)
+
+
+#: The Content-Encodings that responses are decompressed from.
+SUPPORTED_CONTENT_ENCODINGS = ('gzip', 'x-gzip', 'deflate')
+
+_MAX_DECOMPRESSED_SIZE = None
+
+
+def get_max_decompressed_size():
+    """Return the most bytes that a compressed response body may
+    decompress to, or None if there is no limit (the default)."""
+    return _MAX_DECOMPRESSED_SIZE
+
+
+def set_max_decompressed_size(max_size=None):
+    """Limit how large a compressed response body may be once it is
+    decompressed.
+
+    Decompression stops with a :py:class:`DecompressedSizeError` as soon as
+    the limit is passed, so a small response that decompresses to a huge
+    body can't use up all memory.
+
+    :param max_size: The limit, in bytes, or None for no limit.
+    """
+    global _MAX_DECOMPRESSED_SIZE
+    _MAX_DECOMPRESSED_SIZE = max_size
+
+
+class _DecompressingReader(object):
+
+    """A file-like object that decompresses a gzip or deflate encoded stream
+    as it is read."""
+
+    _CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fileobj, encoding, max_size=None):
+        self.fileobj = fileobj
+        self.stats = CompressionStats(encoding)
+        self.max_size = get_max_decompressed_size() if max_size is None else max_size
+        self._gzip = encoding != 'deflate'
+        if self._gzip:
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._decompressor = zlib.decompressobj()
+        self._first = not self._gzip
+        self._buffer = b''
+        self._eof = False
+
+    def _decompress(self, data):
+        if self._first:
+            # Some servers send raw deflate data instead of the zlib format
+            self._first = False
+            try:
+                return self._inflate(data)
+            except zlib.error:
+                self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        chunks = [self._inflate(data)]
+        while self._gzip and self._decompressor.unused_data:
+            # Another gzip member follows the one that just ended. Members
+            # may be padded with zeros, which are skipped like gzip does.
+            data = self._decompressor.unused_data.lstrip(b'\x00')
+            if not data:
+                break
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            chunks.append(self._inflate(data))
+        return b''.join(chunks)
+
+    def _inflate(self, data):
+        if self.max_size is None:
+            data = self._decompressor.decompress(data)
+        else:
+            # Stop one byte past the limit, rather than decompressing all of
+            # data
+            data = self._decompressor.decompress(data, self.max_size - self.stats.uncompressed_bytes + 1)
+        self._check_size(len(data))
+        return data
+
+    def _check_size(self, size):
+        """Count ``size`` more decompressed bytes, and raise a
+        :py:class:`DecompressedSizeError` if that passes the limit."""
+        self.stats.uncompressed_bytes += size
+        if self.max_size is not None and self.stats.uncompressed_bytes > self.max_size:
+            raise DecompressedSizeError(self.max_size)
+
+    def _read_chunk(self):
+        # read1() returns what has arrived instead of waiting for a full chunk
+        read = getattr(self.fileobj, 'read1', self.fileobj.read)
+        data = read(self._CHUNK_SIZE)
+        if not data:
+            self._eof = True
+        return self.feed(data)
+
+    def feed(self, data):
+        """Decompress the next piece of the compressed stream, and return the
+        bytes that have become available. An empty ``data`` marks the end of
+        the stream. This allows decompressing data that is not read from
+        ``fileobj``."""
+        if not data:
+            data = self._decompressor.flush()
+            self._check_size(len(data))
+        else:
+            self.stats.compressed_bytes += len(data)
+            data = self._decompress(data)
+        return data
+
+    def read(self, size=-1):
+        """Read up to ``size`` decompressed bytes, or all of them if ``size`` is negative."""
+        if size is None or size < 0:
+            chunks = [self._buffer]
+            while not self._eof:
+                chunks.append(self._read_chunk())
+            self._buffer = b''
+            return b''.join(chunks)
+
+        while not self._eof and len(self._buffer) < size:
+            self._buffer += self._read_chunk()
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def read1(self, size=-1):
+        """Read up to ``size`` decompressed bytes, returning as soon as any
+        are available."""
+        while not self._eof and not self._buffer:
+            self._buffer = self._read_chunk()
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _is_streamed_body(post_data):
+    """Return True if a request body is an iterable of byte strings or a
+    file-like object, rather than a string."""
+    return post_data is not None and not isinstance(post_data, (six.binary_type, six.text_type))
+
+
+def _iter_body(post_data):
+    """Iterate over the byte strings of a streamed request body."""
+    if hasattr(post_data, 'read'):
+        while True:
+            block = post_data.read(_BODY_BLOCK_SIZE)
+            if not block:
+                return
+            yield block
+    else:
+        for chunk in post_data:
+            if isinstance(chunk, six.text_type):
+                chunk = chunk.encode('utf-8')
+            if chunk:  # An empty chunk would end a chunked body
+                yield chunk
+
+
+def _get_body_length(post_data):
+    """Return the number of bytes left in a file-like request body, if it is
+    a regular file, or None."""
+    try:
+        size = os.fstat(post_data.fileno()).st_size
+        return max(size - post_data.tell(), 0)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return None
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip format
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+_SSL_CONTEXTS = {}
+_SSL_CONTEXTS_LOCK = threading.Lock()
+
+# TLS sessions by (SSL context, host, port), so that new connections to a
+# server can resume a previous session instead of doing a full handshake.
+# Only the most recently used _SSL_SESSIONS_MAX_SIZE sessions are kept.
+# (Python 2.6 has no OrderedDict, but no SSL contexts to use sessions with
+# either.)
+_SSL_SESSIONS = getattr(collections, 'OrderedDict', dict)()
+_SSL_SESSIONS_MAX_SIZE = 100
+
+
+def get_ssl_context(verify_server=False, ca_certs=None, cert_file=None, key_file=None, key_password=None):
+    """Return an ``ssl.SSLContext`` for connecting to TAXII servers.
+
+    Contexts are cached by their arguments, so the CA bundle and the client
+    certificate and key are only read once. Call
+    :py:func:`clear_ssl_context_cache` if those files change.
+
+    libtaxii users should not need to use this function directly.
+    """
+    key = (verify_server, ca_certs, cert_file, key_file, key_password)
+    with _SSL_CONTEXTS_LOCK:
+        context = _SSL_CONTEXTS.get(key)
+        if context is None:
+            context = ssl.create_default_context(
+                ssl.Purpose.SERVER_AUTH if verify_server else ssl.Purpose.CLIENT_AUTH,
+                cafile=ca_certs)
+
+            if cert_file or key_file:
+                context.load_cert_chain(
+                    cert_file, key_file, password=key_password)
+            _SSL_CONTEXTS[key] = context
+    return context
+
+
+def _save_ssl_session(key, session):
+    with _SSL_CONTEXTS_LOCK:
+        # Move the key to the end, so that the least recently used session
+        # is first
+        _SSL_SESSIONS.pop(key, None)
+        _SSL_SESSIONS[key] = session
+        while len(_SSL_SESSIONS) > _SSL_SESSIONS_MAX_SIZE:
+            _SSL_SESSIONS.popitem(last=False)
+
+
+def clear_ssl_context_cache():
+    """Forget all cached SSL contexts and TLS sessions."""
+    with _SSL_CONTEXTS_LOCK:
+        _SSL_CONTEXTS.clear()
+        _SSL_SESSIONS.clear()
+
+
+class _PooledHTTPResponse(six.moves.http_client.HTTPResponse):
+
+    """An HTTP response that gives its connection back to a ConnectionPool
+    once the response body has been read to the end."""
+
+    # HTTPResponse is an old-style class on Python 2, so its methods are
+    # called directly instead of through super().
+
+    _release = None
+    _abandoned = False
+    _reading = False
+
+    def _released(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release(not self._abandoned and not self.will_close)
+
+    def _close_conn(self):
+        # Python 3 calls this once the whole body has been read
+        six.moves.http_client.HTTPResponse._close_conn(self)
+        self._released()
+
+    def _read(self, read, amt):
+        # Python 2 calls close() from read() once the whole body has been
+        # read, which must not count as abandoning the response.
+        self._reading = True
+        try:
+            data = read(self, amt)
+        finally:
+            self._reading = False
+        # read1() doesn't close the connection once the whole body (of a
+        # known length) has been read
+        if self.length == 0 and self.fp is not None:
+            self.close()
+        return data
+
+    def read(self, amt=None):
+        return self._read(six.moves.http_client.HTTPResponse.read, amt)
+
+    if hasattr(six.moves.http_client.HTTPResponse, 'read1'):  # Python 3
+        def read1(self, n=-1):
+            return self._read(six.moves.http_client.HTTPResponse.read1, n)
+
+    def close(self):
+        if self.fp is not None and not self._reading and self.length != 0:
+            # The body has not been read to the end, so the connection is in
+            # an unknown state and must not be reused.
+            self._abandoned = True
+        six.moves.http_client.HTTPResponse.close(self)
+        self._released()
+
+
+class ConnectionPool(object):
+
+    """A pool of persistent HTTP/1.1 connections to a single server.
+
+    libtaxii users should not need to use this class directly; see
+    :py:class:`PooledHttpClient`.
+
+    :param connection_factory: A callable that returns a new, unconnected
+        ``HTTPConnection`` (or ``HTTPSConnection``).
+    :param int max_size: The maximum number of idle connections to keep.
+    :param float idle_timeout: The number of seconds an idle connection is kept
+        before it is closed.
+    """
+
+    def __init__(self, connection_factory, max_size=10, idle_timeout=60):
+        self.connection_factory = connection_factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle = []  # (connection, time it was returned) pairs, oldest first
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return an idle connection, or a new one if there are none.
+
+        :return: A ``(connection, reused)`` tuple.
+        """
+        expired = []
+        with self._lock:
+            now = time.time()
+            while self._idle:
+                conn, returned = self._idle.pop()
+                if now - returned <= self.idle_timeout:
+                    break
+                expired.append(conn)
+            else:
+                conn = None
+            # Everything older than an expired connection has expired too
+            while self._idle and now - self._idle[0][1] > self.idle_timeout:
+                expired.append(self._idle.pop(0)[0])
+
+        for old_conn in expired:
+            old_conn.close()
+
+        if conn is not None:
+            return conn, True
+        return self.connection_factory(), False
+
+    def put(self, conn):
+        """Return a connection to the pool once its response has been read."""
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+
+class PooledHttpClient(HttpClient):
+
+    """An :py:class:`HttpClient` that keeps connections open between calls.
+
+    Connections are pooled per scheme, host, port and authentication
+    settings, and are reused for later requests to the same server as long
+    as the server allows it (HTTP/1.1 keep-alive). This avoids a new TCP
+    connection, and TLS handshake, for every request.
+
+    A connection is only returned to its pool once the previous response has
+    been read to the end (e.g., by
+    :py:func:`libtaxii.get_message_from_http_response`), so always read or
+    close responses.
+
+    :param int max_pool_size: The maximum number of idle connections kept for
+        each server.
+    :param float idle_timeout: The number of seconds an idle connection is kept
+        open.
+
+    Example:
+        .. code-block:: python
+
+            with tc.PooledHttpClient() as client:
+                for collection in collections:
+                    http_resp = client.call_taxii_service2(host, path, VID_TAXII_XML_11, poll_xml(collection))
+                    taxii_message = t.get_message_from_http_response(http_resp, '0')
+    """
+
+    def __init__(self, auth_type=HttpClient.AUTH_NONE, auth_credentials=None, use_https=False,
+                 max_pool_size=10, idle_timeout=60):
+        super(PooledHttpClient, self).__init__(auth_type, auth_credentials, use_https)
+        self.max_pool_size = max_pool_size
+        self.idle_timeout = idle_timeout
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close all idle connections held by this client."""
+        with self._pools_lock:
+            pools, self._pools = self._pools, {}
+        for pool in six.itervalues(pools):
+            pool.close()
+
+    def _get_pool(self, config, host, port):
+        scheme = 'https' if config.use_https else 'http'
+        proxy = self._get_proxy(config, scheme, host)
+        cert = self._get_cert(config)
+
+        key = (scheme, host, port, proxy, cert, config.verify_server, config.ca_file)
+        with self._pools_lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(self._connection_factory(scheme, host, port, proxy, cert,
+                                                               config.verify_server, config.ca_file),
+                                      self.max_pool_size, self.idle_timeout)
+                self._pools[key] = pool
+        return pool, proxy
+
+    def _connection_factory(self, scheme, host, port, proxy, cert, verify_server, ca_file):
+        def new_connection():
+            conn_host, conn_port = proxy if proxy else (host, port)
+            if scheme == 'https':
+                key_file, cert_file, key_password = cert or (None, None, None)
+                conn = VerifiableHTTPSConnection(conn_host, conn_port, key_file=key_file, cert_file=cert_file,
+                                                 key_password=key_password, verify_server=verify_server,
+                                                 ca_certs=ca_file)
+                if proxy:
+                    conn.set_tunnel(host, port)
+            else:
+                conn = six.moves.http_client.HTTPConnection(conn_host, conn_port)
+            conn.response_class = _PooledHTTPResponse
+            return conn
+
+        return new_connection
+
+    def call_taxii_service2(self, host, path, message_binding, post_data, port=None, get_params_dict=None,
+                            content_type=None, headers=None, user_agent=None, timeout=None):
+        """Call a TAXII service, reusing a pooled connection if possible.
+
+        The arguments are the same as for :py:meth:`HttpClient.call_taxii_service2`.
+        If a pooled connection turns out to be closed, the request is sent
+        again on a new one, unless ``post_data`` is an iterable or a file
+        that can't be rewound.
+
+        :return: :class:`httplib.HTTPResponse`, for any HTTP status code
+        """
+        config = self._get_config()
+        header_dict = self._get_header_dict(config, message_binding, content_type, headers, user_agent)
+        streamed = _is_streamed_body(post_data)
+        if streamed:
+            # A streamed body can only be sent again if it can be rewound
+            try:
+                start = post_data.tell()
+            except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+                start = None
+        body = self._encode_body(config, post_data, header_dict)
+        request_kwargs = {}
+        if 'Transfer-Encoding' in header_dict:
+            request_kwargs['encode_chunked'] = True
+
+        if port is None:  # If the caller did not specify a port, use the default
+            port = 443 if config.use_https else 80
+
+        if get_params_dict is not None:
+            path += '?' + urllib.parse.urlencode(get_params_dict)
+
+        pool, proxy = self._get_pool(config, host, port)
+        if proxy and not config.use_https:
+            # Plain HTTP requests through a proxy use the absolute URL
+            path = 'http://%s:%s%s' % (host, port, path)
+        path = str(path)  # See call_taxii_service2
+
+        while True:
+            conn, reused = pool.get()
+            # A reused connection keeps the timeout of the call that last
+            # used it, so always set this call's (or the default) timeout
+            if timeout is not None:
+                conn.timeout = timeout
+            else:  # Defaults to socket.getdefaulttimeout()
+                conn.timeout = socket._GLOBAL_DEFAULT_TIMEOUT
+            if conn.sock is not None:
+                conn.sock.settimeout(socket.getdefaulttimeout() if timeout is None else timeout)
+            sending = True
+            try:
+                conn.request('POST', path, body, header_dict, **request_kwargs)
+                sending = False
+                response = conn.getresponse()
+            except (socket.error, six.moves.http_client.HTTPException) as error:
+                conn.close()
+                if reused and _is_stale_connection_error(error, sending) and (not streamed or start is not None):
+                    # The server had closed the idle connection; try again
+                    # on a new one.
+                    if streamed:
+                        post_data.seek(start)
+                        body = self._encode_body(config, post_data, header_dict)
+                    continue
+                raise
+            break
+
+        def release(reusable):
+            if reusable:
+                pool.put(conn)
+            else:
+                conn.close()
+
+        response._release = release
+        if response.isclosed():  # There was no body to read
+            response._released()
+        return response
+
+
+# Raised by http.client when the server closes the connection instead of
+# sending a status line (Python 3.5+)
+_RemoteDisconnected = getattr(six.moves.http_client, 'RemoteDisconnected', ())
+
+
+def _is_stale_connection_error(error, sending):
+    """Return whether ``error`` shows that a reused connection had already
+    been closed by the server, so that the request can safely be sent again.
+
+    TAXII requests are POSTs, and e.g. an Inbox Message must not be delivered
+    twice, so this is only the case if the connection was reset while the
+    request was being sent, or was closed without any response. Timeouts are
+    never retried: the server may still be handling the request.
+    """
+    if isinstance(error, socket.timeout):
+        return False
+    if isinstance(error, _RemoteDisconnected):
+        return True
+    if isinstance(error, six.moves.http_client.BadStatusLine):
+        return error.line in ('', "''")  # Python 2 reports the line with repr()
+    if sending and isinstance(error, socket.error):
+        return error.errno in (errno.ECONNRESET, errno.EPIPE)
+    return False
+
+
 # http://stackoverflow.com/questions/5896380/https-connection-using-pem-certificate
 class LibtaxiiHTTPSHandler(urllib.request.HTTPSHandler):
 
@@ -428,13 +1189,7 @@ class VerifiableHTTPSConnection(six.moves.http_client.HTTPSConnection):
 
         elif python_version == (2, 7) or six.PY3:
             if hasattr(ssl, "create_default_context"):
-                self.context = ssl.create_default_context(
-                    ssl.Purpose.SERVER_AUTH if verify_server else ssl.Purpose.CLIENT_AUTH,
-                    cafile=ca_certs)
-
-                if cert_file or key_file:
-                    self.context.load_cert_chain(
-                        cert_file, key_file, password=key_password)
+                self.context = get_ssl_context(verify_server, ca_certs, cert_file, key_file, key_password)
 
             if not self.context and key_password:
                 warnings.warn('Key password is not supported in Python <2.7.9. Ignoring')
@@ -458,6 +1213,7 @@ class VerifiableHTTPSConnection(six.moves.http_client.HTTPSConnection):
 
         self.cert_file = cert_file
         self.key_file = key_file
+        self._session_key = None
 
         if verify_server:
             self.cert_reqs = ssl.CERT_REQUIRED
@@ -481,13 +1237,29 @@ class VerifiableHTTPSConnection(six.moves.http_client.HTTPSConnection):
             self.sock = sock
             self._tunnel()
             server_hostname = self._tunnel_host
+            server_port = self._tunnel_port or self.default_port
         else:
             server_hostname = self.host
+            server_port = self.port
 
         if self.context:
-            self.sock = self.context.wrap_socket(
-                sock,
-                server_hostname=server_hostname)
+            # Through a proxy, the session is with the server at the other
+            # end of the tunnel, not with the proxy
+            session_key = (self.context, server_hostname, server_port)
+            session = _SSL_SESSIONS.get(session_key)
+            if session is not None:
+                # If the server no longer knows the session, the handshake
+                # silently falls back to a full one.
+                self.sock = self.context.wrap_socket(
+                    sock,
+                    server_hostname=server_hostname,
+                    session=session)
+            else:
+                self.sock = self.context.wrap_socket(
+                    sock,
+                    server_hostname=server_hostname)
+            self._session_key = session_key
+            self._save_session()
         else:
             self.sock = ssl.wrap_socket(
                 sock,
@@ -496,3 +1268,15 @@ class VerifiableHTTPSConnection(six.moves.http_client.HTTPSConnection):
                 cert_reqs=self.cert_reqs,
                 ca_certs=self.ca_certs,
                 server_hostname=server_hostname)
+
+    def _save_session(self):
+        session = getattr(self.sock, 'session', None)
+        if session is not None:
+            _save_ssl_session(self._session_key, session)
+
+    def close(self):
+        # With TLS 1.3, session tickets arrive after the handshake, so save
+        # the session again before the socket goes away.
+        if self.sock is not None and self._session_key is not None:
+            self._save_session()
+        six.moves.http_client.HTTPSConnection.close(self)
@@ -2,12 +2,17 @@
 Common utility classes and functions used throughout libtaxii.
 """
 
+import codecs
+import copy
+import datetime
 from operator import attrgetter
 import re
 import sys
+import threading
 from uuid import uuid4
 
 import dateutil.parser
+from dateutil.tz import tzoffset, tzutc
 from lxml import etree
 import six
 from six.moves.urllib.parse import urlparse
@@ -17,9 +22,25 @@ try:
 except ImportError:
     import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from functools import lru_cache
+except ImportError:  # Python 2
+    lru_cache = None
+
 from libtaxii.constants import *
 
 _XML_PARSER = None
+_JSON_DUMPS = None
+# Bumped whenever set_xml_parser() is called, so that each thread knows when
+# its copy of the parser is stale.
+_XML_PARSER_GENERATION = 0
+_XML_PARSER_LOCK = threading.Lock()
+_THREAD_LOCAL = threading.local()
 
 
 def parse(s, allow_file=True, allow_url=False):
@@ -59,7 +80,8 @@ def parse_xml_string(xmlstr):
     :return: an etree._Element
     """
     if isinstance(xmlstr, six.binary_type):
-        xmlstr = six.BytesIO(xmlstr)
+        # Bytes can never be a file path here, so hand them straight to lxml.
+        return parse(xmlstr, allow_file=False)
     elif isinstance(xmlstr, six.text_type):
         # LXML doesn't accept Unicode strings with an explicit encoding, so
         # try to detect and encode to bytes before passing to LXML.
@@ -74,52 +96,739 @@ def parse_xml_string(xmlstr):
     return parse(xmlstr, allow_file=True)
 
 
+# The options of the default XML parser
+_XML_PARSER_OPTIONS = dict(
+    attribute_defaults=False,
+    dtd_validation=False,
+    load_dtd=False,
+    no_network=True,
+    ns_clean=True,
+    recover=False,
+    remove_blank_text=False,
+    remove_comments=False,
+    remove_pis=False,
+    strip_cdata=True,
+    compact=True,
+    # collect_ids=True,
+    resolve_entities=False,
+    huge_tree=False
+)
+
+# The number of bytes read from a file-like object per call to
+# IncrementalMessageParser.feed()
+_PARSE_CHUNK_SIZE = 64 * 1024
+
+
+def _new_xml_parser():
+    return etree.XMLParser(**_XML_PARSER_OPTIONS)
+
+
 def get_xml_parser():
     """Return the XML parser currently in use.
 
     If one has not already been set (via :py:func:`set_xml_parser()`), a new
     ``etree.XMLParser`` is constructed with ``no_network=True`` and
     ``huge_tree=False``.
+
+    lxml parsers must not be shared between threads, so each thread gets its
+    own copy of the parser, which is reused for every parse in that thread
+    until :py:func:`set_xml_parser()` is called again.
     """
     global _XML_PARSER
-    if _XML_PARSER is None:
-        _XML_PARSER = etree.XMLParser(
-            attribute_defaults=False,
-            dtd_validation=False,
-            load_dtd=False,
-            no_network=True,
-            ns_clean=True,
-            recover=False,
-            remove_blank_text=False,
-            remove_comments=False,
-            remove_pis=False,
-            strip_cdata=True,
-            compact=True,
-            # collect_ids=True,
-            resolve_entities=False,
-            huge_tree=False
-        )
-    return _XML_PARSER.copy()
+    local = _THREAD_LOCAL
+    generation = _XML_PARSER_GENERATION
+    if getattr(local, 'generation', None) != generation:
+        with _XML_PARSER_LOCK:
+            if _XML_PARSER is None:
+                _XML_PARSER = _new_xml_parser()
+            local.parser = _XML_PARSER.copy()
+            local.generation = _XML_PARSER_GENERATION
+    return local.parser
 
 
 def set_xml_parser(xml_parser=None):
     """Set the libtaxii.messages XML parser.
 
+    The new parser is picked up by every thread the next time it parses.
+
     Args:
         xml_parser (etree.XMLParser): The parser to use to parse TAXII XML.
     """
-    global _XML_PARSER
-    _XML_PARSER = xml_parser
+    global _XML_PARSER, _XML_PARSER_GENERATION
+    with _XML_PARSER_LOCK:
+        _XML_PARSER = xml_parser
+        _XML_PARSER_GENERATION += 1
+
+
+def _default_json_dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj)
+
+
+def get_json_dumps():
+    """Return the function that :py:meth:`TAXIIBase.write_json` uses to
+    encode JSON.
+
+    Unless one has been set (via :py:func:`set_json_dumps()`), this uses
+    ``orjson`` if it is installed, and the ``json`` module (or
+    ``simplejson``) otherwise.
+    """
+    return _JSON_DUMPS or _default_json_dumps
+
+
+def set_json_dumps(json_dumps=None):
+    """Set the function that :py:meth:`TAXIIBase.write_json` uses to encode
+    JSON.
+
+    Args:
+        json_dumps: A function that takes a dict and returns it as JSON, in
+            a string or in UTF-8 encoded bytes (e.g., ``ujson.dumps``), or
+            None to go back to the default.
+    """
+    global _JSON_DUMPS
+    _JSON_DUMPS = json_dumps
+
+
+def _dump_json_bytes(obj):
+    data = get_json_dumps()(obj)
+    if isinstance(data, six.text_type):
+        data = data.encode('utf-8')
+    return data
+
+
+def iterparse_content_blocks(source, message_classes, content_block_class, get_message_from_etree,
+                             detach_content=True):
+    """Incrementally parse a TAXII message that carries Content Blocks.
+
+    ``source`` is read in chunks that are fed to an
+    :py:class:`IncrementalMessageParser`, and the items it returns are
+    yielded as soon as each chunk has been parsed. When ``source`` is an
+    HTTP response, the message header and the first Content Blocks are
+    therefore available while the rest of the body is still being received.
+
+    libtaxii users should not need to use this function directly.
+
+    :param source: A file-like object (opened in binary mode) or a byte string
+    :param message_classes: A dict of root element tag to TAXIIMessage subclass
+    :param content_block_class: The ContentBlock class to build blocks with
+    :param get_message_from_etree: Used for messages not in message_classes
+    :param detach_content: Whether to detach the content of each Content Block
+    """
+    if isinstance(source, six.binary_type):
+        source = six.BytesIO(source)
+
+    # read1() returns what has arrived instead of waiting for a full chunk
+    read = getattr(source, 'read1', source.read)
+    parser = IncrementalMessageParser(message_classes, content_block_class, get_message_from_etree, detach_content)
+    while True:
+        data = read(_PARSE_CHUNK_SIZE)
+        if not data:
+            break
+        for item in parser.feed(data):
+            yield item
+
+    for item in parser.close():
+        yield item
+
+
+class IncrementalMessageParser(object):
+    """Parse a TAXII message that carries Content Blocks from data that
+    arrives in pieces.
+
+    The data is fed to an ``etree.XMLPullParser``. Once every element that
+    precedes the first Content Block has been parsed, the message is built
+    (without any Content Blocks) and returned. Each Content Block is then
+    returned as soon as it has been parsed, and is removed from the message
+    tree so that memory use does not grow with the number of blocks. Unless
+    ``detach_content`` is False, the XML content of each Content Block is
+    also moved to a document of its own (see :py:func:`detach_element`), so
+    a Content Block that is kept does not keep the rest of the message.
+
+    Messages whose root element is not in ``message_classes`` (e.g., a Status
+    Message sent in response to a Poll Request) are parsed fully and
+    returned by :py:meth:`close` via ``get_message_from_etree``.
+
+    Note that the parser set with :py:func:`set_xml_parser` is not used here,
+    since a pull parser can't be made from a parser object. The parsing
+    options match the defaults of :py:func:`get_xml_parser`.
+
+    libtaxii users should not need to use this class directly.
+
+    :param message_classes: A dict of root element tag to TAXIIMessage subclass
+    :param content_block_class: The ContentBlock class to build blocks with
+    :param get_message_from_etree: Used for messages not in message_classes
+    :param detach_content: Whether to detach the content of each Content Block
+    """
+
+    def __init__(self, message_classes, content_block_class, get_message_from_etree, detach_content=True):
+        self.message_classes = message_classes
+        self.content_block_class = content_block_class
+        self.get_message_from_etree = get_message_from_etree
+        self.detach_content = detach_content
+        self._parser = etree.XMLPullParser(events=('start', 'end'), **_XML_PARSER_OPTIONS)
+        self._root = None
+        self._message_class = None
+        self._block_tag = None
+        self._header_done = False
+        self._depth = 0
+
+    def feed(self, data):
+        """Parse the next piece of the message.
+
+        :param bytes data: The next bytes of the message
+        :return: A list of the items that have become complete: first the
+            message, then Content Blocks.
+        """
+        self._parser.feed(data)
+        return list(self._read_events())
+
+    def close(self):
+        """Finish parsing the message.
+
+        :return: A list of the remaining items.
+        :raises etree.XMLSyntaxError: if the message is incomplete.
+        """
+        self._parser.close()
+        items = list(self._read_events())
+        if self._message_class is None:
+            items.append(self.get_message_from_etree(self._root))
+        elif not self._header_done:  # The message had no Content Blocks
+            items.append(self._message_class.from_etree(self._root))
+        return items
+
+    def _read_events(self):
+        for event, elt in self._parser.read_events():
+            if event == 'start':
+                if self._root is None:
+                    self._root = elt
+                    self._message_class = self.message_classes.get(elt.tag)
+                    self._block_tag = '{%s}%s' % (etree.QName(elt).namespace, self.content_block_class.NAME)
+                self._depth += 1
+                continue
+
+            self._depth -= 1
+            if self._message_class is None or self._depth != 1 or elt.tag != self._block_tag:
+                continue
+
+            root = self._root
+            if not self._header_done:
+                # The parser works in chunks, so later Content Blocks may
+                # already be (partially) present in the tree. Build the message
+                # from a new root holding only the elements that precede this
+                # block.
+                header = etree.Element(root.tag, attrib=root.attrib, nsmap=root.nsmap)
+                for child in list(root):
+                    if child is elt:
+                        break
+                    header.append(child)
+                yield self._message_class.from_etree(header)
+                self._header_done = True
+
+            # Detach the parsed Content Block so that neither the message nor
+            # the document keeps it alive.
+            root.remove(elt)
+            content_block = self.content_block_class.from_etree(elt)
+            if self.detach_content:
+                content_block.detach()
+            yield content_block
+
+
+def iterparse_json_content_blocks(source, message_classes, content_block_class, get_message_from_dict,
+                                  encoding='utf_8'):
+    """Incrementally parse a TAXII message with Content Blocks from JSON.
+
+    This is the JSON counterpart of :py:func:`iterparse_content_blocks`. The
+    members of the message object before ``content_blocks`` are read first,
+    and the message is built from them (without any Content Blocks) and
+    yielded. Each element of the ``content_blocks`` array is then decoded
+    and yielded on its own, so only one Content Block is held in memory at
+    a time.
+
+    Content Blocks can only be streamed if ``content_blocks`` follows every
+    member the message needs, as in the output of ``to_json()`` and
+    ``write_json()``. Otherwise, the array is read as a whole, and the
+    message and its Content Blocks are yielded at the end. A member that
+    follows a streamed ``content_blocks`` array raises a ``ValueError``.
+
+    Messages whose ``message_type`` is not in ``message_classes`` are
+    yielded as a single item via ``get_message_from_dict``.
+
+    libtaxii users should not need to use this function directly.
+
+    :param source: A file-like object (opened in binary mode) or a string
+    :param message_classes: A dict of message type to TAXIIMessage subclass
+    :param content_block_class: The ContentBlock class to build blocks with
+    :param get_message_from_dict: Used for messages not in message_classes
+    :param encoding: The encoding of ``source``, if it is binary
+    """
+    reader = _JSONReader(source, encoding)
+    reader.expect('{')
+    header = {}
+    block_dicts = None  # The content_blocks array, if it could not be streamed
+    streamed = False
+
+    first = True
+    while reader.peek() != '}':
+        if not first:
+            reader.expect(',')
+        first = False
+
+        key = reader.read_value()
+        reader.expect(':')
+        if streamed:
+            raise ValueError('Member after content_blocks can not be parsed incrementally: %s' % key)
+        if key != 'content_blocks':
+            header[key] = reader.read_value()
+            continue
+
+        message = _message_from_header_dict(header, message_classes)
+        if message is None:
+            block_dicts = reader.read_value()
+            continue
+
+        yield message
+        streamed = True
+        reader.expect('[')
+        if reader.peek() == ']':
+            reader.expect(']')
+            continue
+        while True:
+            yield content_block_class.from_dict(reader.read_value())
+            if reader.peek() == ']':
+                reader.expect(']')
+                break
+            reader.expect(',')
+
+    reader.expect('}')
+    if reader.peek() != '':
+        raise ValueError('Extra data after the JSON message')
+
+    if streamed:
+        return
+
+    message_class = message_classes.get(header.get('message_type'))
+    if message_class is None:
+        if block_dicts is not None:
+            header['content_blocks'] = block_dicts
+        yield get_message_from_dict(header)
+        return
+
+    header['content_blocks'] = []
+    yield message_class.from_dict(header)
+    for block_dict in block_dicts or ():
+        yield content_block_class.from_dict(block_dict)
+
+
+def _message_from_header_dict(header, message_classes):
+    """Build a message without Content Blocks from the members read so far,
+    or return None if that isn't possible yet."""
+    message_class = message_classes.get(header.get('message_type'))
+    if message_class is None:
+        return None
+    try:
+        return message_class.from_dict(dict(header, content_blocks=[]))
+    except (KeyError, ValueError):  # A required member comes after content_blocks
+        return None
+
+
+_JSON_WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+
+
+class _JSONReader(object):
+    """Reads the JSON values in a stream one at a time, keeping only the
+    unread part of the stream in memory."""
+
+    def __init__(self, source, encoding='utf_8'):
+        if isinstance(source, six.text_type):
+            self._read = None
+            self._buffer = source
+            self._eof = True
+        else:
+            if isinstance(source, six.binary_type):
+                source = six.BytesIO(source)
+            # read1() returns what has arrived instead of waiting for a full chunk
+            self._read = getattr(source, 'read1', source.read)
+            if codecs.lookup(encoding).name == 'utf-8':
+                encoding = 'utf-8-sig'  # Skip a byte order mark
+            self._decoder = codecs.getincrementaldecoder(encoding)('replace')
+            self._buffer = u''
+            self._eof = False
+        self._pos = 0
+        self._json_decoder = json.JSONDecoder()
+
+    def _read_chunk(self):
+        """Read and decode the next chunk of the stream."""
+        data = self._read(_PARSE_CHUNK_SIZE)
+        if data:
+            return self._decoder.decode(data)
+        self._eof = True
+        return self._decoder.decode(b'', True)
+
+    def peek(self):
+        """Return the next character other than whitespace, without
+        consuming it, or an empty string at the end of the stream."""
+        while True:
+            self._pos = _JSON_WHITESPACE_RE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer) or self._eof:
+                return self._buffer[self._pos:self._pos + 1]
+            self._buffer = self._read_chunk()
+            self._pos = 0
+
+    def expect(self, char):
+        """Consume the next character other than whitespace, which must be ``char``."""
+        found = self.peek()
+        if found != char:
+            raise ValueError('Expected %r in JSON, found %r' % (char, found or 'the end'))
+        self._pos += 1
+
+    def read_value(self):
+        """Decode and consume the next JSON value."""
+        if self.peek() not in ('{', '[', '"'):
+            return self._read_scalar()
+
+        # Find the end of the value as chunks arrive, and decode it once
+        # it is complete. Decoding the buffer again for every chunk would
+        # take quadratic time for a large Content Block.
+        scanner = _JSONScanner()
+        end = scanner.scan(self._buffer, self._pos)
+        if end < 0:
+            chunks = [self._buffer[self._pos:]]
+            length = len(chunks[0])
+            while end < 0 and not self._eof:
+                chunk = self._read_chunk()
+                end = scanner.scan(chunk)
+                if end >= 0:
+                    end += length
+                chunks.append(chunk)
+                length += len(chunk)
+            self._buffer = u''.join(chunks)
+            self._pos = 0
+
+        # If the value is incomplete at the end of the stream, this raises
+        value, self._pos = self._json_decoder.raw_decode(self._buffer, self._pos)
+        return value
+
+    def _read_scalar(self):
+        """Decode and consume a JSON number, ``true``, ``false`` or ``null``."""
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if self._eof:
+                    raise
+            else:
+                # A number at the end of the buffer may continue in the
+                # next chunk
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            self._buffer = self._buffer[self._pos:] + self._read_chunk()
+            self._pos = 0
+
+
+_JSON_STRUCTURE_RE = re.compile(r'["{}\[\]]')
+_json_scanstring = json.decoder.scanstring
+
+
+class _JSONScanner(object):
+    """Finds the end of a JSON object, array or string that arrives in
+    pieces, keeping track of strings, escapes and nesting between them."""
+
+    def __init__(self):
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def scan(self, text, pos=0):
+        """Scan ``text`` from ``pos``, and return the index just past the end
+        of the value, or -1 if the value continues after ``text``."""
+        while pos < len(text):
+            if self._escaped:
+                self._escaped = False
+                pos += 1
+            elif self._in_string:
+                try:
+                    pos = _json_scanstring(text, pos, False)[1]
+                except ValueError:
+                    # The string continues in the next chunk. An odd number
+                    # of trailing backslashes starts an escape sequence.
+                    tail = text[pos:]
+                    self._escaped = (len(tail) - len(tail.rstrip('\\'))) % 2 == 1
+                    return -1
+                self._in_string = False
+                if self._depth == 0:
+                    return pos
+            else:
+                match = _JSON_STRUCTURE_RE.search(text, pos)
+                if match is None:
+                    return -1
+                pos = match.end()
+                char = match.group()
+                if char == '"':
+                    self._in_string = True
+                elif char in '{[':
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth <= 0:
+                        return pos
+        return -1
+
+
+def iter_message_xml_chunks(header, content_blocks, pretty_print=False):
+    """Serialize a message with Content Blocks as a sequence of byte strings.
+
+    The first chunk holds the message header (the ``header`` etree, which
+    must not contain any Content Blocks); each following chunk holds one
+    Content Block. The closing tag of the message is part of the last chunk.
+    Content Blocks are pulled from ``content_blocks`` one at a time, so it
+    can be a generator. The chunks add up to the same bytes as ``to_xml()``.
+
+    libtaxii users should not need to use this function directly.
+    """
+    # Each chunk is serialized as the children of an empty copy of the
+    # message element, and cut out of the result. The elements then rely on
+    # the namespace declarations of the message element, instead of
+    # repeating them as etree.xmlfile does for each element it writes.
+    wrapper = etree.Element(header.tag, attrib=dict(header.attrib), nsmap=header.nsmap)
+    wrapper.text = ''  # Serialized with an end tag, not as an empty element
+    empty = etree.tostring(wrapper, encoding='utf-8')
+    start_tag, end_tag = empty[:empty.rindex(b'</')], empty[empty.rindex(b'</'):]
+    wrapper.text = None
+    if pretty_print:
+        end_tag += b'\n'
+
+    def serialize(children, first):
+        if not children:
+            return b''
+        wrapper.extend(children)
+        data = etree.tostring(wrapper, pretty_print=pretty_print, encoding='utf-8')
+        del wrapper[:]
+        data = data[len(start_tag):data.rindex(b'</')]
+        if pretty_print and not first:
+            data = data[1:]  # The newline after the start tag
+        return data
+
+    children = list(header)
+    chunk = start_tag + serialize(children, True)
+    first = not children
+    for block in content_blocks:
+        yield chunk
+        chunk = serialize([block.to_etree()], first)
+        first = False
+
+    if first:  # No child elements, so the message is an empty element
+        yield etree.tostring(wrapper, pretty_print=pretty_print, encoding='utf-8')
+    else:
+        yield chunk + end_tag
+
+
+def write_message_xml(fileobj, header, content_blocks, pretty_print=False):
+    """Write a message with Content Blocks to a file-like object.
+
+    See :py:func:`iter_message_xml_chunks`.
+
+    libtaxii users should not need to use this function directly.
+    """
+    for chunk in iter_message_xml_chunks(header, content_blocks, pretty_print):
+        fileobj.write(chunk)
+
+
+def iter_message_json_chunks(header, content_blocks):
+    """Serialize a message with Content Blocks to JSON as a sequence of
+    byte strings.
+
+    The first chunk holds the message header (the ``header`` dict, which
+    must not contain any Content Blocks); each following chunk holds one
+    Content Block, and the last one closes the message. Content Blocks are
+    pulled from ``content_blocks`` one at a time, so it can be a generator.
+
+    libtaxii users should not need to use this function directly.
+    """
+    _decode_binary_fields(header)
+    # Leave the header object open, so the Content Blocks can be added to it
+    head = _dump_json_bytes(header).rstrip()[:-1].rstrip()
+    if header:
+        head += b', '
+    yield head + b'"content_blocks": ['
+
+    separator = b''
+    for block in content_blocks:
+        block_dict = block.to_dict()
+        _decode_binary_fields(block_dict)
+        yield separator + _dump_json_bytes(block_dict)
+        separator = b', '
+
+    yield b']}'
+
+
+class ContentBlockMessageMixin(object):
+    """Serialization, one Content Block at a time, for TAXII messages that
+    carry Content Blocks (Poll Responses and Inbox Messages).
+
+    Subclasses implement ``_header_etree()`` and ``_header_dict()``, which
+    return the etree and dict representations of the message without its
+    Content Blocks.
+
+    libtaxii users should not need to use this class directly.
+    """
+
+    __slots__ = ()
+
+    def iter_xml_chunks(self, pretty_print=False, content_blocks=None):
+        """Serialize this message to XML one Content Block at a time.
+
+        Args:
+            pretty_print (bool): Whether to indent the XML
+            content_blocks (iterable of ContentBlock): The Content Blocks to
+                write instead of ``self.content_blocks``. This can be a
+                generator, so that Content Blocks never need to all be in
+                memory at once. **Optional**
+        """
+        if content_blocks is None:
+            content_blocks = self.content_blocks
+        return iter_message_xml_chunks(self._header_etree(), content_blocks, pretty_print)
+
+    def write_xml(self, fileobj, pretty_print=False, content_blocks=None):
+        """Write this message as XML to a file-like object, one Content
+        Block at a time.
+
+        Args:
+            fileobj: A file-like object opened in binary mode
+            pretty_print (bool): Whether to indent the XML
+            content_blocks (iterable of ContentBlock): The Content Blocks to
+                write instead of ``self.content_blocks``. **Optional**
+        """
+        if content_blocks is None:
+            content_blocks = self.content_blocks
+        write_message_xml(fileobj, self._header_etree(), content_blocks, pretty_print)
+
+    def iter_json_chunks(self, content_blocks=None):
+        """Serialize this message to JSON one Content Block at a time.
+
+        Args:
+            content_blocks (iterable of ContentBlock): The Content Blocks to
+                write instead of ``self.content_blocks``. This can be a
+                generator, so that Content Blocks never need to all be in
+                memory at once. **Optional**
+        """
+        if content_blocks is None:
+            content_blocks = self.content_blocks
+        return iter_message_json_chunks(self._header_dict(), content_blocks)
+
+    def write_json(self, fileobj, content_blocks=None):
+        """Write this message as JSON to a file-like object, one Content
+        Block at a time.
+
+        Args:
+            fileobj: A file-like object opened in binary mode
+            content_blocks (iterable of ContentBlock): The Content Blocks to
+                write instead of ``self.content_blocks``. **Optional**
+        """
+        for chunk in self.iter_json_chunks(content_blocks):
+            fileobj.write(chunk)
+
+
+class _UnparsedXML(six.binary_type):
+    """The serialized XML content of a Content Block, which is only parsed
+    when its etree is needed."""
+    __slots__ = ()
+
+
+def unparsed_xml(data):
+    """Mark bytes as XML content to be parsed only when its etree is needed
+    (see :py:func:`is_unparsed_xml`).
+
+    libtaxii users should not need to use this function directly.
+    """
+    return _UnparsedXML(data)
+
+
+def is_unparsed_xml(content):
+    """Return whether ``content`` was marked with :py:func:`unparsed_xml`.
+
+    libtaxii users should not need to use this function directly.
+    """
+    return isinstance(content, _UnparsedXML)
+
+
+# xs:dateTime, which is what TAXII uses for every timestamp
+_XS_DATETIME_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?'
+                             r'(?:(Z)|([+-])(\d{2}):(\d{2}))?$')
+
+_UTC = tzutc()
+
+# Number of distinct timestamp strings remembered by parse_datetime_string
+_DATETIME_CACHE_SIZE = 1024
+
+
+def _parse_xs_datetime(datetime_string):
+    """Parse an xs:dateTime string, or return None if it isn't one."""
+    match = _XS_DATETIME_RE.match(datetime_string)
+    if not match:
+        return None
+
+    (year, month, day, hour, minute, second, fraction,
+     zulu, tz_sign, tz_hours, tz_minutes) = match.groups()
+
+    if zulu:
+        tzinfo = _UTC
+    elif tz_sign:
+        offset = int(tz_hours) * 3600 + int(tz_minutes) * 60
+        if tz_sign == '-':
+            offset = -offset
+        tzinfo = _UTC if offset == 0 else tzoffset(None, offset)
+    else:
+        tzinfo = None
+
+    # Like dateutil, keep at most microsecond precision
+    microsecond = int(fraction[:6].ljust(6, '0')) if fraction else 0
+
+    try:
+        return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                                 microsecond, tzinfo)
+    except ValueError:  # e.g., 24:00:00 or a month of 13
+        return None
+
+
+def _parse_datetime_string(datetime_string):
+    dt = _parse_xs_datetime(datetime_string)
+    if dt is None:
+        dt = dateutil.parser.parse(datetime_string)
+    return dt
+
+
+if lru_cache is not None:
+    _parse_datetime_string = lru_cache(maxsize=_DATETIME_CACHE_SIZE)(_parse_datetime_string)
+else:
+    _uncached_parse_datetime_string = _parse_datetime_string
+    _DATETIME_CACHE = {}
+
+    def _parse_datetime_string(datetime_string):
+        try:
+            return _DATETIME_CACHE[datetime_string]
+        except KeyError:
+            pass
+        dt = _uncached_parse_datetime_string(datetime_string)
+        if len(_DATETIME_CACHE) >= _DATETIME_CACHE_SIZE:
+            _DATETIME_CACHE.clear()
+        _DATETIME_CACHE[datetime_string] = dt
+        return dt
 
 
 def parse_datetime_string(datetime_string):
     """Parse a string into a :py:class:`datetime.datetime`.
 
+    xs:dateTime strings (the only format TAXII allows) are parsed directly;
+    anything else is handed to ``dateutil.parser``. Results are cached, since
+    the Content Blocks in a single message often share timestamps.
+
     libtaxii users should not need to use this function directly.
     """
     if not datetime_string:
         return None
-    return dateutil.parser.parse(datetime_string)
+    return _parse_datetime_string(datetime_string)
 
 
 def generate_message_id(maxlen=5, version=VID_TAXII_SERVICES_10):
@@ -145,6 +854,46 @@ def generate_message_id(maxlen=5, version=VID_TAXII_SERVICES_10):
     return message_id
 
 
+def detach_element(elt):
+    """Return a copy of an element in a document of its own, without
+    namespace declarations that it does not use.
+
+    An element keeps the whole document it belongs to alive, so the content
+    of one Content Block would otherwise keep the entire message it was
+    parsed from in memory.
+
+    libtaxii users should not need to use this function directly.
+    """
+    detached = copy.deepcopy(elt)
+    detached.tail = None
+    etree.cleanup_namespaces(detached)
+    return detached
+
+
+# A string can only be an XML document if its first character, after an
+# optional byte order mark and whitespace, is '<'.
+_XML_START_RE = re.compile(u'\ufeff?[ \t\r\n]*<')
+_XML_START_BYTES_RE = re.compile(b'(?:\xef\xbb\xbf)?[ \t\r\n]*<')
+
+
+def might_be_xml(value):
+    """Return False if a string or byte string certainly isn't an XML
+    document.
+
+    This is much cheaper than a failed attempt to parse the string, so it is
+    used to skip parsing content such as base64 or S/MIME data.
+
+    :param value: A string or byte string. Any other value returns False.
+    """
+    if isinstance(value, six.binary_type):
+        if value[:1] in (b'\xff', b'\xfe', b'\x00'):  # Possibly UTF-16 or UTF-32; let the parser decide
+            return True
+        return _XML_START_BYTES_RE.match(value) is not None
+    if isinstance(value, six.text_type):
+        return _XML_START_RE.match(value) is not None
+    return False
+
+
 def append_any_content_etree(etree_elt, content):
     """
     General method for adding content to an etree element. This method can handle:
@@ -153,6 +902,9 @@ def append_any_content_etree(etree_elt, content):
     * any python type that can be cast to str
     * str
 
+    String content is parsed as XML if it might be XML (see
+    :py:func:`might_be_xml`), and kept as text otherwise or if it fails to
+    parse.
 
     :param etree_elt: The etree to append the content to
     :param content: The content to append
@@ -172,11 +924,13 @@ def append_any_content_etree(etree_elt, content):
         return etree_elt
 
     # If content is a string, need to check if it's XML or not
-    try:
-        etree_elt.append(etree.XML(content, get_xml_parser()))
-    except etree.XMLSyntaxError:
-        etree_elt.text = content
-
+    if might_be_xml(content):
+        try:
+            etree_elt.append(etree.XML(content, get_xml_parser()))
+            return etree_elt
+        except etree.XMLSyntaxError:
+            pass
+    etree_elt.text = content
     return etree_elt
 
 
@@ -202,14 +956,54 @@ def gen_filename(collection_name, format_part, date_string, extension):
                 ).translate(None, '/\\:*?"<>|')
 
 
+_SLOT_NAMES = {}
+
+
+def _get_slot_names(cls):
+    """Return the names of all ``__slots__`` defined by ``cls`` and its bases."""
+    try:
+        return _SLOT_NAMES[cls]
+    except KeyError:
+        pass
+
+    names = []
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get('__slots__', ())
+        if isinstance(slots, six.string_types):
+            slots = (slots,)
+        names.extend(name for name in slots if name not in ('__dict__', '__weakref__'))
+    _SLOT_NAMES[cls] = names
+    return names
+
+
+def _get_members(obj):
+    """Return the names of all instance members that are set on ``obj``,
+    whether they are stored in ``__slots__`` or in the instance ``__dict__``.
+
+    libtaxii users should not need to use this function directly.
+    """
+    members = [name for name in _get_slot_names(obj.__class__) if hasattr(obj, name)]
+    members.extend(getattr(obj, '__dict__', ()))
+    return members
+
+
 class TAXIIBase(object):
 
     """
     Base class for all TAXII Messages and Message component types.
 
     libtaxii users should not need to use this class directly.
+
+    Message component classes, which can be created in large numbers, define
+    ``__slots__`` to avoid a per-instance ``__dict__``.
     """
 
+    __slots__ = ()
+
+    #: Names of members that only cache values derived from other members.
+    #: These are ignored when comparing objects.
+    _cache_members = ()
+
     @property
     def sort_key(self):
         """
@@ -246,6 +1040,27 @@ class TAXIIBase(object):
 
         return json.dumps(content_dict)
 
+    def iter_json_chunks(self):
+        """Create a JSON representation of this class, as an iterator of
+        byte strings.
+
+        Subclasses that can hold many Content Blocks override this to
+        serialize one Content Block at a time.
+        """
+        content_dict = self.to_dict()
+        _decode_binary_fields(content_dict)
+        yield _dump_json_bytes(content_dict)
+
+    def write_json(self, fileobj):
+        """Write a JSON representation of this class to a file-like object
+        opened in binary mode.
+
+        The JSON is encoded with the function returned by
+        :py:func:`get_json_dumps`.
+        """
+        for chunk in self.iter_json_chunks():
+            fileobj.write(chunk)
+
     def to_xml(self, pretty_print=False):
         """Create an XML representation of this class.
 
@@ -253,6 +1068,22 @@ class TAXIIBase(object):
         """
         return etree.tostring(self.to_etree(), pretty_print=pretty_print, encoding='utf-8')
 
+    def iter_xml_chunks(self, pretty_print=False):
+        """Create an XML representation of this class, as an iterator of
+        byte strings.
+
+        Subclasses that can hold many Content Blocks override this to
+        serialize one Content Block at a time.
+        """
+        yield self.to_xml(pretty_print=pretty_print)
+
+    def write_xml(self, fileobj, pretty_print=False):
+        """Write an XML representation of this class to a file-like object
+        opened in binary mode.
+        """
+        for chunk in self.iter_xml_chunks(pretty_print=pretty_print):
+            fileobj.write(chunk)
+
     def to_text(self, line_prepend=''):
         """Create a nice looking (this is a subjective term!)
         textual representation of this class. Subclasses should
@@ -295,6 +1126,13 @@ class TAXIIBase(object):
     def __str__(self):
         return self.to_xml(pretty_print=True)
 
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in _get_members(self))
+
+    def __setstate__(self, state):
+        for name, value in six.iteritems(state):
+            setattr(self, name, value)
+
     def __eq__(self, other, debug=False):
         """
         Generic method used to check equality of objects of any TAXII type.
@@ -305,6 +1143,7 @@ class TAXIIBase(object):
         following criteria:
         1. All class properties start with one underscore.
         2. The sort_key property is implemented.
+        3. Members that only cache derived values are named in _cache_members.
 
         Args:
             self (object): this object
@@ -323,7 +1162,8 @@ class TAXIIBase(object):
             return False
 
         # Get all member properties that start with '_'
-        members = [attr for attr in vars(self) if attr.startswith('_') and not attr.startswith('__')]
+        members = [attr for attr in _get_members(self) if attr.startswith('_') and not attr.startswith('__')
+                   and attr not in self._cache_members]
         for member in members:
             if debug:
                 print('member name: %s' % member)
@@ -389,8 +1229,39 @@ class TAXIIBase(object):
         return not self.__eq__(other, debug)
 
 
+_XPATH_CACHE = {}
+
+# Number of compiled XPath expressions remembered by get_xpath
+_XPATH_CACHE_SIZE = 1024
+
+
+def get_xpath(xpath, ns_map=None):
+    """Return a compiled ``etree.XPath`` for an XPath expression.
+
+    Each expression is compiled once per namespace map and then reused, so
+    deserializing many messages does not compile the same XPath repeatedly.
+
+    libtaxii users should not need to use this function directly.
+    """
+    # Key on the contents of ns_map, so that equal maps share an entry and a
+    # changed map is not given a stale expression
+    key = (xpath, frozenset(ns_map.items()) if ns_map else None)
+    try:
+        return _XPATH_CACHE[key]
+    except KeyError:
+        compiled = etree.XPath(xpath, namespaces=ns_map)
+        if len(_XPATH_CACHE) >= _XPATH_CACHE_SIZE:
+            _XPATH_CACHE.clear()
+        _XPATH_CACHE[key] = compiled
+        return compiled
+
+
+def get_all(etree_xml, xpath, ns_map=None):
+    return get_xpath(xpath, ns_map)(etree_xml)
+
+
 def get_required(etree_xml, xpath, ns_map):
-    elements = etree_xml.xpath(xpath, namespaces=ns_map)
+    elements = get_all(etree_xml, xpath, ns_map)
     if len(elements) == 0:
         raise ValueError('Element "%s" is required' % xpath)
     return elements[0]
@@ -412,7 +1283,7 @@ def get_optional_text(etree_xml, xpath, ns_map):
 
 def _decode_binary_fields(dict_obj):
     """Given a dict, decode any binary values, assuming UTF-8 encoding.
-    Will recurse into nested dicts.
+    Will recurse into nested dicts, and dicts in lists.
     Modifies the values in-place.
     """
     for key, value in dict_obj.items():
@@ -423,10 +1294,21 @@ def _decode_binary_fields(dict_obj):
         elif isinstance(value, dict):
             _decode_binary_fields(value)
 
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    _decode_binary_fields(item)
+
 
-def stringify_content(content):
+def stringify_content(content, is_xml=None):
     """Always a string or raises an error.
     Returns the string representation and whether the data is XML.
+
+    If ``is_xml`` is None, content that isn't an etree is parsed as XML if it
+    might be XML (see :py:func:`might_be_xml`), and treated as a string if
+    that fails. If ``is_xml`` is True, the content is parsed as XML and an
+    ``etree.XMLSyntaxError`` is raised if it is not well-formed; if it is
+    False, the content is treated as a string without being parsed.
     """
     # If it's an etree, it's definitely XML
     if isinstance(content, etree._ElementTree):
@@ -436,17 +1318,27 @@ def stringify_content(content):
         return content, True
 
     if hasattr(content, 'read'):  # The content is file-like
-        try:  # Try to parse as XML
-            xml = parse(content, allow_file=True)
-            return xml, True
-        except etree.XMLSyntaxError:  # Content is not well-formed XML; just treat as a string
-            return content.read(), False
-    else:  # The Content is not file-like
+        if is_xml:
+            return parse(content, allow_file=True), True
+        if is_xml is None:
+            try:  # Try to parse as XML
+                xml = parse(content, allow_file=True)
+                return xml, True
+            except etree.XMLSyntaxError:  # Content is not well-formed XML; just treat as a string
+                pass
+        return content.read(), False
+
+    # The Content is not file-like
+    if is_xml:
+        return parse_xml_string(content), True
+    if is_xml is None and might_be_xml(content):
         try:  # Attempt to parse string as XML
             xml = parse_xml_string(content)
             return xml, True
         except etree.XMLSyntaxError:  # Content is not well-formed XML; just treat as a string
-            if isinstance(content, six.string_types):  # It's a string of some kind, unicode or otherwise
-                return content, False
-            else:  # It's some other datatype that needs casting to string
-                return str(content), False
+            pass
+
+    if isinstance(content, six.string_types):  # It's a string of some kind, unicode or otherwise
+        return content, False
+    else:  # It's some other datatype that needs casting to string
+        return str(content), False
@@ -316,6 +316,9 @@ VID_TAXII_HTTPS_10 = 'urn:taxii.mitre.org:protocol:https:1.0'
 # Third Party Version IDs
 #: Version ID for the CERT EU JSON Message Binding
 VID_CERT_EU_JSON_10 = 'urn:cert.europa.eu:message:json:1.0'
+#: Version ID for the libtaxii binary Message Binding, a compact encoding of
+#: TAXII 1.1 messages for exchanges between libtaxii peers
+VID_LIBTAXII_BINARY_11 = 'urn:libtaxii:message:binary:1.1'
 
 
 # TAXII Content Bindings #
@@ -5,6 +5,7 @@
 Creating, handling, and parsing TAXII 1.0 messages.
 """
 
+import codecs
 import six
 
 try:
@@ -17,9 +18,11 @@ import warnings
 from lxml import etree
 
 from .common import (parse, parse_datetime_string, append_any_content_etree, TAXIIBase,
-                     get_required, get_optional, get_optional_text, parse_xml_string,
-                     stringify_content)
-from .validation import do_check, uri_regex, check_timestamp_label, message_id_regex_10
+                     get_required, get_optional, get_optional_text, get_all, parse_xml_string,
+                     stringify_content, iterparse_content_blocks, detach_element, might_be_xml,
+                     iterparse_json_content_blocks)
+from . import common
+from .validation import local_validation_level, do_check, uri_regex, check_timestamp_label, message_id_regex_10
 from .constants import *
 
 
@@ -53,7 +56,7 @@ def validate_xml(xml_string):
     return valid
 
 
-def get_message_from_xml(xml_string, encoding='utf_8'):
+def get_message_from_xml(xml_string, encoding='utf_8', validation_level=None, detach_content=False):
     """Create a TAXIIMessage object from an XML string.
 
     This function automatically detects which type of Message should be created
@@ -61,6 +64,15 @@ def get_message_from_xml(xml_string, encoding='utf_8'):
 
     Args:
         xml_string (str): The XML to parse into a TAXII message.
+        encoding (str): The encoding of the string; defaults to UTF-8
+        validation_level (str): The validation level to use while building
+            the message (see :py:mod:`libtaxii.validation`); defaults to the
+            global level. Use ``VALIDATION_NONE`` to skip checks on trusted
+            input.
+        detach_content (bool): Whether to move the XML content of each
+            Content Block into a document of its own (see
+            :py:meth:`ContentBlock.detach`), so that keeping some Content
+            Blocks does not keep the whole message in memory.
 
     Example:
         .. code-block:: python
@@ -68,40 +80,111 @@ def get_message_from_xml(xml_string, encoding='utf_8'):
             message_xml = message.to_xml()
             new_message = tm10.get_message_from_xml(message_xml)
     """
+    etree_xml = None
     if isinstance(xml_string, six.binary_type):
-        xml_string = xml_string.decode(encoding, 'replace')
-    etree_xml = parse_xml_string(xml_string)
-    qn = etree.QName(etree_xml)
-    if qn.namespace != ns_map['taxii']:
-        raise ValueError('Unsupported namespace: %s' % qn.namespace)
-
-    message_type = qn.localname
-
-    if message_type == MSG_DISCOVERY_REQUEST:
-        return DiscoveryRequest.from_etree(etree_xml)
-    if message_type == MSG_DISCOVERY_RESPONSE:
-        return DiscoveryResponse.from_etree(etree_xml)
-    if message_type == MSG_FEED_INFORMATION_REQUEST:
-        return FeedInformationRequest.from_etree(etree_xml)
-    if message_type == MSG_FEED_INFORMATION_RESPONSE:
-        return FeedInformationResponse.from_etree(etree_xml)
-    if message_type == MSG_POLL_REQUEST:
-        return PollRequest.from_etree(etree_xml)
-    if message_type == MSG_POLL_RESPONSE:
-        return PollResponse.from_etree(etree_xml)
-    if message_type == MSG_STATUS_MESSAGE:
-        return StatusMessage.from_etree(etree_xml)
-    if message_type == MSG_INBOX_MESSAGE:
-        return InboxMessage.from_etree(etree_xml)
-    if message_type == MSG_MANAGE_FEED_SUBSCRIPTION_REQUEST:
-        return ManageFeedSubscriptionRequest.from_etree(etree_xml)
-    if message_type == MSG_MANAGE_FEED_SUBSCRIPTION_RESPONSE:
-        return ManageFeedSubscriptionResponse.from_etree(etree_xml)
-
-    raise ValueError('Unknown message_type: %s' % message_type)
-
-
-def get_message_from_dict(d):
+        if codecs.lookup(encoding).name == 'utf-8':
+            # Let lxml read the bytes directly. This avoids decoding and
+            # re-encoding the whole document before it is parsed.
+            try:
+                etree_xml = parse_xml_string(xml_string)
+            except etree.XMLSyntaxError:
+                pass  # Fall back to replacing undecodable bytes, below
+        if etree_xml is None:
+            xml_string = xml_string.decode(encoding, 'replace')
+    if etree_xml is None:
+        etree_xml = parse_xml_string(xml_string)
+
+    with local_validation_level(validation_level):
+        message = _get_message_from_etree(etree_xml)
+
+    if detach_content:
+        for content_block in getattr(message, 'content_blocks', ()):
+            content_block.detach()
+    return message
+
+
+def _get_message_from_etree(etree_xml):
+    message_class = _MESSAGE_CLASSES_BY_TAG.get(etree_xml.tag)
+    if message_class is None:
+        qn = etree.QName(etree_xml)
+        if qn.namespace != ns_map['taxii']:
+            raise ValueError('Unsupported namespace: %s' % qn.namespace)
+        raise ValueError('Unknown message_type: %s' % qn.localname)
+
+    return message_class.from_etree(etree_xml)
+
+
+def iter_poll_response(source, detach_content=True):
+    """Incrementally parse a Poll Response or Inbox Message.
+
+    This is a generator for messages that are too large to hold in memory at
+    once. The first item yielded is the message itself (a
+    :py:class:`PollResponse` or :py:class:`InboxMessage`) with an empty
+    ``content_blocks`` list, carrying the header fields (e.g., ``feed_name``
+    and the timestamp labels). Every following item is a
+    :py:class:`ContentBlock`, in document order. Content Blocks are discarded
+    from the parsed tree as soon as they have been yielded.
+
+    If the XML is any other TAXII 1.0 message (e.g., a Status Message), that
+    message is yielded as the only item.
+
+    Args:
+        source: A file-like object opened in binary mode (e.g., an HTTP
+            response), or a byte string.
+        detach_content (bool): Whether to move the XML content of each
+            Content Block into a document of its own (see
+            :py:meth:`ContentBlock.detach`). Defaults to True.
+
+    Example:
+        .. code-block:: python
+
+            items = tm10.iter_poll_response(http_response)
+            poll_response = next(items)
+            for content_block in items:
+                handle(content_block)
+    """
+    return iterparse_content_blocks(source, _ITER_MESSAGE_CLASSES, ContentBlock, _get_message_from_etree,
+                                    detach_content)
+
+
+def iter_poll_response_json(source, encoding='utf_8'):
+    """Incrementally parse a Poll Response or Inbox Message from JSON.
+
+    This is the JSON counterpart of :py:func:`iter_poll_response`, for the
+    JSON produced by ``to_json()`` and ``write_json()``. The first item
+    yielded is the message itself with an empty ``content_blocks`` list, and
+    every following item is a :py:class:`ContentBlock`, decoded one at a time
+    from the ``content_blocks`` array.
+
+    Content Blocks are only decoded one at a time if ``content_blocks`` is the
+    last member of the JSON object, as written by libtaxii. Otherwise, the
+    items are the same, but the whole array is read before any are yielded.
+
+    If the JSON is any other TAXII 1.0 message (e.g., a Status Message), that
+    message is yielded as the only item.
+
+    Args:
+        source: A file-like object opened in binary mode (e.g., an HTTP
+            response), a byte string or a text string.
+        encoding (str): The encoding of ``source``, if it is binary; defaults
+            to UTF-8
+
+    Example:
+        .. code-block:: python
+
+            items = tm10.iter_poll_response_json(http_response)
+            poll_response = next(items)
+            for content_block in items:
+                handle(content_block)
+    """
+    message_classes = {
+        MSG_POLL_RESPONSE: PollResponse,
+        MSG_INBOX_MESSAGE: InboxMessage,
+    }
+    return iterparse_json_content_blocks(source, message_classes, ContentBlock, get_message_from_dict, encoding)
+
+
+def get_message_from_dict(d, validation_level=None):
     """Create a TAXIIMessage object from a dictonary.
 
     This function automatically detects which type of Message should be created
@@ -109,6 +192,10 @@ def get_message_from_dict(d):
 
     Args:
         d (dict): The dictionary to build the TAXII message from.
+        validation_level (str): The validation level to use while building
+            the message (see :py:mod:`libtaxii.validation`); defaults to the
+            global level. Use ``VALIDATION_NONE`` to skip checks on trusted
+            input.
 
     Example:
         .. code-block:: python
@@ -120,31 +207,14 @@ def get_message_from_dict(d):
         raise ValueError('message_type is a required field!')
 
     message_type = d['message_type']
-    if message_type == MSG_DISCOVERY_REQUEST:
-        return DiscoveryRequest.from_dict(d)
-    if message_type == MSG_DISCOVERY_RESPONSE:
-        return DiscoveryResponse.from_dict(d)
-    if message_type == MSG_FEED_INFORMATION_REQUEST:
-        return FeedInformationRequest.from_dict(d)
-    if message_type == MSG_FEED_INFORMATION_RESPONSE:
-        return FeedInformationResponse.from_dict(d)
-    if message_type == MSG_POLL_REQUEST:
-        return PollRequest.from_dict(d)
-    if message_type == MSG_POLL_RESPONSE:
-        return PollResponse.from_dict(d)
-    if message_type == MSG_STATUS_MESSAGE:
-        return StatusMessage.from_dict(d)
-    if message_type == MSG_INBOX_MESSAGE:
-        return InboxMessage.from_dict(d)
-    if message_type == MSG_MANAGE_FEED_SUBSCRIPTION_REQUEST:
-        return ManageFeedSubscriptionRequest.from_dict(d)
-    if message_type == MSG_MANAGE_FEED_SUBSCRIPTION_RESPONSE:
-        return ManageFeedSubscriptionResponse.from_dict(d)
-
-    raise ValueError('Unknown message_type: %s' % message_type)
-
-
-def get_message_from_json(json_string, encoding='utf_8'):
+    if message_type not in _MESSAGE_CLASSES:
+        raise ValueError('Unknown message_type: %s' % message_type)
+
+    with local_validation_level(validation_level):
+        return _MESSAGE_CLASSES[message_type].from_dict(d)
+
+
+def get_message_from_json(json_string, encoding='utf_8', validation_level=None):
     """Create a TAXIIMessage object from a JSON string.
 
     This function automatically detects which type of Message should be created
@@ -152,12 +222,20 @@ def get_message_from_json(json_string, encoding='utf_8'):
 
     Args:
         json_string (str): The JSON to parse into a TAXII message.
+        encoding (str): The encoding of the string, if it is a byte string;
+            defaults to UTF-8
+        validation_level (str): The validation level to use while building
+            the message (see :py:mod:`libtaxii.validation`); defaults to the
+            global level. Use ``VALIDATION_NONE`` to skip checks on trusted
+            input.
     """
-    decoded_string = json_string.decode(encoding, 'replace')
-    return get_message_from_dict(json.loads(decoded_string))
+    if isinstance(json_string, six.binary_type):
+        json_string = json_string.decode(encoding, 'replace')
+    return get_message_from_dict(json.loads(json_string), validation_level)
 
 
 class TAXIIBase10(TAXIIBase):
+    __slots__ = ()
     version = VID_TAXII_XML_10
 
 
@@ -179,6 +257,8 @@ class DeliveryParameters(TAXIIBase10):
             receive for this TAXII Data Feed. **Optional**
     """
 
+    __slots__ = ('_content_bindings', '_delivery_message_binding', '_inbox_address', '_inbox_protocol')
+
     # TODO: Should the default arguments of these change? I'm not sure these are
     # actually optional
 
@@ -288,7 +368,7 @@ class DeliveryParameters(TAXIIBase10):
         delivery_message_binding = get_optional_text(etree_xml, './taxii:Message_Binding', ns_map)
 
         content_bindings = []
-        for binding in etree_xml.xpath('./taxii:Content_Binding', namespaces=ns_map):
+        for binding in get_all(etree_xml, './taxii:Content_Binding', ns_map):
             content_bindings.append(binding.text)
 
         return DeliveryParameters(inbox_protocol, inbox_address, delivery_message_binding, content_bindings)
@@ -432,18 +512,18 @@ class TAXIIMessage(TAXIIBase10):
             raise ValueError('%s != %s' % (tag, expected_tag))
 
         # Get the message ID
-        message_id = get_required(src_etree, '/taxii:*/@message_id', ns_map)
+        message_id = get_required(src_etree, './@message_id', ns_map)
 
         # Get in response to, if present
-        in_response_to = get_optional(src_etree, '/taxii:*/@in_response_to', ns_map)
+        in_response_to = get_optional(src_etree, './@in_response_to', ns_map)
         if in_response_to is not None:
             kwargs['in_response_to'] = in_response_to
 
         # Get the Extended headers
-        extended_header_list = src_etree.xpath('/taxii:*/taxii:Extended_Headers/taxii:Extended_Header', namespaces=ns_map)
+        extended_header_list = get_all(src_etree, './taxii:Extended_Headers/taxii:Extended_Header', ns_map)
         extended_headers = {}
         for header in extended_header_list:
-            eh_name = header.xpath('./@name')[0]
+            eh_name = get_all(header, './@name', ns_map)[0]
             # eh_value = header.text
             if len(header) == 0:  # This has string content
                 eh_value = header.text
@@ -478,10 +558,11 @@ class TAXIIMessage(TAXIIBase10):
         message_id = d['message_id']
         extended_headers = {}
         for k, v in six.iteritems(d['extended_headers']):
-            try:
-                v = parse(v, allow_file=False)
-            except etree.XMLSyntaxError:
-                pass
+            if might_be_xml(v):
+                try:
+                    v = parse(v, allow_file=False)
+                except etree.XMLSyntaxError:
+                    pass
             extended_headers[k] = v
 
         in_response_to = d.get('in_response_to')
@@ -509,13 +590,23 @@ class ContentBlock(TAXIIBase10):
             Content Block. **Optional**
         padding (string): an arbitrary amount of padding for this Content
             Block. **Optional**
+        content_is_xml (bool): whether ``content`` is XML, if the caller
+            knows. A string is then parsed, or kept as a string, without
+            first trying to parse it as XML. **Optional**
+
+    XML content is kept as an etree and is only serialized the first time
+    ``content`` is read; the serialized bytes are cached after that. If the
+    etree is modified in place, set ``content`` again to reset the cache.
     """
 
+    __slots__ = ('_content', '_content_binding', '_content_bytes', '_content_is_xml', '_timestamp_label', 'padding')
+
     NAME = 'Content_Block'
+    _cache_members = ('_content_bytes',)
 
-    def __init__(self, content_binding, content, timestamp_label=None, padding=None):
+    def __init__(self, content_binding, content, timestamp_label=None, padding=None, content_is_xml=None):
         self.content_binding = content_binding
-        self.content = content
+        self.set_content(content, content_is_xml)
         self.timestamp_label = timestamp_label
         self.padding = padding
 
@@ -535,14 +626,30 @@ class ContentBlock(TAXIIBase10):
     @property
     def content(self):
         if self.content_is_xml:
-            return etree.tostring(self._content, encoding='utf-8')
+            # XML content is only serialized on first access; the bytes are
+            # kept until new content is set.
+            if self._content_bytes is None:
+                self._content_bytes = etree.tostring(self._content, encoding='utf-8')
+            return self._content_bytes
         else:
             return self._content
 
     @content.setter
     def content(self, value):
-        do_check(value, 'content')  # Just check for not None
-        self._content, self.content_is_xml = stringify_content(value)
+        self.set_content(value)
+
+    def set_content(self, content, is_xml=None):
+        """Set the content of this Content Block.
+
+        Args:
+            content (string or etree): the new content
+            is_xml (bool): whether ``content`` is XML, if known. If None, a
+                string is parsed as XML if it looks like XML, and kept as a
+                string otherwise.
+        """
+        do_check(content, 'content')  # Just check for not None
+        self._content, self.content_is_xml = stringify_content(content, is_xml)
+        self._content_bytes = None
 
     @property
     def content_is_xml(self):
@@ -553,6 +660,19 @@ class ContentBlock(TAXIIBase10):
         do_check(value, 'content_is_xml', value_tuple=(True, False))
         self._content_is_xml = value
 
+    def __getstate__(self):
+        # etree elements can't be pickled, so XML content is pickled as bytes
+        state = super(ContentBlock, self).__getstate__()
+        state['_content'] = self.content
+        state.pop('_content_bytes', None)
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        content = state.pop('_content')
+        super(ContentBlock, self).__setstate__(state)
+        self.set_content(content, state.get('_content_is_xml'))
+
     @property
     def timestamp_label(self):
         return self._timestamp_label
@@ -562,6 +682,20 @@ class ContentBlock(TAXIIBase10):
         value = check_timestamp_label(value, 'timestamp_label', can_be_none=True)
         self._timestamp_label = value
 
+    def detach(self):
+        """Move XML content that was parsed from a message into a document of
+        its own.
+
+        Until then, the content keeps the whole parsed message alive, including
+        the content of every other Content Block. Namespace declarations that
+        the content does not use are dropped. This does nothing for string
+        content, or for content that is not part of a larger document.
+        """
+        if self.content_is_xml and self._content.getparent() is not None:
+            self._content = detach_element(self._content)
+            # The cached bytes declare the namespaces that were just dropped
+            self._content_bytes = None
+
     def to_etree(self):
         block = etree.Element('{%s}Content_Block' % ns_map['taxii'], nsmap=ns_map)
         cb = etree.SubElement(block, '{%s}Content_Binding' % ns_map['taxii'])
@@ -587,10 +721,7 @@ class ContentBlock(TAXIIBase10):
         block = {}
         block['content_binding'] = self.content_binding
 
-        if self.content_is_xml:
-            block['content'] = etree.tostring(self._content, encoding='utf-8')
-        else:
-            block['content'] = self._content
+        block['content'] = self.content
         block['content_is_xml'] = self.content_is_xml
 
         if self.timestamp_label:
@@ -627,6 +758,7 @@ class ContentBlock(TAXIIBase10):
         content = get_required(etree_xml, './taxii:Content', ns_map)
 
         if len(content) == 0:  # This has string content
+            # Text may be escaped or CDATA-wrapped XML, so it is still sniffed
             kwargs['content'] = content.text
         else:  # This has XML content
             kwargs['content'] = content[0]
@@ -643,12 +775,13 @@ class ContentBlock(TAXIIBase10):
         if d.get('timestamp_label'):
             kwargs['timestamp_label'] = parse_datetime_string(d['timestamp_label'])
 
-        is_xml = d.get('content_is_xml', False)
+        is_xml = d.get('content_is_xml')
         if is_xml:
             #FIXME: to parse or not to parse the content - this should be configurable
             kwargs['content'] = parse(d['content'], allow_file=False)
         else:
             kwargs['content'] = d['content']
+            kwargs['content_is_xml'] = is_xml  # None if the dict doesn't say
 
         cb = ContentBlock(**kwargs)
         return cb
@@ -738,7 +871,7 @@ class DiscoveryResponse(TAXIIMessage):
     def from_etree(cls, etree_xml):
         msg = super(DiscoveryResponse, cls).from_etree(etree_xml)
         msg.service_instances = []
-        for service_instance in etree_xml.xpath('./taxii:Service_Instance', namespaces=ns_map):
+        for service_instance in get_all(etree_xml, './taxii:Service_Instance', ns_map):
             si = ServiceInstance.from_etree(service_instance)
             msg.service_instances.append(si)
         return msg
@@ -781,6 +914,9 @@ class ServiceInstance(TAXIIBase10):
     The ``message_bindings`` list must contain at least one value.
     """
 
+    __slots__ = ('_available', '_inbox_service_accepted_content', '_message_bindings', '_protocol_binding',
+                 '_service_address', '_service_type', '_services_version', 'message')
+
     def __init__(self, service_type, services_version, protocol_binding,
                  service_address, message_bindings,
                  inbox_service_accepted_content=None, available=None,
@@ -929,11 +1065,11 @@ class ServiceInstance(TAXIIBase10):
         service_address = get_required(etree_xml, './taxii:Address', ns_map).text
 
         message_bindings = []
-        for mb in etree_xml.xpath('./taxii:Message_Binding', namespaces=ns_map):
+        for mb in get_all(etree_xml, './taxii:Message_Binding', ns_map):
             message_bindings.append(mb.text)
 
         inbox_service_accepted_contents = []
-        for cb in etree_xml.xpath('./taxii:Content_Binding', namespaces=ns_map):
+        for cb in get_all(etree_xml, './taxii:Content_Binding', ns_map):
             inbox_service_accepted_contents.append(cb.text)
 
         message = get_optional_text(etree_xml, './taxii:Message', ns_map)
@@ -1026,7 +1162,7 @@ class FeedInformationResponse(TAXIIMessage):
     def from_etree(cls, etree_xml):
         msg = super(FeedInformationResponse, cls).from_etree(etree_xml)
         msg.feed_informations = []
-        feed_informations = etree_xml.xpath('./taxii:Feed', namespaces=ns_map)
+        feed_informations = get_all(etree_xml, './taxii:Feed', ns_map)
         for feed in feed_informations:
             msg.feed_informations.append(FeedInformation.from_etree(feed))
         return msg
@@ -1075,6 +1211,9 @@ class FeedInformation(TAXIIBase10):
     subscription services.
     """
 
+    __slots__ = ('_available', '_feed_name', '_polling_service_instances', '_push_methods', '_subscription_methods',
+                 '_supported_contents', 'feed_description')
+
     def __init__(self, feed_name, feed_description, supported_contents,
                  available=None, push_methods=None,
                  polling_service_instances=None, subscription_methods=None):
@@ -1215,19 +1354,19 @@ class FeedInformation(TAXIIBase10):
         kwargs['feed_description'] = get_required(etree_xml, './taxii:Description', ns_map).text
 
         kwargs['supported_contents'] = []
-        for binding_elt in etree_xml.xpath('./taxii:Content_Binding', namespaces=ns_map):
+        for binding_elt in get_all(etree_xml, './taxii:Content_Binding', ns_map):
             kwargs['supported_contents'].append(binding_elt.text)
 
         kwargs['push_methods'] = []
-        for push_method_elt in etree_xml.xpath('./taxii:Push_Method', namespaces=ns_map):
+        for push_method_elt in get_all(etree_xml, './taxii:Push_Method', ns_map):
             kwargs['push_methods'].append(PushMethod.from_etree(push_method_elt))
 
         kwargs['polling_service_instances'] = []
-        for polling_elt in etree_xml.xpath('./taxii:Polling_Service', namespaces=ns_map):
+        for polling_elt in get_all(etree_xml, './taxii:Polling_Service', ns_map):
             kwargs['polling_service_instances'].append(PollingServiceInstance.from_etree(polling_elt))
 
         kwargs['subscription_methods'] = []
-        for subscription_elt in etree_xml.xpath('./taxii:Subscription_Service', namespaces=ns_map):
+        for subscription_elt in get_all(etree_xml, './taxii:Subscription_Service', ns_map):
             kwargs['subscription_methods'].append(SubscriptionMethod.from_etree(subscription_elt))
 
         return FeedInformation(**kwargs)
@@ -1273,6 +1412,8 @@ class PushMethod(TAXIIBase10):
             **Required**
     """
 
+    __slots__ = ('_push_message_bindings', '_push_protocol')
+
     def __init__(self, push_protocol, push_message_bindings):
         self.push_protocol = push_protocol
         self.push_message_bindings = push_message_bindings
@@ -1329,7 +1470,7 @@ class PushMethod(TAXIIBase10):
         kwargs = {}
         kwargs['push_protocol'] = get_required(etree_xml, './taxii:Protocol_Binding', ns_map).text
         kwargs['push_message_bindings'] = []
-        for message_binding in etree_xml.xpath('./taxii:Message_Binding', namespaces=ns_map):
+        for message_binding in get_all(etree_xml, './taxii:Message_Binding', ns_map):
             kwargs['push_message_bindings'].append(message_binding.text)
         return PushMethod(**kwargs)
 
@@ -1352,6 +1493,9 @@ class PollingServiceInstance(TAXIIBase10):
         poll_message_bindings (list of str): the message bindings
             supported by this Poll Service instance. **Required**
     """
+
+    __slots__ = ('_poll_message_bindings', '_poll_protocol', 'poll_address')
+
     NAME = 'Polling_Service'
 
     def __init__(self, poll_protocol, poll_address, poll_message_bindings):
@@ -1416,7 +1560,7 @@ class PollingServiceInstance(TAXIIBase10):
         addr = get_required(etree_xml, './taxii:Address', ns_map).text
 
         bindings = []
-        for message_binding in etree_xml.xpath('./taxii:Message_Binding', namespaces=ns_map):
+        for message_binding in get_all(etree_xml, './taxii:Message_Binding', ns_map):
             bindings.append(message_binding.text)
         return cls(protocol, addr, bindings)
 
@@ -1441,6 +1585,9 @@ class SubscriptionMethod(TAXIIBase10):
             bindings supported by this Feed Management Service
             Instance. **Required**
     """
+
+    __slots__ = ('_subscription_message_bindings', '_subscription_protocol', 'subscription_address')
+
     NAME = 'Subscription_Service'
 
     def __init__(self, subscription_protocol, subscription_address,
@@ -1505,7 +1652,7 @@ class SubscriptionMethod(TAXIIBase10):
         protocol = get_required(etree_xml, './taxii:Protocol_Binding', ns_map).text
         addr = get_required(etree_xml, './taxii:Address', ns_map).text
         bindings = []
-        for message_binding in etree_xml.xpath('./taxii:Message_Binding', namespaces=ns_map):
+        for message_binding in get_all(etree_xml, './taxii:Message_Binding', ns_map):
             bindings.append(message_binding.text)
         return cls(protocol, addr, bindings)
 
@@ -1676,7 +1823,7 @@ class PollRequest(TAXIIMessage):
             kwargs['inclusive_end_timestamp_label'] = parse_datetime_string(iet_text)
 
         kwargs['content_bindings'] = []
-        for binding in etree_xml.xpath('./taxii:Content_Binding', namespaces=ns_map):
+        for binding in get_all(etree_xml, './taxii:Content_Binding', ns_map):
             kwargs['content_bindings'].append(binding.text)
 
         msg = super(PollRequest, cls).from_etree(etree_xml, **kwargs)
@@ -1703,7 +1850,7 @@ class PollRequest(TAXIIMessage):
         return msg
 
 
-class PollResponse(TAXIIMessage):
+class PollResponse(common.ContentBlockMessageMixin, TAXIIMessage):
 
     """
     A TAXII Poll Response message.
@@ -1792,7 +1939,8 @@ class PollResponse(TAXIIMessage):
         do_check(value, 'content_blocks', type=ContentBlock)
         self._content_blocks = value
 
-    def to_etree(self):
+    def _header_etree(self):
+        """Create the etree for this message, without the Content Blocks."""
         xml = super(PollResponse, self).to_etree()
         xml.attrib['feed_name'] = self.feed_name
         if self.subscription_id is not None:
@@ -1809,12 +1957,16 @@ class PollResponse(TAXIIMessage):
         iet = etree.SubElement(xml, '{%s}Inclusive_End_Timestamp' % ns_map['taxii'])
         iet.text = self.inclusive_end_timestamp_label.isoformat()
 
+        return xml
+
+    def to_etree(self):
+        xml = self._header_etree()
         for block in self.content_blocks:
             xml.append(block.to_etree())
 
         return xml
 
-    def to_dict(self):
+    def _header_dict(self):
         d = super(PollResponse, self).to_dict()
 
         d['feed_name'] = self.feed_name
@@ -1825,6 +1977,11 @@ class PollResponse(TAXIIMessage):
         if self.inclusive_begin_timestamp_label:
             d['inclusive_begin_timestamp_label'] = self.inclusive_begin_timestamp_label.isoformat()
         d['inclusive_end_timestamp_label'] = self.inclusive_end_timestamp_label.isoformat()
+
+        return d
+
+    def to_dict(self):
+        d = self._header_dict()
         d['content_blocks'] = []
         for block in self.content_blocks:
             d['content_blocks'].append(block.to_dict())
@@ -1866,7 +2023,7 @@ class PollResponse(TAXIIMessage):
         kwargs['inclusive_end_timestamp_label'] = parse_datetime_string(iets_text)
 
         kwargs['content_blocks'] = []
-        blocks = etree_xml.xpath('./taxii:Content_Block', namespaces=ns_map)
+        blocks = get_all(etree_xml, './taxii:Content_Block', ns_map)
         for block in blocks:
             kwargs['content_blocks'].append(ContentBlock.from_etree(block))
 
@@ -1994,7 +2151,7 @@ class StatusMessage(TAXIIMessage):
         return msg
 
 
-class InboxMessage(TAXIIMessage):
+class InboxMessage(common.ContentBlockMessageMixin, TAXIIMessage):
 
     """
     A TAXII Inbox message.
@@ -2046,7 +2203,8 @@ class InboxMessage(TAXIIMessage):
         do_check(value, 'content_blocks', type=ContentBlock)
         self._content_blocks = value
 
-    def to_etree(self):
+    def _header_etree(self):
+        """Create the etree for this message, without the Content Blocks."""
         xml = super(InboxMessage, self).to_etree()
         if self.message is not None:
             m = etree.SubElement(xml, '{%s}Message' % ns_map['taxii'])
@@ -2055,12 +2213,16 @@ class InboxMessage(TAXIIMessage):
         if self.subscription_information:
             xml.append(self.subscription_information.to_etree())
 
+        return xml
+
+    def to_etree(self):
+        xml = self._header_etree()
         for block in self.content_blocks:
             xml.append(block.to_etree())
 
         return xml
 
-    def to_dict(self):
+    def _header_dict(self):
         d = super(InboxMessage, self).to_dict()
         if self.message is not None:
             d['message'] = self.message
@@ -2068,6 +2230,10 @@ class InboxMessage(TAXIIMessage):
         if self.subscription_information:
             d['subscription_information'] = self.subscription_information.to_dict()
 
+        return d
+
+    def to_dict(self):
+        d = self._header_dict()
         d['content_blocks'] = []
         for block in self.content_blocks:
             d['content_blocks'].append(block.to_dict())
@@ -2095,7 +2261,7 @@ class InboxMessage(TAXIIMessage):
         if subs_info is not None:
             msg.subscription_information = SubscriptionInformation.from_etree(subs_info)
 
-        content_blocks = etree_xml.xpath('./taxii:Content_Block', namespaces=ns_map)
+        content_blocks = get_all(etree_xml, './taxii:Content_Block', ns_map)
         msg.content_blocks = []
         for block in content_blocks:
             msg.content_blocks.append(ContentBlock.from_etree(block))
@@ -2137,6 +2303,8 @@ class SubscriptionInformation(TAXIIBase10):
             **Optional**
     """
 
+    __slots__ = ('_feed_name', '_inclusive_begin_timestamp_label', '_inclusive_end_timestamp_label', '_subscription_id')
+
     def __init__(self, feed_name, subscription_id,
                  inclusive_begin_timestamp_label,
                  inclusive_end_timestamp_label):
@@ -2453,7 +2621,7 @@ class ManageFeedSubscriptionResponse(TAXIIMessage):
         kwargs['message'] = get_optional_text(etree_xml, './taxii:Message', ns_map)
 
         kwargs['subscription_instances'] = []
-        for si in etree_xml.xpath('./taxii:Subscription', namespaces=ns_map):
+        for si in get_all(etree_xml, './taxii:Subscription', ns_map):
             kwargs['subscription_instances'].append(SubscriptionInstance.from_etree(si))
 
         msg = super(ManageFeedSubscriptionResponse, cls).from_etree(etree_xml, **kwargs)
@@ -2490,6 +2658,8 @@ class SubscriptionInstance(TAXIIBase10):
             Subscription. **Optional**
     """
 
+    __slots__ = ('_delivery_parameters', '_poll_instances', '_subscription_id')
+
     def __init__(self, subscription_id, delivery_parameters=None,
                  poll_instances=None):
         self.subscription_id = subscription_id
@@ -2574,7 +2744,7 @@ class SubscriptionInstance(TAXIIBase10):
             delivery_parameters = None
 
         poll_instances = []
-        for poll_instance in etree_xml.xpath('./taxii:Poll_Instance', namespaces=ns_map):
+        for poll_instance in get_all(etree_xml, './taxii:Poll_Instance', ns_map):
             poll_instances.append(PollInstance.from_etree(poll_instance))
 
         return SubscriptionInstance(subscription_id, delivery_parameters, poll_instances)
@@ -2611,6 +2781,8 @@ class PollInstance(TAXIIBase10):
             instance. **Required**
     """
 
+    __slots__ = ('_poll_message_bindings', '_poll_protocol', 'poll_address')
+
     def __init__(self, poll_protocol, poll_address, poll_message_bindings=None):
         self.poll_protocol = poll_protocol
         self.poll_address = poll_address
@@ -2678,7 +2850,7 @@ class PollInstance(TAXIIBase10):
         address = get_required(etree_xml, './taxii:Address', ns_map).text
 
         poll_message_bindings = []
-        for b in etree_xml.xpath('./taxii:Message_Binding', namespaces=ns_map):
+        for b in get_all(etree_xml, './taxii:Message_Binding', ns_map):
             poll_message_bindings.append(b.text)
 
         return PollInstance(poll_protocol, address, poll_message_bindings)
@@ -2687,6 +2859,30 @@ class PollInstance(TAXIIBase10):
     def from_dict(d):
         return PollInstance(**d)
 
+# Message classes by message type, used to dispatch parsing
+_MESSAGE_CLASSES = {
+    MSG_DISCOVERY_REQUEST: DiscoveryRequest,
+    MSG_DISCOVERY_RESPONSE: DiscoveryResponse,
+    MSG_FEED_INFORMATION_REQUEST: FeedInformationRequest,
+    MSG_FEED_INFORMATION_RESPONSE: FeedInformationResponse,
+    MSG_POLL_REQUEST: PollRequest,
+    MSG_POLL_RESPONSE: PollResponse,
+    MSG_STATUS_MESSAGE: StatusMessage,
+    MSG_INBOX_MESSAGE: InboxMessage,
+    MSG_MANAGE_FEED_SUBSCRIPTION_REQUEST: ManageFeedSubscriptionRequest,
+    MSG_MANAGE_FEED_SUBSCRIPTION_RESPONSE: ManageFeedSubscriptionResponse,
+}
+
+_MESSAGE_CLASSES_BY_TAG = dict(('{%s}%s' % (ns_map['taxii'], message_type), message_class)
+                               for message_type, message_class in six.iteritems(_MESSAGE_CLASSES))
+
+# Messages whose Content Blocks iter_poll_response() yields as they are parsed
+_ITER_MESSAGE_CLASSES = {
+    '{%s}%s' % (ns_map['taxii'], MSG_POLL_RESPONSE): PollResponse,
+    '{%s}%s' % (ns_map['taxii'], MSG_INBOX_MESSAGE): InboxMessage,
+}
+
+
 ########################################################
 # EVERYTHING BELOW HERE IS FOR BACKWARDS COMPATIBILITY #
 ########################################################
@@ -6,6 +6,7 @@ Creating, handling, and parsing TAXII 1.1 messages.
 """
 
 
+import codecs
 import collections
 import six
 try:
@@ -18,9 +19,12 @@ import warnings
 from lxml import etree
 
 from .common import (parse, parse_datetime_string, append_any_content_etree, TAXIIBase,
-                     get_required, get_optional, get_optional_text, parse_xml_string,
-                     stringify_content)
-from .validation import do_check, uri_regex, check_timestamp_label
+                     get_required, get_optional, get_optional_text, get_all, parse_xml_string,
+                     stringify_content, iterparse_content_blocks, detach_element, might_be_xml,
+                     iterparse_json_content_blocks, unparsed_xml, is_unparsed_xml)
+from . import common
+from .binary import encode_binary, decode_binary
+from .validation import local_validation_level, do_check, uri_regex, check_timestamp_label
 from .constants import *
 
 
@@ -55,7 +59,7 @@ def validate_xml(xml_string):
     return valid
 
 
-def get_message_from_xml(xml_string, encoding='utf_8'):
+def get_message_from_xml(xml_string, encoding='utf_8', validation_level=None, detach_content=False):
     """Create a TAXIIMessage object from an XML string.
 
     This function automatically detects which type of Message should be created
@@ -64,6 +68,14 @@ def get_message_from_xml(xml_string, encoding='utf_8'):
     Args:
         xml_string (str): The XML to parse into a TAXII message.
         encoding (str): The encoding of the string; defaults to UTF-8
+        validation_level (str): The validation level to use while building
+            the message (see :py:mod:`libtaxii.validation`); defaults to the
+            global level. Use ``VALIDATION_NONE`` to skip checks on trusted
+            input.
+        detach_content (bool): Whether to move the XML content of each
+            Content Block into a document of its own (see
+            :py:meth:`ContentBlock.detach`), so that keeping some Content
+            Blocks does not keep the whole message in memory.
 
     Example:
         .. code-block:: python
@@ -71,42 +83,112 @@ def get_message_from_xml(xml_string, encoding='utf_8'):
             message_xml = message.to_xml()
             new_message = tm11.get_message_from_xml(message_xml)
     """
+    etree_xml = None
     if isinstance(xml_string, six.binary_type):
-        xml_string = xml_string.decode(encoding, 'replace')
-    etree_xml = parse_xml_string(xml_string)
-    qn = etree.QName(etree_xml)
-    if qn.namespace != ns_map['taxii_11']:
-        raise ValueError('Unsupported namespace: %s' % qn.namespace)
-
-    message_type = qn.localname
-
-    if message_type == MSG_DISCOVERY_REQUEST:
-        return DiscoveryRequest.from_etree(etree_xml)
-    if message_type == MSG_DISCOVERY_RESPONSE:
-        return DiscoveryResponse.from_etree(etree_xml)
-    if message_type == MSG_COLLECTION_INFORMATION_REQUEST:
-        return CollectionInformationRequest.from_etree(etree_xml)
-    if message_type == MSG_COLLECTION_INFORMATION_RESPONSE:
-        return CollectionInformationResponse.from_etree(etree_xml)
-    if message_type == MSG_POLL_REQUEST:
-        return PollRequest.from_etree(etree_xml)
-    if message_type == MSG_POLL_RESPONSE:
-        return PollResponse.from_etree(etree_xml)
-    if message_type == MSG_STATUS_MESSAGE:
-        return StatusMessage.from_etree(etree_xml)
-    if message_type == MSG_INBOX_MESSAGE:
-        return InboxMessage.from_etree(etree_xml)
-    if message_type == MSG_MANAGE_COLLECTION_SUBSCRIPTION_REQUEST:
-        return ManageCollectionSubscriptionRequest.from_etree(etree_xml)
-    if message_type == MSG_MANAGE_COLLECTION_SUBSCRIPTION_RESPONSE:
-        return ManageCollectionSubscriptionResponse.from_etree(etree_xml)
-    if message_type == MSG_POLL_FULFILLMENT_REQUEST:
-        return PollFulfillmentRequest.from_etree(etree_xml)
-
-    raise ValueError('Unknown message_type: %s' % message_type)
-
-
-def get_message_from_dict(d):
+        if codecs.lookup(encoding).name == 'utf-8':
+            # Let lxml read the bytes directly. This avoids decoding and
+            # re-encoding the whole document before it is parsed.
+            try:
+                etree_xml = parse_xml_string(xml_string)
+            except etree.XMLSyntaxError:
+                pass  # Fall back to replacing undecodable bytes, below
+        if etree_xml is None:
+            xml_string = xml_string.decode(encoding, 'replace')
+    if etree_xml is None:
+        etree_xml = parse_xml_string(xml_string)
+
+    with local_validation_level(validation_level):
+        message = _get_message_from_etree(etree_xml)
+
+    if detach_content:
+        for content_block in getattr(message, 'content_blocks', ()):
+            content_block.detach()
+    return message
+
+
+def _get_message_from_etree(etree_xml):
+    message_class = _MESSAGE_CLASSES_BY_TAG.get(etree_xml.tag)
+    if message_class is None:
+        qn = etree.QName(etree_xml)
+        if qn.namespace != ns_map['taxii_11']:
+            raise ValueError('Unsupported namespace: %s' % qn.namespace)
+        raise ValueError('Unknown message_type: %s' % qn.localname)
+
+    return message_class.from_etree(etree_xml)
+
+
+def iter_poll_response(source, detach_content=True):
+    """Incrementally parse a Poll Response or Inbox Message.
+
+    This is a generator for messages that are too large to hold in memory at
+    once. The first item yielded is the message itself (a
+    :py:class:`PollResponse` or :py:class:`InboxMessage`) with an empty
+    ``content_blocks`` list, carrying the header fields (e.g.,
+    ``collection_name``, ``more``, ``result_id``, ``result_part_number`` and
+    ``record_count``). Every following item is a :py:class:`ContentBlock`, in
+    document order. Content Blocks are discarded from the parsed tree as soon
+    as they have been yielded.
+
+    If the XML is any other TAXII 1.1 message (e.g., a Status Message), that
+    message is yielded as the only item.
+
+    Args:
+        source: A file-like object opened in binary mode (e.g., an HTTP
+            response), or a byte string.
+        detach_content (bool): Whether to move the XML content of each
+            Content Block into a document of its own (see
+            :py:meth:`ContentBlock.detach`). Defaults to True.
+
+    Example:
+        .. code-block:: python
+
+            items = tm11.iter_poll_response(http_response)
+            poll_response = next(items)
+            for content_block in items:
+                handle(content_block)
+    """
+    return iterparse_content_blocks(source, _ITER_MESSAGE_CLASSES, ContentBlock, _get_message_from_etree,
+                                    detach_content)
+
+
+def iter_poll_response_json(source, encoding='utf_8'):
+    """Incrementally parse a Poll Response or Inbox Message from JSON.
+
+    This is the JSON counterpart of :py:func:`iter_poll_response`, for the
+    JSON produced by ``to_json()`` and ``write_json()``. The first item
+    yielded is the message itself with an empty ``content_blocks`` list, and
+    every following item is a :py:class:`ContentBlock`, decoded one at a time
+    from the ``content_blocks`` array.
+
+    Content Blocks are only decoded one at a time if ``content_blocks`` is the
+    last member of the JSON object, as written by libtaxii. Otherwise, the
+    items are the same, but the whole array is read before any are yielded.
+
+    If the JSON is any other TAXII 1.1 message (e.g., a Status Message), that
+    message is yielded as the only item.
+
+    Args:
+        source: A file-like object opened in binary mode (e.g., an HTTP
+            response), a byte string or a text string.
+        encoding (str): The encoding of ``source``, if it is binary; defaults
+            to UTF-8
+
+    Example:
+        .. code-block:: python
+
+            items = tm11.iter_poll_response_json(http_response)
+            poll_response = next(items)
+            for content_block in items:
+                handle(content_block)
+    """
+    message_classes = {
+        MSG_POLL_RESPONSE: PollResponse,
+        MSG_INBOX_MESSAGE: InboxMessage,
+    }
+    return iterparse_json_content_blocks(source, message_classes, ContentBlock, get_message_from_dict, encoding)
+
+
+def get_message_from_dict(d, validation_level=None):
     """Create a TAXIIMessage object from a dictonary.
 
     This function automatically detects which type of Message should be created
@@ -114,6 +196,10 @@ def get_message_from_dict(d):
 
     Args:
         d (dict): The dictionary to build the TAXII message from.
+        validation_level (str): The validation level to use while building
+            the message (see :py:mod:`libtaxii.validation`); defaults to the
+            global level. Use ``VALIDATION_NONE`` to skip checks on trusted
+            input.
 
     Example:
         .. code-block:: python
@@ -125,33 +211,14 @@ def get_message_from_dict(d):
         raise ValueError('message_type is a required field!')
 
     message_type = d['message_type']
-    if message_type == MSG_DISCOVERY_REQUEST:
-        return DiscoveryRequest.from_dict(d)
-    if message_type == MSG_DISCOVERY_RESPONSE:
-        return DiscoveryResponse.from_dict(d)
-    if message_type == MSG_COLLECTION_INFORMATION_REQUEST:
-        return CollectionInformationRequest.from_dict(d)
-    if message_type == MSG_COLLECTION_INFORMATION_RESPONSE:
-        return CollectionInformationResponse.from_dict(d)
-    if message_type == MSG_POLL_REQUEST:
-        return PollRequest.from_dict(d)
-    if message_type == MSG_POLL_RESPONSE:
-        return PollResponse.from_dict(d)
-    if message_type == MSG_STATUS_MESSAGE:
-        return StatusMessage.from_dict(d)
-    if message_type == MSG_INBOX_MESSAGE:
-        return InboxMessage.from_dict(d)
-    if message_type == MSG_MANAGE_COLLECTION_SUBSCRIPTION_REQUEST:
-        return ManageCollectionSubscriptionRequest.from_dict(d)
-    if message_type == MSG_MANAGE_COLLECTION_SUBSCRIPTION_RESPONSE:
-        return ManageCollectionSubscriptionResponse.from_dict(d)
-    if message_type == MSG_POLL_FULFILLMENT_REQUEST:
-        return PollFulfillmentRequest.from_dict(d)
-
-    raise ValueError('Unknown message_type: %s' % message_type)
-
-
-def get_message_from_json(json_string, encoding='utf_8'):
+    if message_type not in _MESSAGE_CLASSES:
+        raise ValueError('Unknown message_type: %s' % message_type)
+
+    with local_validation_level(validation_level):
+        return _MESSAGE_CLASSES[message_type].from_dict(d)
+
+
+def get_message_from_json(json_string, encoding='utf_8', validation_level=None):
     """Create a TAXIIMessage object from a JSON string.
 
     This function automatically detects which type of Message should be created
@@ -159,9 +226,50 @@ def get_message_from_json(json_string, encoding='utf_8'):
 
     Args:
         json_string (str): The JSON to parse into a TAXII message.
+        encoding (str): The encoding of the string, if it is a byte string;
+            defaults to UTF-8
+        validation_level (str): The validation level to use while building
+            the message (see :py:mod:`libtaxii.validation`); defaults to the
+            global level. Use ``VALIDATION_NONE`` to skip checks on trusted
+            input.
+    """
+    if isinstance(json_string, six.binary_type):
+        json_string = json_string.decode(encoding, 'replace')
+    return get_message_from_dict(json.loads(json_string), validation_level)
+
+
+def get_message_from_binary(data, validation_level=None):
+    """Create a TAXIIMessage object from the libtaxii binary Message Binding
+    (see :py:meth:`TAXIIMessage.to_binary`).
+
+    The XML content of each Content Block is kept as bytes, and is only
+    parsed the first time its etree is needed, so a message can be received
+    and sent on again without parsing its content.
+
+    Args:
+        data (bytes): The binary message.
+        validation_level (str): The validation level to use while building
+            the message (see :py:mod:`libtaxii.validation`); defaults to the
+            global level. Use ``VALIDATION_NONE`` to skip checks on trusted
+            input.
+
+    Raises:
+        ValueError: If ``data`` is not a valid binary TAXII message.
     """
-    decoded_string = json_string.decode(encoding, 'replace')
-    return get_message_from_dict(json.loads(decoded_string))
+    d = decode_binary(data, _BINARY_OBJECT_TYPES)
+    if not isinstance(d, dict):
+        raise ValueError('The binary message is not a TAXII message')
+
+    try:
+        for block in d.get('content_blocks') or ():
+            content = block.get('content')
+            if block.get('content_is_xml') and isinstance(content, six.binary_type):
+                block['content'] = unparsed_xml(content)
+        return get_message_from_dict(d, validation_level)
+    except (KeyError, TypeError, AttributeError):
+        # A missing field, or one of the wrong type (e.g., a list as the
+        # message_type, or a string as a Content Block)
+        raise ValueError('The binary message is not a valid TAXII message')
 
 
 def _sanitize_content_binding(binding):
@@ -259,6 +367,7 @@ def get_deserializer(format_id, type):
 
 
 class TAXIIBase11(TAXIIBase):
+    __slots__ = ()
     version = VID_TAXII_XML_11
 
 
@@ -271,6 +380,8 @@ class SupportedQuery(TAXIIBase11):
     to represent a query
     """
 
+    __slots__ = ('_format_id',)
+
     def __init__(self, format_id):
         """
         Arguments:
@@ -322,6 +433,8 @@ class Query(TAXIIBase11):
     in place of this class to represent a query.
     """
 
+    __slots__ = ('_format_id',)
+
     def __init__(self, format_id):
         """
         Arguments:
@@ -378,6 +491,8 @@ class ContentBinding(TAXIIBase11):
         subtype_ids (list of str): the subtype IDs. **Required**
     """
 
+    __slots__ = ('_binding_id', '_subtype_ids')
+
     def __init__(self, binding_id, subtype_ids=None):
         self.binding_id = binding_id
         self.subtype_ids = subtype_ids or []
@@ -442,7 +557,7 @@ class ContentBinding(TAXIIBase11):
     def from_etree(self, etree_xml):
         binding_id = etree_xml.attrib['binding_id']
         subtype_ids = []
-        subtype_elts = etree_xml.xpath('./taxii_11:Subtype', namespaces=ns_map)
+        subtype_elts = get_all(etree_xml, './taxii_11:Subtype', ns_map)
         for elt in subtype_elts:
             subtype_ids.append(elt.attrib['subtype_id'])
         return ContentBinding(binding_id, subtype_ids)
@@ -462,6 +577,8 @@ class RecordCount(TAXIIBase11):
         partial_count (bool): Whether the number of records is a partial count
     """
 
+    __slots__ = ('_partial_count', '_record_count')
+
     def __init__(self, record_count, partial_count=False):
         self.record_count = record_count
         self.partial_count = partial_count
@@ -522,6 +639,8 @@ class RecordCount(TAXIIBase11):
 
 
 class _GenericParameters(TAXIIBase11):
+    __slots__ = ('_content_bindings', '_query', '_response_type')
+
     name = 'Generic_Parameters'
 
     def __init__(self, response_type=RT_FULL, content_bindings=None, query=None):
@@ -608,7 +727,7 @@ class _GenericParameters(TAXIIBase11):
             response_type = RT_FULL
 
         content_bindings = []
-        for binding in etree_xml.xpath('./taxii_11:Content_Binding', namespaces=ns_map):
+        for binding in get_all(etree_xml, './taxii_11:Content_Binding', ns_map):
             content_bindings.append(ContentBinding.from_etree(binding))
 
         query = None
@@ -647,6 +766,9 @@ class SubscriptionParameters(_GenericParameters):
             Bindings acceptable in response. **Optional**
         query (Query): The query for this poll parameters. **Optional**
     """
+
+    __slots__ = ()
+
     name = 'Subscription_Parameters'
 
 
@@ -665,13 +787,27 @@ class ContentBlock(TAXIIBase11):
         padding (string): an arbitrary amount of padding for this Content
             Block. **Optional**
         message (string): a message associated with this ContentBlock. **Optional**
+        content_is_xml (bool): whether ``content`` is XML, if the caller
+            knows. A string is then parsed, or kept as a string, without
+            first trying to parse it as XML. **Optional**
+
+    XML content is kept as an etree and is only serialized the first time
+    ``content`` is read; the serialized bytes are cached after that. If the
+    etree is modified in place, set ``content`` again to reset the cache.
+    XML content decoded from the binary Message Binding is kept as bytes,
+    and only parsed the first time its etree is needed.
     """
+
+    __slots__ = ('_content', '_content_binding', '_content_bytes', '_content_is_xml', '_message', '_timestamp_label',
+                 'padding')
+
     NAME = 'Content_Block'
+    _cache_members = ('_content_bytes',)
 
     def __init__(self, content_binding, content, timestamp_label=None,
-                 padding=None, message=None):
+                 padding=None, message=None, content_is_xml=None):
         self.content_binding = content_binding
-        self.content = content
+        self.set_content(content, content_is_xml)
         self.timestamp_label = timestamp_label
         self.message = message
         self.padding = padding
@@ -693,14 +829,40 @@ class ContentBlock(TAXIIBase11):
     @property
     def content(self):
         if self.content_is_xml:
-            return etree.tostring(self._content, encoding='utf-8')
+            # XML content is only serialized on first access; the bytes are
+            # kept until new content is set.
+            if self._content_bytes is None:
+                self._content_bytes = etree.tostring(self._content, encoding='utf-8')
+            return self._content_bytes
         else:
             return self._content
 
     @content.setter
     def content(self, value):
-        do_check(value, 'content')  # Just check for not None
-        self._content, self.content_is_xml = stringify_content(value)
+        self.set_content(value)
+
+    def set_content(self, content, is_xml=None):
+        """Set the content of this Content Block.
+
+        Args:
+            content (string or etree): the new content
+            is_xml (bool): whether ``content`` is XML, if known. If None, a
+                string is parsed as XML if it looks like XML, and kept as a
+                string otherwise.
+        """
+        do_check(content, 'content')  # Just check for not None
+        if is_unparsed_xml(content):
+            self._content, self.content_is_xml = None, True
+            self._content_bytes = six.binary_type(content)
+            return
+        self._content, self.content_is_xml = stringify_content(content, is_xml)
+        self._content_bytes = None
+
+    def _get_content_etree(self):
+        """Return the XML content as an etree, parsing it if it hasn't been."""
+        if self._content is None:
+            self._content = parse(self._content_bytes, allow_file=False)
+        return self._content
 
     @property
     def content_is_xml(self):
@@ -711,6 +873,19 @@ class ContentBlock(TAXIIBase11):
         do_check(value, 'content_is_xml', value_tuple=(True, False))
         self._content_is_xml = value
 
+    def __getstate__(self):
+        # etree elements can't be pickled, so XML content is pickled as bytes
+        state = super(ContentBlock, self).__getstate__()
+        state['_content'] = self.content
+        state.pop('_content_bytes', None)
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        content = state.pop('_content')
+        super(ContentBlock, self).__setstate__(state)
+        self.set_content(content, state.get('_content_is_xml'))
+
     @property
     def timestamp_label(self):
         return self._timestamp_label
@@ -729,13 +904,35 @@ class ContentBlock(TAXIIBase11):
         do_check(value, 'message', type=six.string_types, can_be_none=True)
         self._message = value
 
+    def detach(self):
+        """Move XML content that was parsed from a message into a document of
+        its own.
+
+        Until then, the content keeps the whole parsed message alive, including
+        the content of every other Content Block. Namespace declarations that
+        the content does not use are dropped. This does nothing for string
+        content, or for content that is not part of a larger document.
+        """
+        if self.content_is_xml and self._content is not None and self._content.getparent() is not None:
+            self._content = detach_element(self._content)
+            # The cached bytes declare the namespaces that were just dropped
+            self._content_bytes = None
+
+    def __eq__(self, other, debug=False):
+        # Compare the parsed XML of content decoded from the binary binding
+        if self.content_is_xml:
+            self._get_content_etree()
+        if isinstance(other, ContentBlock) and other.content_is_xml:
+            other._get_content_etree()
+        return super(ContentBlock, self).__eq__(other, debug)
+
     def to_etree(self):
         block = etree.Element('{%s}Content_Block' % ns_map['taxii_11'], nsmap=ns_map)
         block.append(self.content_binding.to_etree())
         c = etree.SubElement(block, '{%s}Content' % ns_map['taxii_11'])
 
         if self.content_is_xml:
-            c.append(self._content)
+            c.append(self._get_content_etree())
         else:
             c.text = self._content
 
@@ -757,10 +954,7 @@ class ContentBlock(TAXIIBase11):
         block = {}
         block['content_binding'] = self.content_binding.to_dict()
 
-        if self.content_is_xml:
-            block['content'] = etree.tostring(self._content, encoding='utf-8')
-        else:
-            block['content'] = self._content
+        block['content'] = self.content
         block['content_is_xml'] = self.content_is_xml
 
         if self.timestamp_label is not None:
@@ -802,6 +996,7 @@ class ContentBlock(TAXIIBase11):
 
         content = get_required(etree_xml, './taxii_11:Content', ns_map)
         if len(content) == 0:  # This has string content
+            # Text may be escaped or CDATA-wrapped XML, so it is still sniffed
             kwargs['content'] = content.text
         else:  # This has XML content
             kwargs['content'] = content[0]
@@ -816,11 +1011,12 @@ class ContentBlock(TAXIIBase11):
         if 'timestamp_label' in d:
             kwargs['timestamp_label'] = parse_datetime_string(d['timestamp_label'])
         kwargs['message'] = d.get('message')
-        is_xml = d.get('content_is_xml', False)
-        if is_xml:
+        is_xml = d.get('content_is_xml')
+        if is_xml and not is_unparsed_xml(d['content']):
             kwargs['content'] = parse(d['content'], allow_file=False)
         else:
             kwargs['content'] = d['content']
+            kwargs['content_is_xml'] = is_xml  # None if the dict doesn't say
 
         cb = ContentBlock(**kwargs)
         return cb
@@ -845,6 +1041,8 @@ class PushParameters(TAXIIBase11):
              used to send pushed content for this subscription. **Required**
     """
 
+    __slots__ = ('_delivery_message_binding', '_inbox_address', '_inbox_protocol')
+
     name = 'Push_Parameters'
 
     def __init__(self, inbox_protocol, inbox_address, delivery_message_binding):
@@ -946,6 +1144,8 @@ class DeliveryParameters(PushParameters):
              used to send pushed content for this subscription. **Required**
     """
 
+    __slots__ = ()
+
     name = 'Delivery_Parameters'
 
 
@@ -1045,6 +1245,17 @@ class TAXIIMessage(TAXIIBase11):
 
         return d
 
+    def to_binary(self):
+        """Create a representation of this message in the libtaxii binary
+        Message Binding (:py:data:`VID_LIBTAXII_BINARY_11
+        <libtaxii.constants.VID_LIBTAXII_BINARY_11>`).
+
+        This is much faster to create and parse than XML, and Content Block
+        content is carried as raw bytes, but only libtaxii can read it. Use
+        it between libtaxii peers that both accept it.
+        """
+        return encode_binary(self.to_dict())
+
     def to_text(self, line_prepend=''):
         s = line_prepend + "Message Type: %s\n" % self.message_type
         s += line_prepend + "Message ID: %s" % self.message_id
@@ -1072,18 +1283,18 @@ class TAXIIMessage(TAXIIBase11):
             raise ValueError('%s != %s' % (tag, expected_tag))
 
         # Get the message ID
-        message_id = get_required(src_etree, '/taxii_11:*/@message_id', ns_map)
+        message_id = get_required(src_etree, './@message_id', ns_map)
 
         # Get in response to, if present
-        in_response_to = get_optional(src_etree, '/taxii_11:*/@in_response_to', ns_map)
+        in_response_to = get_optional(src_etree, './@in_response_to', ns_map)
         if in_response_to is not None:
             kwargs['in_response_to'] = in_response_to
 
         # Get the Extended headers
-        extended_header_list = src_etree.xpath('/taxii_11:*/taxii_11:Extended_Headers/taxii_11:Extended_Header', namespaces=ns_map)
+        extended_header_list = get_all(src_etree, './taxii_11:Extended_Headers/taxii_11:Extended_Header', ns_map)
         extended_headers = {}
         for header in extended_header_list:
-            eh_name = header.xpath('./@name')[0]
+            eh_name = get_all(header, './@name', ns_map)[0]
             if len(header) == 0:  # This has string content
                 eh_value = header.text
             else:  # This has XML content
@@ -1108,10 +1319,11 @@ class TAXIIMessage(TAXIIBase11):
         message_id = d['message_id']
         extended_headers = {}
         for k, v in six.iteritems(d['extended_headers']):
-            try:
-                v = parse(v, allow_file=False)
-            except etree.XMLSyntaxError:
-                pass
+            if might_be_xml(v):
+                try:
+                    v = parse(v, allow_file=False)
+                except etree.XMLSyntaxError:
+                    pass
             extended_headers[k] = v
 
         in_response_to = d.get('in_response_to')
@@ -1207,7 +1419,7 @@ class DiscoveryResponse(TAXIIMessage):
     def from_etree(cls, etree_xml):
         kwargs = {}
         kwargs['service_instances'] = []
-        service_instance_set = etree_xml.xpath('./taxii_11:Service_Instance', namespaces=ns_map)
+        service_instance_set = get_all(etree_xml, './taxii_11:Service_Instance', ns_map)
         for service_instance in service_instance_set:
             si = ServiceInstance.from_etree(service_instance)
             kwargs['service_instances'].append(si)
@@ -1257,6 +1469,9 @@ class ServiceInstance(TAXIIBase11):
     ``service_type`` is :py:data:`SVC_POLL`.
     """
 
+    __slots__ = ('_available', '_inbox_service_accepted_content', '_message_bindings', '_protocol_binding',
+                 '_service_address', '_service_type', '_services_version', '_supported_query', 'message')
+
     def __init__(self, service_type, services_version, protocol_binding,
                  service_address, message_bindings,
                  inbox_service_accepted_content=None, available=None,
@@ -1422,19 +1637,19 @@ class ServiceInstance(TAXIIBase11):
         service_address = get_required(etree_xml, './taxii_11:Address', ns_map).text
 
         message_bindings = []
-        message_binding_set = etree_xml.xpath('./taxii_11:Message_Binding', namespaces=ns_map)
+        message_binding_set = get_all(etree_xml, './taxii_11:Message_Binding', ns_map)
         for mb in message_binding_set:
             message_bindings.append(mb.text)
 
         inbox_service_accepted_content = []
-        inbox_service_accepted_content_set = etree_xml.xpath('./taxii_11:Content_Binding', namespaces=ns_map)
+        inbox_service_accepted_content_set = get_all(etree_xml, './taxii_11:Content_Binding', ns_map)
         for cb in inbox_service_accepted_content_set:
             inbox_service_accepted_content.append(ContentBinding.from_etree(cb))
 
         supported_query = []
-        supported_query_set = etree_xml.xpath('./taxii_11:Supported_Query', namespaces=ns_map)
+        supported_query_set = get_all(etree_xml, './taxii_11:Supported_Query', ns_map)
         for sq in supported_query_set:
-            format_id = sq.xpath('./@format_id')[0]
+            format_id = get_all(sq, './@format_id', ns_map)[0]
             query_obj = get_deserializer(format_id, 'query_info').from_etree(sq)
             supported_query.append(query_obj)
 
@@ -1553,7 +1768,7 @@ class CollectionInformationResponse(TAXIIMessage):
     def from_etree(cls, etree_xml):
         msg = super(CollectionInformationResponse, cls).from_etree(etree_xml)
         msg.collection_informations = []
-        collection_informations = etree_xml.xpath('./taxii_11:Collection', namespaces=ns_map)
+        collection_informations = get_all(etree_xml, './taxii_11:Collection', ns_map)
         for collection in collection_informations:
             msg.collection_informations.append(CollectionInformation.from_etree(collection))
         return msg
@@ -1609,6 +1824,10 @@ class CollectionInformation(TAXIIBase11):
     indicates no receiving inbox services.
     """
 
+    __slots__ = ('_available', '_collection_name', '_collection_type', '_collection_volume',
+                 '_polling_service_instances', '_push_methods', '_receiving_inbox_services', '_subscription_methods',
+                 '_supported_contents', 'collection_description')
+
     def __init__(self, collection_name, collection_description,
                  supported_contents=None, available=None, push_methods=None,
                  polling_service_instances=None, subscription_methods=None,
@@ -1813,27 +2032,27 @@ class CollectionInformation(TAXIIBase11):
             kwargs['collection_volume'] = int(collection_volume_text)
 
         kwargs['supported_contents'] = []
-        supported_content_set = etree_xml.xpath('./taxii_11:Content_Binding', namespaces=ns_map)
+        supported_content_set = get_all(etree_xml, './taxii_11:Content_Binding', ns_map)
         for binding_elt in supported_content_set:
             kwargs['supported_contents'].append(ContentBinding.from_etree(binding_elt))
 
         kwargs['push_methods'] = []
-        push_method_set = etree_xml.xpath('./taxii_11:Push_Method', namespaces=ns_map)
+        push_method_set = get_all(etree_xml, './taxii_11:Push_Method', ns_map)
         for push_method_elt in push_method_set:
             kwargs['push_methods'].append(PushMethod.from_etree(push_method_elt))
 
         kwargs['polling_service_instances'] = []
-        polling_service_set = etree_xml.xpath('./taxii_11:Polling_Service', namespaces=ns_map)
+        polling_service_set = get_all(etree_xml, './taxii_11:Polling_Service', ns_map)
         for polling_elt in polling_service_set:
             kwargs['polling_service_instances'].append(PollingServiceInstance.from_etree(polling_elt))
 
         kwargs['subscription_methods'] = []
-        subscription_method_set = etree_xml.xpath('./taxii_11:Subscription_Service', namespaces=ns_map)
+        subscription_method_set = get_all(etree_xml, './taxii_11:Subscription_Service', ns_map)
         for subscription_elt in subscription_method_set:
             kwargs['subscription_methods'].append(SubscriptionMethod.from_etree(subscription_elt))
 
         kwargs['receiving_inbox_services'] = []
-        receiving_inbox_services_set = etree_xml.xpath('./taxii_11:Receiving_Inbox_Service', namespaces=ns_map)
+        receiving_inbox_services_set = get_all(etree_xml, './taxii_11:Receiving_Inbox_Service', ns_map)
         for receiving_inbox_service in receiving_inbox_services_set:
             kwargs['receiving_inbox_services'].append(ReceivingInboxService.from_etree(receiving_inbox_service))
 
@@ -1886,6 +2105,8 @@ class PushMethod(TAXIIBase11):
             **Required**
     """
 
+    __slots__ = ('_push_message_bindings', '_push_protocol')
+
     def __init__(self, push_protocol, push_message_bindings):
         self.push_protocol = push_protocol
         self.push_message_bindings = push_message_bindings
@@ -1942,7 +2163,7 @@ class PushMethod(TAXIIBase11):
         kwargs['push_protocol'] = get_required(etree_xml, './taxii_11:Protocol_Binding', ns_map).text
 
         kwargs['push_message_bindings'] = []
-        message_binding_set = etree_xml.xpath('./taxii_11:Message_Binding', namespaces=ns_map)
+        message_binding_set = get_all(etree_xml, './taxii_11:Message_Binding', ns_map)
         for message_binding in message_binding_set:
             kwargs['push_message_bindings'].append(message_binding.text)
         return PushMethod(**kwargs)
@@ -1966,6 +2187,9 @@ class PollingServiceInstance(TAXIIBase11):
         poll_message_bindings (list of str): the message bindings
             supported by this Poll Service instance. **Required**
     """
+
+    __slots__ = ('_poll_message_bindings', '_poll_protocol', 'poll_address')
+
     NAME = 'Polling_Service'
 
     def __init__(self, poll_protocol, poll_address, poll_message_bindings):
@@ -2029,7 +2253,7 @@ class PollingServiceInstance(TAXIIBase11):
         addr = get_required(etree_xml, './taxii_11:Address', ns_map).text
 
         bindings = []
-        message_binding_set = etree_xml.xpath('./taxii_11:Message_Binding', namespaces=ns_map)
+        message_binding_set = get_all(etree_xml, './taxii_11:Message_Binding', ns_map)
         for message_binding in message_binding_set:
             bindings.append(message_binding.text)
         return cls(protocol, addr, bindings)
@@ -2055,6 +2279,9 @@ class SubscriptionMethod(TAXIIBase11):
             bindings supported by this Collection Management Service
             Instance. **Required**
     """
+
+    __slots__ = ('_subscription_message_bindings', '_subscription_protocol', 'subscription_address')
+
     NAME = 'Subscription_Service'
 
     def __init__(self, subscription_protocol, subscription_address,
@@ -2118,7 +2345,7 @@ class SubscriptionMethod(TAXIIBase11):
         protocol = get_required(etree_xml, './taxii_11:Protocol_Binding', ns_map).text
         addr = get_required(etree_xml, './taxii_11:Address', ns_map).text
         bindings = []
-        message_binding_set = etree_xml.xpath('./taxii_11:Message_Binding', namespaces=ns_map)
+        message_binding_set = get_all(etree_xml, './taxii_11:Message_Binding', ns_map)
         for message_binding in message_binding_set:
             bindings.append(message_binding.text)
         return cls(protocol, addr, bindings)
@@ -2147,6 +2374,8 @@ class ReceivingInboxService(TAXIIBase11):
             Bindings are supported.
     """
 
+    __slots__ = ('_inbox_address', '_inbox_message_bindings', '_inbox_protocol', '_supported_contents')
+
     def __init__(self, inbox_protocol, inbox_address,
                  inbox_message_bindings, supported_contents=None):
         self.inbox_protocol = inbox_protocol
@@ -2243,12 +2472,12 @@ class ReceivingInboxService(TAXIIBase11):
         addr = get_required(etree_xml, './taxii_11:Address', ns_map).text
 
         message_bindings = []
-        message_binding_set = etree_xml.xpath('./taxii_11:Message_Binding', namespaces=ns_map)
+        message_binding_set = get_all(etree_xml, './taxii_11:Message_Binding', ns_map)
         for mb in message_binding_set:
             message_bindings.append(mb.text)
 
         supported_contents = []
-        supported_contents_set = etree_xml.xpath('./taxii_11:Content_Binding', namespaces=ns_map)
+        supported_contents_set = get_all(etree_xml, './taxii_11:Content_Binding', ns_map)
         for cb in supported_contents_set:
             supported_contents.append(ContentBinding.from_etree(cb))
 
@@ -2477,6 +2706,9 @@ class PollParameters(_GenericParameters):
     If ``content_bindings`` in not provided, this indicates that all
     bindings are accepted as a response.
     """
+
+    __slots__ = ('_allow_asynch', '_delivery_parameters')
+
     name = 'Poll_Parameters'
 
     def __init__(self, response_type=RT_FULL, content_bindings=None,
@@ -2558,7 +2790,7 @@ class PollParameters(_GenericParameters):
         return poll_parameters
 
 
-class PollResponse(TAXIIMessage):
+class PollResponse(common.ContentBlockMessageMixin, TAXIIMessage):
 
     """
     A TAXII Poll Response message.
@@ -2696,7 +2928,8 @@ class PollResponse(TAXIIMessage):
         do_check(value, 'record_count', type=RecordCount, can_be_none=True)
         self._record_count = value
 
-    def to_etree(self):
+    def _header_etree(self):
+        """Create the etree for this message, without the Content Blocks."""
         xml = super(PollResponse, self).to_etree()
         xml.attrib['collection_name'] = self.collection_name
         if self.result_id is not None:
@@ -2727,12 +2960,16 @@ class PollResponse(TAXIIMessage):
             m = etree.SubElement(xml, '{%s}Message' % ns_map['taxii_11'])
             m.text = self.message
 
+        return xml
+
+    def to_etree(self):
+        xml = self._header_etree()
         for block in self.content_blocks:
             xml.append(block.to_etree())
 
         return xml
 
-    def to_dict(self):
+    def _header_dict(self):
         d = super(PollResponse, self).to_dict()
 
         d['collection_name'] = self.collection_name
@@ -2749,6 +2986,11 @@ class PollResponse(TAXIIMessage):
             d['exclusive_begin_timestamp_label'] = self.exclusive_begin_timestamp_label.isoformat()
         if self.inclusive_end_timestamp_label is not None:
             d['inclusive_end_timestamp_label'] = self.inclusive_end_timestamp_label.isoformat()
+
+        return d
+
+    def to_dict(self):
+        d = self._header_dict()
         d['content_blocks'] = []
         for block in self.content_blocks:
             d['content_blocks'].append(block.to_dict())
@@ -2800,7 +3042,7 @@ class PollResponse(TAXIIMessage):
             kwargs['inclusive_end_timestamp_label'] = parse_datetime_string(iets_text)
 
         kwargs['content_blocks'] = []
-        for block in etree_xml.xpath('./taxii_11:Content_Block', namespaces=ns_map):
+        for block in get_all(etree_xml, './taxii_11:Content_Block', ns_map):
             kwargs['content_blocks'].append(ContentBlock.from_etree(block))
 
         record_count_el = get_optional(etree_xml, './taxii_11:Record_Count', ns_map)
@@ -2997,7 +3239,7 @@ class StatusMessage(TAXIIMessage):
         kwargs['status_type'] = status_type
 
         kwargs['status_detail'] = {}
-        detail_set = etree_xml.xpath('./taxii_11:Status_Detail/taxii_11:Detail', namespaces=ns_map)
+        detail_set = get_all(etree_xml, './taxii_11:Status_Detail/taxii_11:Detail', ns_map)
         for detail in detail_set:
             # TODO: This seems kind of hacky and should probably be improved
             name = detail.attrib['name']
@@ -3022,7 +3264,7 @@ class StatusMessage(TAXIIMessage):
                 kwargs['status_detail'][name] = v
 
         kwargs['message'] = None
-        m_set = etree_xml.xpath('./taxii_11:Message', namespaces=ns_map)
+        m_set = get_all(etree_xml, './taxii_11:Message', ns_map)
         if len(m_set) > 0:
             kwargs['message'] = m_set[0].text
 
@@ -3040,7 +3282,7 @@ class StatusMessage(TAXIIMessage):
         return msg
 
 
-class InboxMessage(TAXIIMessage):
+class InboxMessage(common.ContentBlockMessageMixin, TAXIIMessage):
 
     """
     A TAXII Inbox message.
@@ -3128,7 +3370,8 @@ class InboxMessage(TAXIIMessage):
         do_check(value, 'record_count', type=RecordCount, can_be_none=True)
         self._record_count = value
 
-    def to_etree(self):
+    def _header_etree(self):
+        """Create the etree for this message, without the Content Blocks."""
         xml = super(InboxMessage, self).to_etree()
 
         if self.result_id is not None:
@@ -3148,12 +3391,16 @@ class InboxMessage(TAXIIMessage):
         if self.record_count is not None:
             xml.append(self.record_count.to_etree())
 
+        return xml
+
+    def to_etree(self):
+        xml = self._header_etree()
         for block in self.content_blocks:
             xml.append(block.to_etree())
 
         return xml
 
-    def to_dict(self):
+    def _header_dict(self):
         d = super(InboxMessage, self).to_dict()
 
         if self.result_id is not None:
@@ -3172,6 +3419,10 @@ class InboxMessage(TAXIIMessage):
         if self.record_count is not None:
             d['record_count'] = self.record_count.to_dict()
 
+        return d
+
+    def to_dict(self):
+        d = self._header_dict()
         d['content_blocks'] = []
         for block in self.content_blocks:
             d['content_blocks'].append(block.to_dict())
@@ -3199,28 +3450,28 @@ class InboxMessage(TAXIIMessage):
     def from_etree(cls, etree_xml):
         kwargs = {}
 
-        result_id_set = etree_xml.xpath('./@result_id')
+        result_id_set = get_all(etree_xml, './@result_id', ns_map)
         if len(result_id_set) > 0:
             kwargs['result_id'] = result_id_set[0]
 
         kwargs['destination_collection_names'] = []
-        dcn_set = etree_xml.xpath('./taxii_11:Destination_Collection_Name', namespaces=ns_map)
+        dcn_set = get_all(etree_xml, './taxii_11:Destination_Collection_Name', ns_map)
         for dcn in dcn_set:
             kwargs['destination_collection_names'].append(dcn.text)
 
-        msg_set = etree_xml.xpath('./taxii_11:Message', namespaces=ns_map)
+        msg_set = get_all(etree_xml, './taxii_11:Message', ns_map)
         if len(msg_set) > 0:
             kwargs['message'] = msg_set[0].text
 
-        subs_infos = etree_xml.xpath('./taxii_11:Source_Subscription', namespaces=ns_map)
+        subs_infos = get_all(etree_xml, './taxii_11:Source_Subscription', ns_map)
         if len(subs_infos) > 0:
             kwargs['subscription_information'] = SubscriptionInformation.from_etree(subs_infos[0])
 
-        record_count_set = etree_xml.xpath('./taxii_11:Record_Count', namespaces=ns_map)
+        record_count_set = get_all(etree_xml, './taxii_11:Record_Count', ns_map)
         if len(record_count_set) > 0:
             kwargs['record_count'] = RecordCount.from_etree(record_count_set[0])
 
-        content_blocks = etree_xml.xpath('./taxii_11:Content_Block', namespaces=ns_map)
+        content_blocks = get_all(etree_xml, './taxii_11:Content_Block', ns_map)
         kwargs['content_blocks'] = []
         for block in content_blocks:
             kwargs['content_blocks'].append(ContentBlock.from_etree(block))
@@ -3275,6 +3526,9 @@ class SubscriptionInformation(TAXIIBase11):
             **Optional for a Data Feed, Prohibited for a Data Set**
     """
 
+    __slots__ = ('_collection_name', '_exclusive_begin_timestamp_label', '_inclusive_end_timestamp_label',
+                 '_subscription_id')
+
     def __init__(self, collection_name, subscription_id, exclusive_begin_timestamp_label=None, inclusive_end_timestamp_label=None):
         self.collection_name = collection_name
         self.subscription_id = subscription_id
@@ -3640,7 +3894,7 @@ class ManageCollectionSubscriptionResponse(TAXIIMessage):
         kwargs['message'] = get_optional_text(etree_xml, './taxii_11:Message', ns_map)
 
         kwargs['subscription_instances'] = []
-        for si in etree_xml.xpath('./taxii_11:Subscription', namespaces=ns_map):
+        for si in get_all(etree_xml, './taxii_11:Subscription', ns_map):
             kwargs['subscription_instances'].append(SubscriptionInstance.from_etree(si))
 
         msg = super(ManageCollectionSubscriptionResponse, cls).from_etree(etree_xml, **kwargs)
@@ -3680,6 +3934,8 @@ class SubscriptionInstance(TAXIIBase11):
                 polled to fulfill this subscription. **Optional**
     """
 
+    __slots__ = ('_poll_instances', '_push_parameters', '_status', '_subscription_id', '_subscription_parameters')
+
     def __init__(self, subscription_id, status=SS_ACTIVE,
                  subscription_parameters=None, push_parameters=None,
                  poll_instances=None):
@@ -3806,7 +4062,7 @@ class SubscriptionInstance(TAXIIBase11):
             push_parameters = PushParameters.from_etree(push_parameters_el)
 
         poll_instances = []
-        for pi in etree_xml.xpath('./taxii_11:Poll_Instance', namespaces=ns_map):
+        for pi in get_all(etree_xml, './taxii_11:Poll_Instance', ns_map):
             poll_instances.append(PollInstance.from_etree(pi))
 
         return SubscriptionInstance(subscription_id, status, subscription_parameters, push_parameters, poll_instances)
@@ -3848,6 +4104,8 @@ class PollInstance(TAXIIBase11):
             instance. **Required**
     """
 
+    __slots__ = ('_poll_message_bindings', '_poll_protocol', 'poll_address')
+
     def __init__(self, poll_protocol, poll_address, poll_message_bindings=None):
         self.poll_protocol = poll_protocol
         self.poll_address = poll_address
@@ -3915,7 +4173,7 @@ class PollInstance(TAXIIBase11):
         address = get_required(etree_xml, './taxii_11:Address', ns_map).text
 
         poll_message_bindings = []
-        for b in etree_xml.xpath('./taxii_11:Message_Binding', namespaces=ns_map):
+        for b in get_all(etree_xml, './taxii_11:Message_Binding', ns_map):
             poll_message_bindings.append(b.text)
 
         return PollInstance(poll_protocol, address, poll_message_bindings)
@@ -4017,6 +4275,36 @@ class PollFulfillmentRequest(TAXIIRequestMessage):
         return super(PollFulfillmentRequest, cls).from_dict(d, **kwargs)
 
 
+# TAXII objects that to_dict() may leave in a dict as they are
+_BINARY_OBJECT_TYPES = {
+    'ContentBinding': ContentBinding.from_dict,
+}
+
+# Message classes by message type, used to dispatch parsing
+_MESSAGE_CLASSES = {
+    MSG_DISCOVERY_REQUEST: DiscoveryRequest,
+    MSG_DISCOVERY_RESPONSE: DiscoveryResponse,
+    MSG_COLLECTION_INFORMATION_REQUEST: CollectionInformationRequest,
+    MSG_COLLECTION_INFORMATION_RESPONSE: CollectionInformationResponse,
+    MSG_POLL_REQUEST: PollRequest,
+    MSG_POLL_RESPONSE: PollResponse,
+    MSG_STATUS_MESSAGE: StatusMessage,
+    MSG_INBOX_MESSAGE: InboxMessage,
+    MSG_MANAGE_COLLECTION_SUBSCRIPTION_REQUEST: ManageCollectionSubscriptionRequest,
+    MSG_MANAGE_COLLECTION_SUBSCRIPTION_RESPONSE: ManageCollectionSubscriptionResponse,
+    MSG_POLL_FULFILLMENT_REQUEST: PollFulfillmentRequest,
+}
+
+_MESSAGE_CLASSES_BY_TAG = dict(('{%s}%s' % (ns_map['taxii_11'], message_type), message_class)
+                               for message_type, message_class in six.iteritems(_MESSAGE_CLASSES))
+
+# Messages whose Content Blocks iter_poll_response() yields as they are parsed
+_ITER_MESSAGE_CLASSES = {
+    '{%s}%s' % (ns_map['taxii_11'], MSG_POLL_RESPONSE): PollResponse,
+    '{%s}%s' % (ns_map['taxii_11'], MSG_INBOX_MESSAGE): InboxMessage,
+}
+
+
 ########################################################
 # EVERYTHING BELOW HERE IS FOR BACKWARDS COMPATIBILITY #
 ########################################################
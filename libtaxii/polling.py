@@ -0,0 +1,597 @@
+# Copyright (c) 2017, The MITRE Corporation
+# For license information, see the LICENSE.txt file
+
+"""
+Helpers for polling TAXII Data Collections (TAXII 1.1) and Data Feeds
+(TAXII 1.0).
+"""
+import copy
+import heapq
+import threading
+import time
+
+from six.moves import queue as Queue
+
+import libtaxii.messages_10 as tm10
+import libtaxii.messages_11 as tm11
+from libtaxii.clients import HttpClient, StatusMessageError
+from libtaxii.common import generate_message_id
+from libtaxii.constants import *
+from libtaxii.retry import send_message
+
+
+class PollTarget(object):
+
+    """A Data Collection (or TAXII 1.0 Data Feed) to poll, and the time
+    window to poll it for.
+
+    :param str host: The host name of the Poll Service.
+    :param str path: The path of the Poll Service.
+    :param str collection_name: The Data Collection name. For TAXII 1.0,
+        this is the Data Feed name.
+    :param datetime exclusive_begin_timestamp_label: The start of the time
+        window, or None.
+    :param datetime inclusive_end_timestamp_label: The end of the time
+        window, or None.
+    :param int port: The port of the Poll Service, or None for the default.
+    :param str version: :py:data:`VID_TAXII_XML_11` to send a TAXII 1.1
+        Poll Request, or :py:data:`VID_TAXII_XML_10` for TAXII 1.0.
+    :param client: The :py:class:`libtaxii.clients.HttpClient` to use for this
+        target, or None to use the :py:class:`PollOrchestrator`'s client.
+    :param str subscription_id: The Subscription ID to poll, if any.
+    :param poll_parameters: The TAXII 1.1 Poll Parameters. If neither
+        ``subscription_id`` nor ``poll_parameters`` is given, default Poll
+        Parameters are used.
+    :param list content_bindings: The TAXII 1.0 Content Bindings to request.
+    """
+
+    def __init__(self, host, path, collection_name, exclusive_begin_timestamp_label=None,
+                 inclusive_end_timestamp_label=None, port=None, version=VID_TAXII_XML_11, client=None,
+                 subscription_id=None, poll_parameters=None, content_bindings=None):
+        if version not in (VID_TAXII_XML_10, VID_TAXII_XML_11):
+            raise ValueError('version must be VID_TAXII_XML_10 or VID_TAXII_XML_11')
+
+        self.host = host
+        self.path = path
+        self.collection_name = collection_name
+        self.exclusive_begin_timestamp_label = exclusive_begin_timestamp_label
+        self.inclusive_end_timestamp_label = inclusive_end_timestamp_label
+        self.port = port
+        self.version = version
+        self.client = client
+        self.subscription_id = subscription_id
+        self.poll_parameters = poll_parameters
+        self.content_bindings = content_bindings
+
+    def __repr__(self):
+        return 'PollTarget(%r, %r, %r)' % (self.host, self.path, self.collection_name)
+
+    def to_poll_request(self):
+        """Return the Poll Request for this target."""
+        if self.version == VID_TAXII_XML_10:
+            return tm10.PollRequest(
+                message_id=generate_message_id(),
+                feed_name=self.collection_name,
+                exclusive_begin_timestamp_label=self.exclusive_begin_timestamp_label,
+                inclusive_end_timestamp_label=self.inclusive_end_timestamp_label,
+                subscription_id=self.subscription_id,
+                content_bindings=self.content_bindings)
+
+        poll_parameters = self.poll_parameters
+        if poll_parameters is None and self.subscription_id is None:
+            poll_parameters = tm11.PollParameters()
+        return tm11.PollRequest(
+            message_id=generate_message_id(),
+            collection_name=self.collection_name,
+            exclusive_begin_timestamp_label=self.exclusive_begin_timestamp_label,
+            inclusive_end_timestamp_label=self.inclusive_end_timestamp_label,
+            subscription_id=self.subscription_id,
+            poll_parameters=poll_parameters)
+
+
+class PollResult(object):
+
+    """The outcome of polling one :py:class:`PollTarget`.
+
+    Content Blocks are not kept here; they are handed to the
+    :py:class:`PollOrchestrator`'s callback or queue as they arrive.
+    """
+
+    def __init__(self, target):
+        #: The :py:class:`PollTarget` that was polled.
+        self.target = target
+        #: The number of Content Blocks received.
+        self.content_block_count = 0
+        #: The number of Poll Responses (result parts) received.
+        self.response_count = 0
+        #: The Result ID of an asynchronous poll, if the server returned one.
+        self.result_id = None
+        #: The exception that stopped polling this target, or None. A
+        #: :py:class:`libtaxii.clients.StatusMessageError` if the server
+        #: responded with a Status Message.
+        self.error = None
+
+    def __repr__(self):
+        return 'PollResult(%r, content_block_count=%r, error=%r)' % (
+            self.target, self.content_block_count, self.error)
+
+
+def _send_message(client, host, path, message, port, timeout, retry_policy):
+    if retry_policy is not None:
+        return retry_policy.send_message(client, host, path, message, port, timeout)
+    return send_message(client, host, path, message, port, timeout)
+
+
+class _Fetch(object):
+
+    """A Poll Fulfillment Request running in its own thread."""
+
+    def __init__(self, target, *args):
+        self._done = threading.Event()
+        self._response = None
+        self._error = None
+        thread = threading.Thread(target=self._run, args=(target,) + args)
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, target, *args):
+        try:
+            self._response = target(*args)
+        except Exception as e:
+            self._error = e
+        self._done.set()
+
+    def result(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._response
+
+
+class PollResultIterator(object):
+
+    """Iterate over the Content Blocks of a (possibly multi-part) poll
+    result.
+
+    Starting from the first :py:class:`libtaxii.messages_11.PollResponse`,
+    the following result parts are requested with Poll Fulfillment Requests.
+    Up to ``max_concurrent`` of them are in flight at once, ahead of the
+    part being iterated over, and Content Blocks are yielded in part order.
+
+    Since a Poll Response only says whether there are more parts, parts
+    may be requested past the end of the result; those responses are
+    discarded. If the total number of records is known, from the first
+    response's ``record_count`` or the ``record_count`` argument (see
+    :py:meth:`poll`), no more parts than needed are requested ahead.
+
+    A TAXII 1.0 Poll Response has no further parts; its Content Blocks are
+    simply yielded.
+
+    :param client: The :py:class:`libtaxii.clients.HttpClient` to send Poll
+        Fulfillment Requests with. It must be safe to use from several
+        threads, which every libtaxii client is.
+    :param str host: The host name of the Poll Service.
+    :param str path: The path of the Poll Service.
+    :param poll_response: The first Poll Response.
+    :param int port: The port of the Poll Service, or None for the default.
+    :param int max_concurrent: The maximum number of parts requested at once.
+    :param int record_count: The total number of records in the result, if known.
+    :param float timeout: The timeout of each HTTP request, in seconds.
+    :param retry_policy: The :py:class:`libtaxii.retry.RetryPolicy` for each
+        request, or None to not retry.
+    :param bool detach_content: Whether to move the XML content of each
+        Content Block into a document of its own as it is yielded (see
+        :py:meth:`libtaxii.messages_11.ContentBlock.detach`), so that keeping
+        a Content Block does not keep its whole Poll Response in memory.
+
+    Example:
+        .. code-block:: python
+
+            for content_block in PollResultIterator.poll(client, host, '/poll/', poll_request, count_first=True):
+                save(content_block)
+    """
+
+    def __init__(self, client, host, path, poll_response, port=None, max_concurrent=4, record_count=None,
+                 timeout=None, retry_policy=None, detach_content=True):
+        if max_concurrent < 1:
+            raise ValueError('max_concurrent must be at least 1')
+        self.client = client
+        self.host = host
+        self.path = path
+        self.port = port
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.retry_policy = retry_policy
+        self.detach_content = detach_content
+        #: The number of Poll Responses that have been iterated over.
+        self.response_count = 1
+
+        self._content_blocks = iter(poll_response.content_blocks)
+        self._fetches = {}  # _Fetch by result part number
+
+        if not isinstance(poll_response, tm11.PollResponse) or not poll_response.more:
+            self._last_part = self._part = 0
+            return
+
+        self._collection_name = poll_response.collection_name
+        self._result_id = poll_response.result_id
+        self._part = poll_response.result_part_number
+        self._next_request = self._part + 1
+        self._last_part = None
+
+        if record_count is None and poll_response.record_count is not None:
+            record_count = poll_response.record_count.record_count
+        # Estimate the number of the last part, assuming parts (numbered
+        # from 1) have the same number of Content Blocks as this one
+        block_count = len(poll_response.content_blocks)
+        self._estimated_last_part = None
+        if record_count and block_count:
+            self._estimated_last_part = max(-(-record_count // block_count), self._part + 1)
+
+        self._request_ahead()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            try:
+                content_block = next(self._content_blocks)
+            except StopIteration:
+                pass
+            else:
+                if self.detach_content:
+                    content_block.detach()
+                return content_block
+
+            if self._part == self._last_part:
+                raise StopIteration
+
+            self._part += 1
+            response = self._fetches.pop(self._part).result()
+            if response.message_type != MSG_POLL_RESPONSE:
+                self.close()
+                if response.message_type == MSG_STATUS_MESSAGE:
+                    raise StatusMessageError(response)
+                raise ValueError('Unexpected response to a Poll Fulfillment Request: %s' % response.message_type)
+
+            self.response_count += 1
+            self._content_blocks = iter(response.content_blocks)
+            if not response.more:
+                self.close()
+            else:
+                if self._estimated_last_part is not None and self._part >= self._estimated_last_part:
+                    self._estimated_last_part = None  # The estimate was wrong
+                self._request_ahead()
+
+    next = __next__
+
+    def close(self):
+        """Stop requesting further parts. Requests already sent are ignored."""
+        self._last_part = self._part
+        self._fetches.clear()
+
+    def _request_ahead(self):
+        limit = self._part + self.max_concurrent
+        if self._estimated_last_part is not None:
+            limit = min(limit, self._estimated_last_part)
+        while self._next_request <= limit:
+            self._fetches[self._next_request] = _Fetch(self._fulfill, self._next_request)
+            self._next_request += 1
+
+    def _fulfill(self, part):
+        request = tm11.PollFulfillmentRequest(
+            message_id=generate_message_id(),
+            collection_name=self._collection_name,
+            result_id=self._result_id,
+            result_part_number=part)
+        return _send_message(self.client, self.host, self.path, request, self.port, self.timeout,
+                             self.retry_policy)
+
+    @classmethod
+    def poll(cls, client, host, path, poll_request, port=None, max_concurrent=4, count_first=False,
+             timeout=None, retry_policy=None, detach_content=True):
+        """Send a Poll Request and return a :py:class:`PollResultIterator`
+        over its result.
+
+        :param poll_request: A :py:class:`libtaxii.messages_11.PollRequest`
+            or :py:class:`libtaxii.messages_10.PollRequest`.
+        :param bool count_first: If True, first send the same TAXII 1.1 Poll
+            Request with a response type of
+            :py:data:`libtaxii.constants.RT_COUNT_ONLY`, and use the record
+            count to size the read-ahead window. Ignored for requests that
+            have no Poll Parameters.
+        :raises libtaxii.clients.StatusMessageError: if the server answers
+            with a Status Message.
+        """
+        record_count = None
+        if count_first and getattr(poll_request, 'poll_parameters', None) is not None:
+            count_request = copy.deepcopy(poll_request)
+            count_request.message_id = generate_message_id()
+            count_request.poll_parameters.response_type = RT_COUNT_ONLY
+            response = _send_message(client, host, path, count_request, port, timeout, retry_policy)
+            if response.message_type == MSG_POLL_RESPONSE and response.record_count is not None:
+                record_count = response.record_count.record_count
+
+        response = _send_message(client, host, path, poll_request, port, timeout, retry_policy)
+        if response.message_type != MSG_POLL_RESPONSE:
+            if response.message_type == MSG_STATUS_MESSAGE:
+                raise StatusMessageError(response)
+            raise ValueError('Unexpected response to a Poll Request: %s' % response.message_type)
+
+        return cls(client, host, path, response, port, max_concurrent, record_count, timeout, retry_policy,
+                   detach_content)
+
+
+class PollOrchestrator(object):
+
+    """Poll many Data Collections concurrently.
+
+    Targets are polled by a pool of ``max_workers`` threads, with at most
+    ``max_per_host`` concurrent requests to any one host. When a TAXII 1.1
+    server splits a result into several parts, the remaining parts are
+    fetched one at a time with a :py:class:`PollResultIterator`.
+
+    Every Content Block received is passed to ``callback`` as
+    ``callback(target, content_block)``, and/or put on ``queue`` as a
+    ``(target, content_block)`` tuple, as soon as the response containing it
+    has been parsed. ``callback`` is called from the worker threads.
+
+    :param client: The default :py:class:`libtaxii.clients.HttpClient` for
+        targets that don't have their own. It is shared by all worker threads.
+    :param int max_workers: The maximum number of concurrent requests.
+    :param int max_per_host: The maximum number of concurrent requests to the
+        same host and port.
+    :param callback: A callable that receives each Content Block.
+    :param queue: A ``queue.Queue`` that receives each Content Block.
+    :param float timeout: The timeout of each HTTP request, in seconds.
+    :param retry_policy: The :py:class:`libtaxii.retry.RetryPolicy` for each
+        request, or None to not retry.
+
+    Example:
+        .. code-block:: python
+
+            targets = [PollTarget('taxii.example.com', '/poll/', name, begin, end)
+                       for name in collection_names]
+            orchestrator = PollOrchestrator(tc.PooledHttpClient(), max_per_host=4, callback=save_block)
+            for result in orchestrator.run(targets):
+                if result.error:
+                    print('Polling %s failed: %s' % (result.target, result.error))
+    """
+
+    def __init__(self, client=None, max_workers=8, max_per_host=2, callback=None, queue=None, timeout=None,
+                 retry_policy=None):
+        if max_workers < 1 or max_per_host < 1:
+            raise ValueError('max_workers and max_per_host must be at least 1')
+        self.client = client if client is not None else HttpClient()
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.callback = callback
+        self.queue = queue
+        self.timeout = timeout
+        self.retry_policy = retry_policy
+
+    def run(self, targets):
+        """Poll all of ``targets`` and wait until they are done.
+
+        :return: A list of :py:class:`PollResult`, in the same order as ``targets``.
+        """
+        pending = list(enumerate(targets))
+        results = [None] * len(pending)
+        active = {}  # Number of requests in progress, by (host, port)
+        condition = threading.Condition()
+
+        def next_target():
+            with condition:
+                while pending:
+                    for i, (index, target) in enumerate(pending):
+                        key = (target.host, target.port)
+                        if active.get(key, 0) < self.max_per_host:
+                            del pending[i]
+                            active[key] = active.get(key, 0) + 1
+                            return index, target
+                    # Every remaining target's host is busy
+                    condition.wait()
+                return None
+
+        def worker():
+            while True:
+                item = next_target()
+                if item is None:
+                    return
+                index, target = item
+                try:
+                    results[index] = self.poll(target)
+                finally:
+                    with condition:
+                        active[(target.host, target.port)] -= 1
+                        condition.notify_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(min(self.max_workers, len(pending)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def poll(self, target):
+        """Poll a single target, delivering its Content Blocks.
+
+        :return: A :py:class:`PollResult`.
+        """
+        result = PollResult(target)
+        client = target.client if target.client is not None else self.client
+        content_blocks = None
+        try:
+            # Parts are fetched one at a time to stay within max_per_host
+            content_blocks = PollResultIterator.poll(client, target.host, target.path, target.to_poll_request(),
+                                                     target.port, max_concurrent=1, timeout=self.timeout,
+                                                     retry_policy=self.retry_policy)
+            self._deliver_all(target, result, content_blocks)
+        except Exception as e:
+            result.error = e
+        if content_blocks is not None:
+            result.response_count = content_blocks.response_count
+        return result
+
+    def _deliver_all(self, target, result, content_blocks):
+        for content_block in content_blocks:
+            self._deliver(target, content_block)
+            result.content_block_count += 1
+
+    def _deliver(self, target, content_block):
+        if self.callback is not None:
+            self.callback(target, content_block)
+        if self.queue is not None:
+            self.queue.put((target, content_block))
+
+
+class AsyncPollScheduler(PollOrchestrator):
+
+    """Poll many TAXII 1.1 Data Collections with asynchronous polls.
+
+    Every target is sent a Poll Request with ``allow_asynch`` set. When the
+    server answers with a :py:data:`ST_PENDING
+    <libtaxii.constants.ST_PENDING>` Status Message, the result ID is
+    recorded and a Poll Fulfillment Request for it is sent once the
+    server's estimated wait (or ``default_wait``, if the server gave none)
+    has passed, and again until the result is ready. Results that are
+    returned right away are handled as by :py:class:`PollOrchestrator`.
+
+    Pending results wait in a timer heap, not in a thread each, so any
+    number of collections can be pending while only ``max_workers``
+    requests are in progress. TAXII 1.0 targets are polled synchronously.
+
+    The arguments are the same as for :py:class:`PollOrchestrator`, plus:
+
+    :param float default_wait: The number of seconds to wait before asking
+        for a pending result when the server gave no estimated wait.
+    :param float max_wait: The longest a pending result is waited for, in
+        seconds, or None for no limit. Past it, the target's
+        :py:attr:`PollResult.error` is set to the last Status Message, as a
+        :py:class:`libtaxii.clients.StatusMessageError`.
+    """
+
+    def __init__(self, client=None, max_workers=8, max_per_host=2, callback=None, queue=None, timeout=None,
+                 retry_policy=None, default_wait=30, max_wait=None):
+        super(AsyncPollScheduler, self).__init__(client, max_workers, max_per_host, callback, queue, timeout,
+                                                 retry_policy)
+        self.default_wait = default_wait
+        self.max_wait = max_wait
+
+    def run(self, targets):
+        """Poll all of ``targets`` and wait until all results have arrived.
+
+        :return: A list of :py:class:`PollResult`, in the same order as ``targets``.
+        """
+        results = [PollResult(target) for target in targets]
+        start = time.time()
+        # (time due, sequence number, index of the target, result ID)
+        timers = [(start, index, index, None) for index in range(len(targets))]
+        sequence = [len(targets)]
+        ready = []  # Timers that are due, waiting for their host to be free
+        active = {}  # Number of requests in progress, by (host, port)
+        outstanding = [len(targets)]  # Number of targets without a final result
+        condition = threading.Condition()
+        work = Queue.Queue()
+
+        def worker():
+            while True:
+                item = work.get()
+                if item is None:
+                    return
+                _, _, index, result_id = item
+                target = targets[index]
+                try:
+                    wait = self._poll_step(target, results[index], result_id, start)
+                except Exception as e:
+                    results[index].error = e
+                    wait = None
+                with condition:
+                    active[(target.host, target.port)] -= 1
+                    if wait is None:
+                        outstanding[0] -= 1
+                    else:
+                        heapq.heappush(timers, (time.time() + wait, sequence[0], index, results[index].result_id))
+                        sequence[0] += 1
+                    condition.notify()
+
+        threads = [threading.Thread(target=worker) for _ in range(min(self.max_workers, len(targets)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        with condition:
+            while outstanding[0]:
+                now = time.time()
+                while timers and timers[0][0] <= now:
+                    ready.append(heapq.heappop(timers))
+                for item in list(ready):
+                    key = (targets[item[2]].host, targets[item[2]].port)
+                    if active.get(key, 0) < self.max_per_host:
+                        ready.remove(item)
+                        active[key] = active.get(key, 0) + 1
+                        work.put(item)
+                condition.wait(timers[0][0] - now if timers else None)
+
+        for thread in threads:
+            work.put(None)
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def _poll_step(self, target, result, result_id, start):
+        """Send the Poll Request, or a Poll Fulfillment Request for a pending
+        result, and deliver the Content Blocks if the result is ready.
+
+        :return: The number of seconds to wait before asking for the result
+            again, or None if polling the target is done.
+        """
+        client = target.client if target.client is not None else self.client
+
+        if result_id is None:
+            request = target.to_poll_request()
+            if isinstance(request, tm11.PollRequest) and request.poll_parameters is not None:
+                request.poll_parameters = copy.deepcopy(request.poll_parameters)
+                request.poll_parameters.allow_asynch = True
+        else:
+            request = tm11.PollFulfillmentRequest(
+                message_id=generate_message_id(),
+                collection_name=target.collection_name,
+                result_id=result_id,
+                result_part_number=1)
+
+        response = _send_message(client, target.host, target.path, request, target.port, self.timeout,
+                                 self.retry_policy)
+
+        if response.message_type == MSG_STATUS_MESSAGE and response.status_type == ST_PENDING:
+            status_detail = response.status_detail
+            if not isinstance(status_detail, dict):
+                status_detail = {}
+            if result_id is None:
+                result.result_id = status_detail.get(SD_RESULT_ID)
+                if result.result_id is None:
+                    raise StatusMessageError(response)
+            try:
+                wait = float(status_detail[SD_ESTIMATED_WAIT])
+            except (KeyError, TypeError, ValueError):
+                wait = self.default_wait
+            if self.max_wait is not None and time.time() + wait - start > self.max_wait:
+                raise StatusMessageError(response)
+            return wait
+
+        if response.message_type != MSG_POLL_RESPONSE:
+            if response.message_type == MSG_STATUS_MESSAGE:
+                raise StatusMessageError(response)
+            raise ValueError('Unexpected response to a Poll Request: %s' % response.message_type)
+
+        content_blocks = PollResultIterator(client, target.host, target.path, response, target.port,
+                                            max_concurrent=1, timeout=self.timeout, retry_policy=self.retry_policy)
+        try:
+            self._deliver_all(target, result, content_blocks)
+        finally:
+            result.response_count = content_blocks.response_count
+        return None
@@ -0,0 +1,189 @@
+# Copyright (c) 2017, The MITRE Corporation
+# For license information, see the LICENSE.txt file
+
+"""
+Automatic retries of TAXII requests
+"""
+import random
+import socket
+import threading
+import time
+
+import six
+from six.moves import urllib
+
+import libtaxii
+from libtaxii.constants import *
+
+#: The message types that are safe to send again, and are retried by a
+#: :py:class:`RetryPolicy`.
+IDEMPOTENT_MESSAGE_TYPES = frozenset([
+    MSG_DISCOVERY_REQUEST,
+    MSG_FEED_INFORMATION_REQUEST,
+    MSG_COLLECTION_INFORMATION_REQUEST,
+    MSG_POLL_REQUEST,
+    MSG_POLL_FULFILLMENT_REQUEST,
+])
+
+# Errors that mean the request may not have reached the server, or the
+# response was lost on the way back
+_TRANSPORT_ERRORS = (socket.error, six.moves.http_client.HTTPException, urllib.error.URLError)
+
+
+def send_message(client, host, path, message, port=None, timeout=None):
+    """Send a TAXII message with an XML Message Binding and return the parsed
+    response.
+
+    libtaxii users should not need to use this function directly.
+    """
+    http_response = client.call_taxii_service2(host, path, message.version, message.to_xml(), port=port,
+                                               timeout=timeout)
+    return libtaxii.get_message_from_http_response(http_response, message.message_id)
+
+
+class _RetryBudget(object):
+
+    """A token bucket limiting the number of retries sent to one host."""
+
+    def __init__(self, capacity, refill_rate):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._tokens = float(capacity)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Use up one retry. Return False if there is none left."""
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_rate)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class RetryPolicy(object):
+
+    """Retry TAXII requests that fail with a transport error, or that the
+    server answers with a :py:data:`ST_RETRY <libtaxii.constants.ST_RETRY>`
+    Status Message.
+
+    Only messages in :py:data:`IDEMPOTENT_MESSAGE_TYPES` are retried. The
+    delay before each retry is chosen at random between 0 and
+    ``backoff_base * 2 ** (attempt - 1)``, capped at ``backoff_max``
+    ("full jitter"). If the server gives an estimated wait in a TAXII 1.1
+    Status Message, the delay is at least that long.
+
+    Retries to each host are limited by a budget of ``host_budget`` retries,
+    which refills at ``host_budget_refill`` retries per second, so a failing
+    server is not flooded with retries from many requests at once.
+
+    A RetryPolicy can be shared by several threads.
+
+    :param int max_attempts: The maximum number of attempts, including the first.
+    :param float backoff_base: The base delay, in seconds.
+    :param float backoff_max: The maximum delay between attempts, in seconds.
+    :param float max_elapsed: The maximum time spent on a request, in seconds.
+        No retry is made if its delay would exceed this.
+    :param int host_budget: The maximum number of retries to a host in a burst.
+    :param float host_budget_refill: The number of retries per second added
+        back to each host's budget.
+
+    Example:
+        .. code-block:: python
+
+            policy = RetryPolicy(max_attempts=4, max_elapsed=120)
+            poll_response = policy.send_message(client, 'taxii.example.com', '/poll/', poll_request)
+    """
+
+    def __init__(self, max_attempts=5, backoff_base=1.0, backoff_max=60.0, max_elapsed=300.0,
+                 host_budget=20, host_budget_refill=0.5):
+        if max_attempts < 1:
+            raise ValueError('max_attempts must be at least 1')
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_elapsed = max_elapsed
+        self.host_budget = host_budget
+        self.host_budget_refill = host_budget_refill
+        self._budgets = {}
+        self._budgets_lock = threading.Lock()
+
+    def send_message(self, client, host, path, message, port=None, timeout=None):
+        """Send a TAXII message, retrying it if needed, and return the parsed
+        response.
+
+        :param client: The :py:class:`libtaxii.clients.HttpClient` to send
+            the message with.
+        :param message: A :py:mod:`libtaxii.messages_11` or
+            :py:mod:`libtaxii.messages_10` message.
+        :return: The last response. This is an :py:data:`ST_RETRY
+            <libtaxii.constants.ST_RETRY>` Status Message if the server still
+            asked for a retry when no more retries were allowed.
+        :raises: The last transport error, if the last attempt failed with one.
+        """
+        retry = message.message_type in IDEMPOTENT_MESSAGE_TYPES
+        start = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            error = None
+            response = None
+            try:
+                response = send_message(client, host, path, message, port, timeout)
+            except _TRANSPORT_ERRORS as e:
+                if not retry:
+                    raise
+                error = e
+
+            if error is None and not (retry and _is_retry(response)):
+                return response
+
+            delay = self.get_delay(attempt, response)
+            if (attempt >= self.max_attempts or
+                    time.time() - start + delay > self.max_elapsed or
+                    not self._get_budget(host, port).take()):
+                if error is not None:
+                    raise error
+                return response
+            self._sleep(delay)
+
+    def get_delay(self, attempt, response=None):
+        """Return the number of seconds to wait before retrying after
+        ``attempt`` failed attempts.
+
+        :param response: The Status Message that asked for the retry, if any.
+        """
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+        estimated_wait = _get_estimated_wait(response)
+        if estimated_wait is not None:
+            delay = max(delay, estimated_wait)
+        return delay
+
+    def _get_budget(self, host, port):
+        with self._budgets_lock:
+            budget = self._budgets.get((host, port))
+            if budget is None:
+                budget = _RetryBudget(self.host_budget, self.host_budget_refill)
+                self._budgets[(host, port)] = budget
+        return budget
+
+    def _sleep(self, seconds):
+        time.sleep(seconds)
+
+
+def _is_retry(response):
+    return response.message_type == MSG_STATUS_MESSAGE and response.status_type == ST_RETRY
+
+
+def _get_estimated_wait(response):
+    """Return the estimated wait from a TAXII 1.1 Status Message, or None."""
+    status_detail = getattr(response, 'status_detail', None)
+    if not isinstance(status_detail, dict):  # TAXII 1.0 has no Status Details
+        return None
+    try:
+        return float(status_detail[SD_ESTIMATED_WAIT])
+    except (KeyError, TypeError, ValueError):
+        return None
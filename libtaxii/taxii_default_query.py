@@ -16,7 +16,7 @@ from lxml import etree
 
 import libtaxii.messages_11 as tm11
 
-from .common import TAXIIBase
+from .common import TAXIIBase, get_all
 from .validation import (do_check, uri_regex, targeting_expression_regex)
 from .constants import *
 import six
@@ -149,6 +149,8 @@ class DefaultQueryInfo(tm11.SupportedQuery):
         :type capability_modules: :class:`list` of :class:`str`
     """
 
+    __slots__ = ('_capability_modules', '_targeting_expression_infos')
+
     def __init__(self, targeting_expression_infos, capability_modules):
         super(DefaultQueryInfo, self).__init__(FID_TAXII_DEFAULT_QUERY_10)
         self.targeting_expression_infos = targeting_expression_infos
@@ -205,12 +207,12 @@ class DefaultQueryInfo(tm11.SupportedQuery):
 
     @staticmethod
     def from_etree(etree_xml):
-        texpr_infos = etree_xml.xpath('./tdq:Default_Query_Info/tdq:Targeting_Expression_Info', namespaces=ns_map)
+        texpr_infos = get_all(etree_xml, './tdq:Default_Query_Info/tdq:Targeting_Expression_Info', ns_map)
         texpr_info_list = []
         for texpr_info in texpr_infos:
             texpr_info_list.append(DefaultQueryInfo.TargetingExpressionInfo.from_etree(texpr_info))
 
-        cms = etree_xml.xpath('./tdq:Default_Query_Info/tdq:Capability_Module', namespaces=ns_map)
+        cms = get_all(etree_xml, './tdq:Default_Query_Info/tdq:Capability_Module', ns_map)
         cms_list = []
         for cm in cms:
             cms_list.append(cm.text)
@@ -240,6 +242,8 @@ class TargetingExpressionInfo(TAXIIBase):
         :type allowed_scope: :class:`list` of :class:`string`
     """
 
+    __slots__ = ('_allowed_scope', '_preferred_scope', '_targeting_expression_id')
+
     def __init__(self, targeting_expression_id, preferred_scope=None, allowed_scope=None):
         self.targeting_expression_id = targeting_expression_id
         self.preferred_scope = preferred_scope or []
@@ -311,15 +315,15 @@ class TargetingExpressionInfo(TAXIIBase):
     @staticmethod
     def from_etree(etree_xml):
         kwargs = {}
-        kwargs['targeting_expression_id'] = etree_xml.xpath('./@targeting_expression_id', namespaces=ns_map)[0]
+        kwargs['targeting_expression_id'] = get_all(etree_xml, './@targeting_expression_id', ns_map)[0]
         kwargs['preferred_scope'] = []
 
-        preferred_scope_set = etree_xml.xpath('./tdq:Preferred_Scope', namespaces=ns_map)
+        preferred_scope_set = get_all(etree_xml, './tdq:Preferred_Scope', ns_map)
         for preferred in preferred_scope_set:
             kwargs['preferred_scope'].append(preferred.text)
 
         kwargs['allowed_scope'] = []
-        allowed_scope_set = etree_xml.xpath('./tdq:Allowed_Scope', namespaces=ns_map)
+        allowed_scope_set = get_all(etree_xml, './tdq:Allowed_Scope', ns_map)
         for allowed in allowed_scope_set:
             kwargs['allowed_scope'].append(allowed.text)
 
@@ -339,6 +343,8 @@ class DefaultQuery(tm11.Query):
         :type criteria: :class:`DefaultQuery.Criteria`
     """
 
+    __slots__ = ('_criteria', '_targeting_expression_id')
+
     def __init__(self, targeting_expression_id, criteria):
         super(DefaultQuery, self).__init__(FID_TAXII_DEFAULT_QUERY_10)
         self.targeting_expression_id = targeting_expression_id
@@ -384,8 +390,8 @@ class DefaultQuery(tm11.Query):
 
     @staticmethod
     def from_etree(etree_xml):
-        tei = etree_xml.xpath('./tdq:Default_Query/@targeting_expression_id', namespaces=ns_map)[0]  # attrib['targeting_expression_id']
-        criteria = DefaultQuery.Criteria.from_etree(etree_xml.xpath('./tdq:Default_Query/tdq:Criteria', namespaces=ns_map)[0])
+        tei = get_all(etree_xml, './tdq:Default_Query/@targeting_expression_id', ns_map)[0]  # attrib['targeting_expression_id']
+        criteria = DefaultQuery.Criteria.from_etree(get_all(etree_xml, './tdq:Default_Query/tdq:Criteria', ns_map)[0])
         return DefaultQuery(tei, criteria)
 
     @staticmethod
@@ -406,6 +412,8 @@ class Criteria(TAXIIBase):
     :type criterion: :class:`DefaultQuery.Criterion`
     """
 
+    __slots__ = ('_criteria', '_criterion', '_operator')
+
     def __init__(self, operator, criteria=None, criterion=None):
         self.operator = operator
         self.criteria = criteria or []
@@ -490,12 +498,12 @@ class Criteria(TAXIIBase):
         kwargs['operator'] = etree_xml.attrib['operator']
 
         kwargs['criteria'] = []
-        criteria_set = etree_xml.xpath('./tdq:Criteria', namespaces=ns_map)
+        criteria_set = get_all(etree_xml, './tdq:Criteria', ns_map)
         for criteria in criteria_set:
             kwargs['criteria'].append(DefaultQuery.Criteria.from_etree(criteria))
 
         kwargs['criterion'] = []
-        criterion_set = etree_xml.xpath('./tdq:Criterion', namespaces=ns_map)
+        criterion_set = get_all(etree_xml, './tdq:Criterion', ns_map)
         for criterion in criterion_set:
             kwargs['criterion'].append(DefaultQuery.Criterion.from_etree(criterion))
 
@@ -529,6 +537,8 @@ class Criterion(TAXIIBase):
         :param bool negate: Whether the result of applying the test to the target should be negated
     """
 
+    __slots__ = ('_negate', '_target', '_test')
+
     def __init__(self, target, test, negate=False):
         self.negate = negate
         self.target = target
@@ -597,13 +607,13 @@ class Criterion(TAXIIBase):
 
     @staticmethod
     def from_etree(etree_xml):
-        negate_set = etree_xml.xpath('./@negate')
+        negate_set = get_all(etree_xml, './@negate', ns_map)
         negate = None
         if len(negate_set) > 0:
             negate = negate_set[0] == 'true'
 
-        target = etree_xml.xpath('./tdq:Target', namespaces=ns_map)[0].text
-        test = DefaultQuery.Criterion.Test.from_etree(etree_xml.xpath('./tdq:Test', namespaces=ns_map)[0])
+        target = get_all(etree_xml, './tdq:Target', ns_map)[0].text
+        test = DefaultQuery.Criterion.Test.from_etree(get_all(etree_xml, './tdq:Test', ns_map)[0])
 
         return DefaultQuery.Criterion(target, test, negate)
 
@@ -625,6 +635,8 @@ class Test(TAXIIBase):
         :type parameters: :class:`dict` of key/value pairs
     """
 
+    __slots__ = ('_capability_id', '_parameters', '_relationship')
+
     def __init__(self, capability_id, relationship, parameters=None):
         self.capability_id = capability_id
         self.relationship = relationship
@@ -726,7 +738,7 @@ class Test(TAXIIBase):
         else:
             r = None
 
-        for parameter in etree_xml.xpath('./tdq:Parameter', namespaces=ns_map):
+        for parameter in get_all(etree_xml, './tdq:Parameter', ns_map):
             k = parameter.attrib['name']
             v = parameter.text
 
@@ -0,0 +1,72 @@
+# Copyright (c) 2017, The MITRE Corporation
+# For license information, see the LICENSE.txt file
+
+import datetime
+import unittest
+
+import dateutil.parser
+from dateutil.tz import tzoffset, tzutc
+from lxml import etree
+
+from libtaxii import common
+from libtaxii.common import get_xpath, parse_datetime_string
+
+
+class ParseDatetimeStringTests(unittest.TestCase):
+
+    def assertSameAsDateutil(self, datetime_string):
+        dt = parse_datetime_string(datetime_string)
+        expected = dateutil.parser.parse(datetime_string)
+        self.assertEqual(expected, dt)
+        self.assertEqual(expected.utcoffset(), dt.utcoffset())
+
+    def test_xs_datetime(self):
+        self.assertSameAsDateutil('2014-05-08T09:00:00Z')
+        self.assertSameAsDateutil('2014-05-08T09:00:00+00:00')
+        self.assertSameAsDateutil('2014-05-08T09:00:00-05:30')
+        self.assertSameAsDateutil('2014-05-08T09:00:00.123Z')
+        self.assertSameAsDateutil('2014-05-08T09:00:00.1234567+02:00')
+        self.assertSameAsDateutil('2014-05-08T09:00:00')
+
+    def test_fast_path_timezones(self):
+        dt = parse_datetime_string('2014-05-08T09:00:00.5-05:00')
+        self.assertEqual(datetime.datetime(2014, 5, 8, 9, 0, 0, 500000, tzoffset(None, -18000)), dt)
+        self.assertEqual(datetime.timedelta(0), parse_datetime_string('2014-05-08T09:00:00Z').utcoffset())
+
+    def test_other_formats_fall_back_to_dateutil(self):
+        self.assertSameAsDateutil('2014-05-08 09:00:00+00:00')
+        self.assertSameAsDateutil('May 8 2014 9:00 UTC')
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, parse_datetime_string, '2014-13-08T09:00:00Z')
+        self.assertRaises(ValueError, parse_datetime_string, 'not a timestamp')
+
+    def test_empty(self):
+        self.assertIsNone(parse_datetime_string(None))
+        self.assertIsNone(parse_datetime_string(''))
+
+    def test_cached(self):
+        ts = '2015-01-01T00:00:00.000001Z'
+        self.assertIs(parse_datetime_string(ts), parse_datetime_string(ts))
+        self.assertEqual(tzutc(), parse_datetime_string(ts).tzinfo)
+
+
+class GetXPathTests(unittest.TestCase):
+
+    def test_keyed_on_namespaces(self):
+        ns_map = {'a': 'urn:a'}
+        compiled = get_xpath('/a:x', ns_map)
+        self.assertIs(compiled, get_xpath('/a:x', {'a': 'urn:a'}))
+
+        # A namespace map with the same id() but different contents
+        ns_map['a'] = 'urn:b'
+        self.assertEqual(1, len(get_xpath('/a:x', ns_map)(etree.fromstring('<x xmlns="urn:b"/>'))))
+
+    def test_bounded(self):
+        for i in range(common._XPATH_CACHE_SIZE + 10):
+            get_xpath('/x%s' % i)
+        self.assertTrue(len(common._XPATH_CACHE) <= common._XPATH_CACHE_SIZE)
+
+
+if __name__ == '__main__':
+    unittest.main()
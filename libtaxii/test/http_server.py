@@ -0,0 +1,130 @@
+"""An HTTP server for tests of the TAXII clients."""
+
+from __future__ import unicode_literals
+
+import contextlib
+import threading
+import zlib
+
+import six
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+from libtaxii.constants import CB_STIX_XML_111, VID_TAXII_XML_11
+from libtaxii.messages_11 import ContentBlock, DiscoveryResponse, InboxMessage, PollResponse, get_message_from_xml
+
+
+class TAXIIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+    authorizations = set()
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding') != 'chunked':
+            return self.rfile.read(int(self.headers['Content-Length']))
+
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+            if size == 0:
+                return b''.join(chunks)
+
+    def do_POST(self):
+        self.connections.add(self.client_address)
+        self.authorizations.add(self.headers.get('Authorization'))
+        request = get_message_from_xml(self.read_body())
+        body = DiscoveryResponse(message_id='2', in_response_to=request.message_id).to_xml()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('X-TAXII-Content-Type', VID_TAXII_XML_11)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@contextlib.contextmanager
+def taxii_server(handler_class=TAXIIHandler):
+    server = _ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+    handler_class.connections = set()
+    handler_class.authorizations = set()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class CompressingHandler(TAXIIHandler):
+    """Accepts gzip request bodies, and gzips its response when the client
+    accepts it."""
+    request_encodings = []
+    transfer_encodings = []
+
+    def do_POST(self):
+        body = self.read_body()
+        self.request_encodings.append(self.headers.get('Content-Encoding'))
+        self.transfer_encodings.append(self.headers.get('Transfer-Encoding'))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        request = get_message_from_xml(body)
+        # Echo the request back, so there is something worth compressing
+        body = InboxMessage(message_id='2', in_response_to=request.message_id,
+                            content_blocks=getattr(request, 'content_blocks', [])).to_xml()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('X-TAXII-Content-Type', VID_TAXII_XML_11)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = zlib.compress(body)
+            self.send_header('Content-Encoding', 'deflate')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class SlowPollHandler(TAXIIHandler):
+    """Sends the first Content Block of a Poll Response, then waits until the
+    client has parsed it before sending the rest."""
+    first_block_parsed = threading.Event()
+    waited = []
+
+    message_binding = VID_TAXII_XML_11
+
+    def get_parts(self, request_body):
+        request = get_message_from_xml(request_body)
+        body = PollResponse(message_id='2', in_response_to=request.message_id, collection_name='default',
+                            content_blocks=[ContentBlock(CB_STIX_XML_111, '%s' % i * 10000)
+                                            for i in range(3)]).to_xml()
+        split = body.index(b'</taxii_11:Content_Block>') + len(b'</taxii_11:Content_Block>')
+        return [body[:split], body[split:]]
+
+    def do_POST(self):
+        self.connections.add(self.client_address)
+        parts = self.get_parts(self.read_body())
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('X-TAXII-Content-Type', self.message_binding)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            parts = [compressor.compress(parts[0]) + compressor.flush(zlib.Z_SYNC_FLUSH),
+                     compressor.compress(parts[1]) + compressor.flush()]
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(parts[0]) + len(parts[1])))
+        self.end_headers()
+        self.wfile.write(parts[0])
+        self.wfile.flush()
+        # Python 2 clients can't parse a partial read, so don't wait for them
+        self.waited.append(self.first_block_parsed.wait(0 if six.PY2 else 10))
+        self.wfile.write(parts[1])
@@ -6,6 +6,7 @@
 # 2. To provide examples of how to use libtaxii.messages
 
 import datetime
+import io
 import unittest
 import warnings
 import inspect
@@ -346,6 +347,64 @@ class PollResponseTests(unittest.TestCase):
         round_trip_message(poll_response2)
 
 
+class IterPollResponseTests(unittest.TestCase):
+
+    def test_iter_poll_response(self):
+        poll_response = tm10.PollResponse(
+            message_id=tm10.generate_message_id(),
+            in_response_to=tm10.generate_message_id(),
+            feed_name='FeedName',
+            inclusive_end_timestamp_label=datetime.datetime.now(tzutc()),
+            content_blocks=[string_content_block1, string_content_block1])
+        items = list(tm10.iter_poll_response(poll_response.to_xml()))
+
+        self.assertEqual(len(items), 3)
+        self.assertEqual(items[0].feed_name, 'FeedName')
+        self.assertEqual(items[0].inclusive_end_timestamp_label, poll_response.inclusive_end_timestamp_label)
+        self.assertEqual(items[0].content_blocks, [])
+        self.assertEqual(items[1:], [string_content_block1, string_content_block1])
+
+    def test_write_json(self):
+        poll_response = tm10.PollResponse(
+            message_id=tm10.generate_message_id(),
+            in_response_to=tm10.generate_message_id(),
+            feed_name='FeedName',
+            inclusive_end_timestamp_label=datetime.datetime.now(tzutc()),
+            content_blocks=[string_content_block1, string_content_block1])
+        f = io.BytesIO()
+        poll_response.write_json(f)
+        self.assertEqual(tm10.get_message_from_json(f.getvalue()), poll_response)
+
+    def test_iter_poll_response_json(self):
+        poll_response = tm10.PollResponse(
+            message_id=tm10.generate_message_id(),
+            in_response_to=tm10.generate_message_id(),
+            feed_name='FeedName',
+            inclusive_end_timestamp_label=datetime.datetime.now(tzutc()),
+            content_blocks=[string_content_block1, string_content_block1])
+        items = list(tm10.iter_poll_response_json(io.BytesIO(poll_response.to_json().encode('utf-8'))))
+
+        self.assertEqual(len(items), 3)
+        self.assertEqual(items[0].feed_name, 'FeedName')
+        self.assertEqual(items[0].inclusive_end_timestamp_label, poll_response.inclusive_end_timestamp_label)
+        self.assertEqual(items[0].content_blocks, [])
+        self.assertEqual(items[1:], [string_content_block1, string_content_block1])
+
+    def test_write_xml(self):
+        poll_response = tm10.PollResponse(
+            message_id=tm10.generate_message_id(),
+            in_response_to=tm10.generate_message_id(),
+            feed_name='FeedName',
+            inclusive_end_timestamp_label=datetime.datetime.now(tzutc()))
+        content_blocks = iter([string_content_block1, string_content_block1])
+        f = io.BytesIO()
+        poll_response.write_xml(f, content_blocks=content_blocks)
+
+        msg = tm10.get_message_from_xml(f.getvalue())
+        self.assertEqual(msg.feed_name, 'FeedName')
+        self.assertEqual(msg.content_blocks, [string_content_block1, string_content_block1])
+
+
 class StatusMessageTests(unittest.TestCase):
 
     def test_status_message(self):
@@ -570,6 +629,16 @@ class ContentBlockTests(unittest.TestCase):
         cb6 = tm10.ContentBlock(content_binding='RandomUnicodeString', content=six.text_type('abcdef'))
         round_trip_content_block(cb6)
 
+    def test_detach_after_reading_content(self):
+        cb = tm10.ContentBlock(content_binding=CB_STIX_XML_10,
+                               content='<stix:STIX_Package xmlns:stix="http://stix.mitre.org/stix-1"/>')
+        inbox = tm10.InboxMessage(message_id='1', content_blocks=[cb])
+        block = tm10.get_message_from_xml(inbox.to_xml()).content_blocks[0]
+        self.assertTrue(b'xmlns:taxii' in block.content)
+        block.detach()
+        self.assertTrue(b'xmlns:taxii' not in block.content)
+        self.assertEqual(block.content, etree.tostring(block._content))
+
 
 class VersionsTest(unittest.TestCase):
 
@@ -5,9 +5,14 @@
 # 1. To provide a rough unit test of libtaxii.messages
 # 2. To provide examples of how to use libtaxii.messages
 
+import copy
 import datetime
+import functools
 import io
+import json
+import pickle
 import sys
+import time
 import unittest
 import warnings
 import inspect
@@ -17,6 +22,7 @@ from lxml import etree
 
 import libtaxii as t
 import libtaxii.messages_11 as tm11
+from libtaxii.binary import encode_binary, decode_binary
 import libtaxii.taxii_default_query as tdq
 from libtaxii.validation import SchemaValidator
 from libtaxii.constants import *
@@ -194,6 +200,12 @@ def round_trip_message(taxii_message, print_xml=False):
         msg_from_xml.__eq__(msg_from_dict, True)
         raise Exception('Test #4 failed - msg_from_xml != msg_from_dict')
 
+    msg_from_binary = tm11.get_message_from_binary(taxii_message.to_binary())
+    if msg_from_binary != msg_from_dict:
+        print('\t Failure of test #5 - running equals w/ debug:')
+        msg_from_binary.__eq__(msg_from_dict, True)
+        raise Exception('Test #5 failed - msg_from_binary != msg_from_dict')
+
     # print '***** All tests completed!'
 
 
@@ -1061,6 +1073,21 @@ class PollResponseTests(unittest.TestCase):
             content_blocks=[])
         round_trip_message(poll_resp5)
 
+    def test_poll_resp_cdata_content(self):
+        # XML content is often sent CDATA-wrapped, and arrives as text
+        xml = ('<taxii_11:Poll_Response xmlns:taxii_11="http://taxii.mitre.org/messages/taxii_xml_binding-1.1" '
+               'message_id="1" in_response_to="2" collection_name="default" more="false" result_part_number="1">'
+               '<taxii_11:Content_Block>'
+               '<taxii_11:Content_Binding binding_id="%s"/>'
+               '<taxii_11:Content><![CDATA[<stix:STIX_Package xmlns:stix="http://stix.mitre.org/stix-1"/>]]>'
+               '</taxii_11:Content>'
+               '</taxii_11:Content_Block>'
+               '</taxii_11:Poll_Response>' % CB_STIX_XML_111)
+        block = tm11.get_message_from_xml(xml).content_blocks[0]
+        self.assertTrue(block.content_is_xml)
+        self.assertEqual(etree.fromstring(block.content).tag, '{http://stix.mitre.org/stix-1}STIX_Package')
+        self.assertTrue(isinstance(block.content, six.binary_type))
+
 
 class InboxMessageTests(unittest.TestCase):
 
@@ -1111,6 +1138,346 @@ class InboxMessageTests(unittest.TestCase):
         round_trip_message(inbox)
 
 
+class _SmallReads(object):
+    """A binary file that returns at most ``size`` bytes per read."""
+
+    def __init__(self, data, size):
+        self._data = io.BytesIO(data)
+        self._size = size
+        self.remaining = len(data)
+
+    def read(self, size=-1):
+        data = self._data.read(self._size)
+        self.remaining -= len(data)
+        return data
+
+
+class IterPollResponseTests(unittest.TestCase):
+
+    def assertContentBlocksEqual(self, blocks, expected):
+        # Detached content does not carry the in-scope namespace declarations
+        # of the original message, so compare the content canonically.
+        self.assertEqual(len(blocks), len(expected))
+        for block, expected_block in zip(blocks, expected):
+            self.assertEqual(block.content_binding, expected_block.content_binding)
+            self.assertEqual(block.timestamp_label, expected_block.timestamp_label)
+            self.assertEqual(block.message, expected_block.message)
+            self.assertEqual(block.padding, expected_block.padding)
+            self.assertEqual(etree.tostring(block._content, method='c14n', exclusive=True),
+                             etree.tostring(expected_block._content, method='c14n', exclusive=True))
+
+    def test_iter_poll_response(self):
+        poll_resp = tm11.PollResponse(
+            message_id='PollResp1',
+            in_response_to='tmp',
+            collection_name='blah',
+            more=True,
+            result_id='123',
+            result_part_number=2,
+            record_count=tm11.RecordCount(record_count=2, partial_count=True),
+            message='Woooooooo',
+            content_blocks=[cb001, cb002])
+        items = list(tm11.iter_poll_response(io.BytesIO(poll_resp.to_xml())))
+
+        self.assertEqual(len(items), 3)
+        header = items[0]
+        self.assertEqual(header.collection_name, 'blah')
+        self.assertEqual(header.more, True)
+        self.assertEqual(header.result_id, '123')
+        self.assertEqual(header.result_part_number, 2)
+        self.assertEqual(header.record_count.record_count, 2)
+        self.assertEqual(header.content_blocks, [])
+        self.assertContentBlocksEqual(items[1:], [cb001, cb002])
+
+    def test_iter_inbox_message(self):
+        inbox = tm11.InboxMessage(
+            message_id='Inbox1',
+            destination_collection_names=['collection1'],
+            content_blocks=[cb001, cb002])
+        items = list(tm11.iter_poll_response(inbox.to_xml()))
+
+        self.assertEqual(items[0].message_type, MSG_INBOX_MESSAGE)
+        self.assertEqual(items[0].destination_collection_names, ['collection1'])
+        self.assertContentBlocksEqual(items[1:], [cb001, cb002])
+
+    def test_iter_no_content_blocks(self):
+        poll_resp = tm11.PollResponse(message_id='PollResp2', in_response_to='tmp', collection_name='blah')
+        items = list(tm11.iter_poll_response(poll_resp.to_xml()))
+        self.assertEqual(items, [poll_resp])
+
+    def test_iter_status_message(self):
+        sm = tm11.StatusMessage(message_id='SM01', in_response_to='tmp', status_type=ST_FAILURE)
+        items = list(tm11.iter_poll_response(sm.to_xml()))
+        self.assertEqual(items, [sm])
+
+    def assertDetached(self, content_block):
+        # The content is the root of its own document, and doesn't declare
+        # the namespaces of the message it came from
+        self.assertIs(content_block._content.getroottree().getroot(), content_block._content)
+        self.assertTrue(b'taxii_11' not in content_block.content)
+
+    def test_detach_after_reading_content(self):
+        poll_resp = tm11.PollResponse(message_id='PollResp1', in_response_to='tmp', collection_name='blah',
+                                      content_blocks=[cb001])
+        block = tm11.get_message_from_xml(poll_resp.to_xml()).content_blocks[0]
+        self.assertTrue(b'taxii_11' in block.content)
+        block.detach()
+        self.assertDetached(block)
+
+    def test_iter_detach_content(self):
+        poll_resp = tm11.PollResponse(message_id='PollResp1', in_response_to='tmp', collection_name='blah',
+                                      content_blocks=[cb001, cb002])
+        items = list(tm11.iter_poll_response(poll_resp.to_xml()))
+        for block in items[1:]:
+            self.assertDetached(block)
+
+        items = list(tm11.iter_poll_response(poll_resp.to_xml(), detach_content=False))
+        self.assertTrue(items[1]._content.getparent() is not None)
+
+    def test_get_message_from_xml_detach_content(self):
+        poll_resp = tm11.PollResponse(message_id='PollResp1', in_response_to='tmp', collection_name='blah',
+                                      content_blocks=[cb001, cb002])
+        msg = tm11.get_message_from_xml(poll_resp.to_xml())
+        self.assertTrue(msg.content_blocks[0]._content.getparent() is not None)
+
+        msg = tm11.get_message_from_xml(poll_resp.to_xml(), detach_content=True)
+        for block in msg.content_blocks:
+            self.assertDetached(block)
+        self.assertContentBlocksEqual(msg.content_blocks, [cb001, cb002])
+
+    def test_iter_poll_response_json(self):
+        poll_resp = tm11.PollResponse(message_id='PollResp1', in_response_to='tmp', collection_name='blah',
+                                      more=True, result_id='123', result_part_number=2,
+                                      record_count=tm11.RecordCount(record_count=2, partial_count=True),
+                                      extended_headers={'ext_header1': 'value1'},
+                                      content_blocks=[cb001, cb002, cb001])
+        f = io.BytesIO()
+        poll_resp.write_json(f)
+        expected = [tm11.PollResponse.from_dict(dict(poll_resp.to_dict(), content_blocks=[]))]
+        expected += tm11.get_message_from_json(f.getvalue()).content_blocks
+
+        self.assertEqual(list(tm11.iter_poll_response_json(f.getvalue())), expected)
+        self.assertEqual(list(tm11.iter_poll_response_json(poll_resp.to_json())), expected)
+        # Values split across reads
+        self.assertEqual(list(tm11.iter_poll_response_json(_SmallReads(f.getvalue(), 7))), expected)
+
+        # content_blocks is not the last member, so the array is read whole
+        unordered = json.dumps(json.loads(poll_resp.to_json()), sort_keys=True)
+        self.assertEqual(list(tm11.iter_poll_response_json(unordered)), expected)
+
+    def test_iter_poll_response_json_streamed(self):
+        # Each Content Block is yielded before the next one is read
+        inbox = tm11.InboxMessage(message_id='Inbox1', content_blocks=[cb001] * 3)
+        f = io.BytesIO()
+        inbox.write_json(f)
+        source = _SmallReads(f.getvalue(), 16)
+        items = tm11.iter_poll_response_json(source)
+        self.assertEqual(next(items).message_id, 'Inbox1')
+        self.assertEqual(next(items), cb001)
+        self.assertTrue(source.remaining > 0)
+        self.assertEqual(list(items), [cb001, cb001])
+
+    def test_iter_poll_response_json_escapes(self):
+        # Brackets, quotes and backslashes in strings, split at every offset
+        block = tm11.ContentBlock(CB_STIX_XML_111, u'{"a": "]}\\\\", "b": ["\\"]} \u00e9 \\')
+        inbox = tm11.InboxMessage(message_id='Inbox1', content_blocks=[block, block])
+        data = inbox.to_json().encode('utf-8')
+        expected = list(tm11.iter_poll_response_json(data))
+        self.assertEqual(expected[1:], [block, block])
+        for size in range(1, 8):
+            self.assertEqual(list(tm11.iter_poll_response_json(_SmallReads(data, size))), expected)
+
+    def test_iter_poll_response_json_large_block(self):
+        # A large Content Block is decoded once, not again for every chunk
+        content = (u'<a b="}]">\\ ' + u'x' * 1000 + u'</a>') * 8000
+        block = tm11.ContentBlock(CB_STIX_XML_111, content)
+        data = tm11.InboxMessage(message_id='Inbox1', content_blocks=[block, block]).to_json().encode('utf-8')
+
+        start = time.time()
+        message = tm11.get_message_from_json(data)
+        whole = time.time() - start
+        start = time.time()
+        items = list(tm11.iter_poll_response_json(io.BytesIO(data)))
+        streamed = time.time() - start
+
+        self.assertEqual(items[1:], message.content_blocks)
+        self.assertTrue(streamed < 10 * whole + 0.5, (streamed, whole))
+
+    def test_iter_poll_response_json_other_message(self):
+        sm = tm11.StatusMessage(message_id='SM01', in_response_to='tmp', status_type=ST_FAILURE)
+        self.assertEqual(list(tm11.iter_poll_response_json(sm.to_json())), [sm])
+
+        with self.assertRaises(ValueError):
+            list(tm11.iter_poll_response_json('{"message_type": "Inbox_Message", "message_id": "1", '
+                                              '"extended_headers": {}, "content_blocks": [], "message": "late"}'))
+        with self.assertRaises(ValueError):
+            list(tm11.iter_poll_response_json('{"message_type": "Inbox_Message", "message_id": "1"} {}'))
+        with self.assertRaises(ValueError):
+            list(tm11.iter_poll_response_json('{"message_type": "Inbox_Message", "message_id": "1", "con'))
+
+
+class WriteXmlTests(unittest.TestCase):
+
+    def make_poll_response(self, content_blocks):
+        return tm11.PollResponse(
+            message_id='PollResp1',
+            in_response_to='tmp',
+            collection_name='blah',
+            result_part_number=2,
+            record_count=tm11.RecordCount(record_count=2),
+            message='Woooooooo',
+            extended_headers={'ext_header1': 'value1'},
+            content_blocks=content_blocks)
+
+    def test_iter_xml_chunks(self):
+        poll_resp = self.make_poll_response([cb001, cb002])
+        chunks = list(poll_resp.iter_xml_chunks())
+
+        # The header, then one chunk per Content Block
+        self.assertEqual(len(chunks), 3)
+        self.assertTrue(b'Content_Block' not in chunks[0])
+        # Namespaces are only declared on the message element
+        self.assertEqual(b''.join(chunks), poll_resp.to_xml())
+        self.assertEqual(b''.join(poll_resp.iter_xml_chunks(pretty_print=True)), poll_resp.to_xml(pretty_print=True))
+
+    def test_write_xml_lazy_content_blocks(self):
+        poll_resp = self.make_poll_response([])
+        content_blocks = (tm11.ContentBlock(CB_STIX_XML_111, '<Package id="%s"/>' % i) for i in range(5))
+        f = io.BytesIO()
+        poll_resp.write_xml(f, content_blocks=content_blocks)
+
+        msg = tm11.get_message_from_xml(f.getvalue())
+        self.assertEqual(msg.collection_name, 'blah')
+        self.assertEqual(msg.extended_headers, {'ext_header1': 'value1'})
+        self.assertEqual([cb._content.get('id') for cb in msg.content_blocks], ['0', '1', '2', '3', '4'])
+
+    def test_write_json(self):
+        poll_resp = self.make_poll_response([cb001, cb002])
+        f = io.BytesIO()
+        poll_resp.write_json(f)
+        self.assertEqual(json.loads(f.getvalue().decode('utf-8')), json.loads(poll_resp.to_json()))
+        self.assertEqual(tm11.get_message_from_json(f.getvalue()), poll_resp)
+
+        # With the json module, the output is the same as to_json() wherever
+        # dicts keep insertion order (Content Blocks are always written last)
+        set_json_dumps(json.dumps)
+        try:
+            chunks = list(poll_resp.iter_json_chunks())
+        finally:
+            set_json_dumps()
+        self.assertEqual(len(chunks), 4)
+        if sys.version_info >= (3, 7):
+            self.assertEqual(b''.join(chunks), poll_resp.to_json().encode('utf-8'))
+
+    def test_write_json_lazy_content_blocks(self):
+        inbox = tm11.InboxMessage(message_id='Inbox1')
+        content_blocks = (tm11.ContentBlock(CB_STIX_XML_111, '<Package id="%s"/>' % i) for i in range(5))
+        f = io.BytesIO()
+        inbox.write_json(f, content_blocks=content_blocks)
+
+        msg = tm11.get_message_from_json(f.getvalue())
+        self.assertEqual([cb._content.get('id') for cb in msg.content_blocks], ['0', '1', '2', '3', '4'])
+
+        f = io.BytesIO()
+        tm11.DiscoveryRequest(message_id='1').write_json(f)
+        self.assertEqual(tm11.get_message_from_json(f.getvalue()), tm11.DiscoveryRequest(message_id='1'))
+
+    def test_write_xml_inbox_message(self):
+        inbox = tm11.InboxMessage(message_id='Inbox1', content_blocks=[cb001])
+        f = io.BytesIO()
+        inbox.write_xml(f)
+        self.assertEqual(f.getvalue(), inbox.to_xml())
+
+        f = io.BytesIO()
+        inbox.write_xml(f, pretty_print=True)
+        self.assertEqual(f.getvalue(), inbox.to_xml(pretty_print=True))
+
+        # A message without any child elements
+        inbox = tm11.InboxMessage(message_id='Inbox1')
+        self.assertEqual(b''.join(inbox.iter_xml_chunks()), inbox.to_xml())
+
+    def test_write_xml_other_message(self):
+        sm = tm11.StatusMessage(message_id='SM01', in_response_to='tmp', status_type=ST_FAILURE)
+        f = io.BytesIO()
+        sm.write_xml(f)
+        self.assertEqual(f.getvalue(), sm.to_xml())
+
+
+class BinaryMessageBindingTests(unittest.TestCase):
+
+    def make_inbox_message(self):
+        return tm11.InboxMessage(message_id='Inbox1', destination_collection_names=['collection1'],
+                                 extended_headers={'ext_header1': 'value1'},
+                                 content_blocks=[tm11.ContentBlock(CB_STIX_XML_111, '<STIX_Package/>',
+                                                                   timestamp_label=datetime.datetime.now(tzutc()),
+                                                                   message='Hullo!'),
+                                                 tm11.ContentBlock(CB_STIX_XML_11, full_stix_doc)])
+
+    def test_round_trip(self):
+        inbox = self.make_inbox_message()
+        msg = tm11.get_message_from_binary(inbox.to_binary())
+        self.assertEqual(msg, tm11.get_message_from_dict(inbox.to_dict()))
+        self.assertEqual([cb.content for cb in msg.content_blocks], [cb.content for cb in inbox.content_blocks])
+        self.assertTrue(len(inbox.to_binary()) < len(inbox.to_xml()))
+
+        inbox.content_blocks = [tm11.ContentBlock(CB_STIX_XML_111, '<Not XML', content_is_xml=False)]
+        msg = tm11.get_message_from_binary(inbox.to_binary())
+        self.assertEqual(msg.content_blocks[0].content, '<Not XML')
+        self.assertEqual(msg.content_blocks[0].content_is_xml, False)
+
+    def test_content_parsed_when_needed(self):
+        msg = tm11.get_message_from_binary(self.make_inbox_message().to_binary())
+        block = msg.content_blocks[0]
+        self.assertTrue(block._content is None)
+
+        # Sending the content on does not parse it
+        self.assertEqual(block.content, b'<STIX_Package/>')
+        self.assertEqual(tm11.get_message_from_binary(msg.to_binary()).content_blocks[0].content, block.content)
+        self.assertTrue(block._content is None)
+
+        msg_from_xml = tm11.get_message_from_xml(msg.to_xml(), detach_content=True)
+        self.assertEqual(msg_from_xml.content_blocks[0].content, b'<STIX_Package/>')
+        self.assertEqual(block._content.tag, 'STIX_Package')
+
+    def test_invalid(self):
+        data = self.make_inbox_message().to_binary()
+        for bad_data in (data[:-1], data + b'N', b'<Inbox_Message/>', data[:4] + b'X'):
+            with self.assertRaises(ValueError):
+                tm11.get_message_from_binary(bad_data)
+        with self.assertRaises(ValueError):
+            tm11.get_message_from_binary(encode_binary(['not', 'a', 'message']))
+
+    def test_invalid_structure(self):
+        # An unhashable map key or message_type, and an unknown object type
+        for bad_value in ({'message_type': ['Inbox_Message']}, {'message_type': {}},
+                          {'message_type': MSG_INBOX_MESSAGE, 'message_id': '1', 'content_blocks': 5},
+                          {'message_type': MSG_INBOX_MESSAGE, 'message_id': '1', 'content_blocks': ['x']}):
+            with self.assertRaises(ValueError):
+                tm11.get_message_from_binary(encode_binary(bad_value))
+        bad_key = b'TXB\x01M\x00\x00\x00\x01L\x00\x00\x00\x00N'
+        bad_object = b'TXB\x01OS\x00\x00\x00\x03FooM\x00\x00\x00\x00'
+        missing_fields = b'TXB\x01OS\x00\x00\x00\x0eContentBindingM\x00\x00\x00\x00'
+        for bad_data in (bad_key, bad_object, missing_fields):
+            with self.assertRaises(ValueError):
+                decode_binary(bad_data, {'ContentBinding': tm11.ContentBinding.from_dict})
+
+    def test_oversized_values(self):
+        # Lengths and counts larger than the rest of the data, and a
+        # timestamp too large for a datetime
+        for bad_data in (b'TXB\x01S\xff\xff\xff\xffabc', b'TXB\x01L\xff\xff\xff\xffN',
+                         b'TXB\x01M\xff\xff\xff\xffS\x00\x00\x00\x00N', b'TXB\x01M\x00\x00\x00\x01N',
+                         b'TXB\x01AS\x00\x00\x00\x1410000000000000000000'):
+            with self.assertRaises(ValueError):
+                decode_binary(bad_data)
+
+    def test_nested_too_deeply(self):
+        with self.assertRaises(ValueError):
+            tm11.get_message_from_binary(b'TXB\x01' + b'L\x00\x00\x00\x01' * 100000 + b'N')
+        with self.assertRaises(ValueError):
+            decode_binary(encode_binary(functools.reduce(lambda value, _: [value], range(101), None)))
+        self.assertEqual(decode_binary(encode_binary([[[None]]])), [[[None]]])
+
+
 class PollFulfillmentTests(unittest.TestCase):
 
     def test_poll_fulfillment1(self):
@@ -1186,6 +1553,70 @@ class ContentBlockTests(unittest.TestCase):
                                 padding='the padding!')
         round_trip_content_block(cb7)
 
+    def test_content_block_serialized_once(self):
+        cb8 = tm11.ContentBlock(content_binding=CB_STIX_XML_111, content='<stix:STIX_Package xmlns:stix="http://stix.mitre.org/stix-1"/>')
+        cb9 = tm11.ContentBlock(content_binding=CB_STIX_XML_111, content='<stix:STIX_Package xmlns:stix="http://stix.mitre.org/stix-1"/>')
+
+        content = cb8.content
+        self.assertTrue(cb8.content is content)
+        # The cached serialization is not part of the comparison
+        self.assertEqual(cb8, cb9)
+
+        cb8.content = '<Other/>'
+        self.assertEqual(cb8.content, b'<Other/>')
+
+    def test_content_block_slots(self):
+        cb = tm11.ContentBlock(content_binding=CB_STIX_XML_111,
+                               content='<stix:STIX_Package xmlns:stix="http://stix.mitre.org/stix-1"/>',
+                               timestamp_label=datetime.datetime.now(tzutc()),
+                               message='a message', padding='the padding!')
+        self.assertFalse(hasattr(cb, '__dict__'))
+        self.assertFalse(hasattr(cb.content_binding, '__dict__'))
+
+        # XML content is kept as an etree, which must survive pickling
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            cb2 = pickle.loads(pickle.dumps(cb, protocol))
+            self.assertEqual(cb, cb2)
+            self.assertTrue(cb2.content_is_xml)
+        self.assertEqual(cb, copy.deepcopy(cb))
+
+    def test_content_block_is_xml_hint(self):
+        cb = tm11.ContentBlock(CB_SMIME, '<a/>', content_is_xml=False)
+        self.assertFalse(cb.content_is_xml)
+        self.assertEqual(cb.content, '<a/>')
+        # The string survives a round trip through a dict. The XML binding
+        # has no such flag, so text that is XML is parsed again.
+        self.assertEqual(tm11.ContentBlock.from_dict(cb.to_dict()).content, '<a/>')
+        self.assertEqual(tm11.ContentBlock.from_xml(cb.to_xml()).content, b'<a/>')
+
+        cb.set_content('<b/>', is_xml=True)
+        self.assertEqual(cb.content, b'<b/>')
+        self.assertRaises(etree.XMLSyntaxError, tm11.ContentBlock, CB_STIX_XML_111, '<a', content_is_xml=True)
+
+        # Without the hint, a dict's content is sniffed
+        self.assertTrue(tm11.ContentBlock.from_dict({'content_binding': {'binding_id': CB_STIX_XML_111},
+                                                     'content': '<a/>'}).content_is_xml)
+
+    def test_might_be_xml(self):
+        for value in ('<a/>', ' \n<a/>', u'\ufeff<a/>', b'<a/>', b'\xef\xbb\xbf<a/>', b'\xff\xfe<\x00'):
+            self.assertTrue(might_be_xml(value), value)
+        for value in ('', 'MIIBsgYJKoZIhvcNAQcDoIIBozCCAZ8CAQAxggFa', b'abc <a/>', 5, None):
+            self.assertFalse(might_be_xml(value), value)
+
+        # Strings that can't be XML are not parsed
+        elt = append_any_content_etree(etree.Element('Extended_Header'), 'abc <a/>')
+        self.assertEqual((elt.text, len(elt)), ('abc <a/>', 0))
+        elt = append_any_content_etree(etree.Element('Extended_Header'), '<a/>')
+        self.assertEqual((elt.text, len(elt)), (None, 1))
+
+    def test_content_block_eq_unset_slot(self):
+        cb1 = tm11.ContentBlock(content_binding=CB_STIX_XML_111, content='abc')
+        cb2 = tm11.ContentBlock(content_binding=CB_STIX_XML_111, content='abc')
+        cb2.padding = 'padding'  # Public members are not compared
+        self.assertEqual(cb1, cb2)
+        cb2.message = 'different'
+        self.assertNotEqual(cb1, cb2)
+
 
 class TestXmlAttacks(unittest.TestCase):
     """
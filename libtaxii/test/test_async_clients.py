@@ -0,0 +1,222 @@
+from __future__ import unicode_literals
+
+import sys
+
+import pytest
+
+if sys.version_info < (3, 5):
+    pytest.skip('libtaxii.async_clients requires Python 3.5+', allow_module_level=True)
+
+import asyncio
+import concurrent.futures
+import socket
+
+from libtaxii.async_clients import AsyncHttpClient, AsyncHttpResponse, _BodyReader, _connect_socket
+from libtaxii.clients import StatusMessageError
+from libtaxii.constants import *
+import libtaxii.messages_11 as tm11
+from libtaxii.test.http_server import CompressingHandler, SlowPollHandler, TAXIIHandler, taxii_server
+
+
+class _PollHandler(TAXIIHandler):
+    # Part 2 is large enough to be parsed in the executor
+    parts = {1: ['block 1', 'block 2'], 2: ['x' * 100000]}
+
+    def do_POST(self):
+        request = tm11.get_message_from_xml(self.rfile.read(int(self.headers['Content-Length'])))
+        if request.collection_name != 'default':
+            response = tm11.StatusMessage(message_id='2', in_response_to=request.message_id,
+                                          status_type=ST_NOT_FOUND, message='No such collection')
+        else:
+            if request.message_type == MSG_POLL_REQUEST:
+                part = 1
+            else:
+                assert request.result_id == 'result'
+                part = request.result_part_number
+            response = tm11.PollResponse(message_id='2', in_response_to=request.message_id,
+                                         collection_name='default', result_id='result',
+                                         result_part_number=part, more=part < len(self.parts),
+                                         content_blocks=[tm11.ContentBlock(CB_STIX_XML_111, content)
+                                                         for content in self.parts[part]])
+        body = response.to_xml()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('X-TAXII-Content-Type', VID_TAXII_XML_11)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def _collect(async_iterator):
+    # Equivalent to [x async for x in async_iterator]
+    results = []
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                results.append(loop.run_until_complete(async_iterator.__anext__()))
+            except StopAsyncIteration:
+                return results
+    finally:
+        loop.close()
+
+
+def _poll_request(collection_name):
+    return tm11.PollRequest(message_id='1', collection_name=collection_name,
+                            poll_parameters=tm11.PollRequest.PollParameters())
+
+
+def test_send_taxii_message():
+    with taxii_server() as server:
+        client = AsyncHttpClient()
+        response = _run(client.send_taxii_message('127.0.0.1', '/discovery/', tm11.DiscoveryRequest(message_id='1'),
+                                                  port=server.server_port, timeout=10))
+    assert isinstance(response, tm11.DiscoveryResponse)
+    assert response.in_response_to == '1'
+
+
+def test_call_taxii_service2_headers():
+    with taxii_server() as server:
+        client = AsyncHttpClient()
+        response = _run(client.call_taxii_service2('127.0.0.1', '/discovery/', VID_TAXII_XML_11,
+                                                   tm11.DiscoveryRequest(message_id='1').to_xml(),
+                                                   port=server.server_port))
+    assert response.status == 200
+    assert response.getheader('x-taxii-content-type') == VID_TAXII_XML_11
+    assert isinstance(tm11.get_message_from_xml(response.body), tm11.DiscoveryResponse)
+
+
+def test_poll_content_blocks_follows_result_parts():
+    with taxii_server(_PollHandler) as server:
+        client = AsyncHttpClient()
+        blocks = _collect(client.poll_content_blocks('127.0.0.1', '/poll/', _poll_request('default'),
+                                                     port=server.server_port))
+    assert [b.content for b in blocks] == ['block 1', 'block 2', 'x' * 100000]
+
+
+class _RecordingExecutor(concurrent.futures.ThreadPoolExecutor):
+
+    def __init__(self):
+        super(_RecordingExecutor, self).__init__(1)
+        self.functions = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.functions.append(getattr(fn, '__name__', None))
+        return super(_RecordingExecutor, self).submit(fn, *args, **kwargs)
+
+
+def test_poll_content_blocks_parsed_in_executor():
+    with _RecordingExecutor() as executor, taxii_server(_PollHandler) as server:
+        client = AsyncHttpClient(executor=executor)
+        blocks = _collect(client.poll_content_blocks('127.0.0.1', '/poll/', _poll_request('default'),
+                                                     port=server.server_port))
+    assert [b.content for b in blocks] == ['block 1', 'block 2', 'x' * 100000]
+    # Each response is parsed in the executor, including the small first part
+    assert executor.functions.count('_parse') >= 4
+
+
+def test_poll_content_blocks_streamed():
+    for accept_compressed in (False, True):
+        SlowPollHandler.first_block_parsed.clear()
+        SlowPollHandler.waited = []
+        with taxii_server(SlowPollHandler) as server:
+            client = AsyncHttpClient()
+            client.set_compression(accept_compressed=accept_compressed)
+            blocks = client.poll_content_blocks('127.0.0.1', '/poll/', _poll_request('default'),
+                                                port=server.server_port)
+            loop = asyncio.new_event_loop()
+            try:
+                assert loop.run_until_complete(blocks.__anext__()).content == '0' * 10000
+                SlowPollHandler.first_block_parsed.set()
+                assert [loop.run_until_complete(blocks.__anext__()).content
+                        for _ in range(2)] == ['1' * 10000, '2' * 10000]
+                with pytest.raises(StopAsyncIteration):
+                    loop.run_until_complete(blocks.__anext__())
+            finally:
+                loop.close()
+
+        # The first Content Block was returned before the server sent the rest
+        assert SlowPollHandler.waited == [True]
+
+
+def test_body_reader_chunked():
+    # No async syntax, so that Python 2 can still skip this module
+    loop = asyncio.new_event_loop()
+    try:
+        reader = asyncio.StreamReader(loop=loop)
+        reader.feed_data(b'5\r\nhello\r\n6;name=value\r\n world\r\n0\r\nTrailer: x\r\n\r\n')
+        reader.feed_eof()
+        response = AsyncHttpResponse(200, 'OK', [('Transfer-Encoding', 'chunked')], b'')
+        assert loop.run_until_complete(_BodyReader(reader, response).read_all()) == b'hello world'
+    finally:
+        loop.close()
+
+
+def test_connect_socket_ipv6():
+    try:
+        listener = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        listener.bind(('::1', 0))
+    except (AttributeError, OSError):
+        pytest.skip('IPv6 is not available')
+    listener.listen(1)
+
+    loop = asyncio.new_event_loop()
+    try:
+        sock = loop.run_until_complete(_connect_socket(loop, ('::1', listener.getsockname()[1])))
+        assert sock.family == socket.AF_INET6
+        sock.close()
+    finally:
+        loop.close()
+        listener.close()
+
+
+def test_poll_content_blocks_status_message():
+    with taxii_server(_PollHandler) as server:
+        client = AsyncHttpClient()
+        with pytest.raises(StatusMessageError) as excinfo:
+            _collect(client.poll_content_blocks('127.0.0.1', '/poll/', _poll_request('missing'),
+                                                port=server.server_port))
+    assert excinfo.value.status_message.status_type == ST_NOT_FOUND
+
+
+def test_send_taxii_message_compressed():
+    CompressingHandler.request_encodings = []
+    message = tm11.InboxMessage(message_id='1', content_blocks=[tm11.ContentBlock(CB_STIX_XML_111, 'x' * 100000)])
+    with taxii_server(CompressingHandler) as server:
+        client = AsyncHttpClient()
+        client.set_compression(accept_compressed=True, compress_requests=True)
+        response = _run(client.send_taxii_message('127.0.0.1', '/inbox/', message, port=server.server_port))
+    assert CompressingHandler.request_encodings == ['gzip']
+    assert response.content_blocks[0].content == 'x' * 100000
+
+
+def test_call_taxii_service2_streamed():
+    CompressingHandler.transfer_encodings = []
+    message = tm11.InboxMessage(message_id='1', content_blocks=[tm11.ContentBlock(CB_STIX_XML_111, 'x' * 1000)
+                                                                for _ in range(3)])
+    with taxii_server(CompressingHandler) as server:
+        client = AsyncHttpClient()
+        response = _run(client.call_taxii_service2('127.0.0.1', '/inbox/', VID_TAXII_XML_11,
+                                                   message.iter_xml_chunks(), port=server.server_port))
+        response = _run(client.get_message_from_response(response, '1'))
+    assert CompressingHandler.transfer_encodings == ['chunked']
+    assert [cb.content for cb in response.content_blocks] == ['x' * 1000] * 3
+
+
+def test_send_inbox_message():
+    CompressingHandler.transfer_encodings = []
+    content_blocks = (tm11.ContentBlock(CB_STIX_XML_111, '%s ' % i * 1000) for i in range(3))
+    with taxii_server(CompressingHandler) as server:
+        client = AsyncHttpClient()
+        response = _run(client.send_inbox_message('127.0.0.1', '/inbox/', tm11.InboxMessage(message_id='1'),
+                                                  content_blocks=content_blocks, port=server.server_port))
+    assert CompressingHandler.transfer_encodings == ['chunked']
+    assert [cb.content for cb in response.content_blocks] == ['%s ' % i * 1000 for i in range(3)]
@@ -1,8 +1,31 @@
 from __future__ import unicode_literals
 
+import datetime
+import gzip
+import io
+import socket
+import tempfile
+import threading
+import time
+import zlib
+
+from dateutil.tz import tzutc
 from lxml import etree
+import pytest
+import six
+from six.moves import urllib
 
-from libtaxii.clients import VerifiableHTTPSConnection
+from libtaxii import clients, get_message_from_http_response, iter_message_from_http_response
+from libtaxii.clients import (ConnectionPool, DecompressedSizeError, HttpClient, PooledHttpClient,
+                              VerifiableHTTPSConnection, _CAN_STREAM_BODY, _DecompressingReader,
+                              clear_ssl_context_cache, get_max_decompressed_size, get_ssl_context,
+                              set_max_decompressed_size)
+from libtaxii.constants import (CB_STIX_XML_10, CB_STIX_XML_111, VID_CERT_EU_JSON_10, VID_LIBTAXII_BINARY_11,
+                                VID_TAXII_XML_11)
+import libtaxii.messages_10 as tm10
+from libtaxii.messages_11 import (ContentBlock, DiscoveryRequest, DiscoveryResponse, InboxMessage,
+                                  get_message_from_binary, get_message_from_xml)
+from libtaxii.test.http_server import CompressingHandler, SlowPollHandler, TAXIIHandler, taxii_server
 
 
 def test_connection():
@@ -10,3 +33,487 @@ def test_connection():
     # in the right order to a (non-TAXII) HTTPS server
 
     conn = VerifiableHTTPSConnection("https://httpbin.org/", 443)
+
+
+def test_pooled_client_reuses_connection():
+    with taxii_server() as server:
+        with PooledHttpClient() as client:
+            for _ in range(3):
+                response = client.call_taxii_service2('127.0.0.1', '/discovery/', VID_TAXII_XML_11,
+                                                      DiscoveryRequest(message_id='1').to_xml(),
+                                                      port=server.server_port)
+                msg = get_message_from_http_response(response, '1')
+                assert msg.in_response_to == '1'
+
+    assert len(TAXIIHandler.connections) == 1
+
+
+def test_pooled_client_resets_timeout():
+    with taxii_server() as server:
+        with PooledHttpClient() as client:
+            for timeout in (5, None):
+                response = client.call_taxii_service2('127.0.0.1', '/discovery/', VID_TAXII_XML_11,
+                                                      DiscoveryRequest(message_id='1').to_xml(),
+                                                      port=server.server_port, timeout=timeout)
+                get_message_from_http_response(response, '1')
+                pool, = client._pools.values()
+                conn = pool._idle[0][0]
+                # A call without a timeout doesn't keep the previous call's
+                assert conn.sock.gettimeout() == (timeout if timeout is not None else socket.getdefaulttimeout())
+
+    assert len(TAXIIHandler.connections) == 1
+
+
+class _SlowInboxHandler(TAXIIHandler):
+    """Counts the requests it receives, and answers a Discovery Request slowly
+    or, after answering, closes the connection, as the client asks."""
+    requests = []
+
+    def do_POST(self):
+        request = get_message_from_xml(self.read_body())
+        self.requests.append(request.message_id)
+        if request.message_id == 'slow':
+            time.sleep(1)
+        self.send_response(200)
+        body = DiscoveryResponse(message_id='2', in_response_to=request.message_id).to_xml()
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('X-TAXII-Content-Type', VID_TAXII_XML_11)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if request.message_id == 'close':
+            # Close the connection as if it had been idle too long, without
+            # telling the client
+            self.wfile.flush()
+            self.close_connection = True
+
+
+def test_pooled_client_retry():
+    _SlowInboxHandler.requests = []
+    with taxii_server(_SlowInboxHandler) as server:
+        with PooledHttpClient() as client:
+            def call(message_id, timeout=None):
+                response = client.call_taxii_service2('127.0.0.1', '/inbox/', VID_TAXII_XML_11,
+                                                      InboxMessage(message_id=message_id).to_xml(),
+                                                      port=server.server_port, timeout=timeout)
+                return get_message_from_http_response(response, message_id)
+
+            call('close')
+            time.sleep(0.2)
+            # The connection was closed by the server, so the request is sent
+            # again on a new one
+            assert call('1').in_response_to == '1'
+
+            # A request that timed out on a reused connection may have been
+            # handled, so it is not sent again
+            start = time.time()
+            try:
+                call('slow', timeout=0.5)
+            except (socket.error, six.moves.http_client.HTTPException):
+                pass
+            else:
+                assert False, 'The request did not time out'
+            assert time.time() - start < 0.9
+
+    assert _SlowInboxHandler.requests == ['close', '1', 'slow']
+
+
+def test_pooled_client_unread_response_not_reused():
+    with taxii_server() as server:
+        with PooledHttpClient() as client:
+            for _ in range(2):
+                response = client.call_taxii_service2('127.0.0.1', '/discovery/', VID_TAXII_XML_11,
+                                                      DiscoveryRequest(message_id='1').to_xml(),
+                                                      port=server.server_port)
+                response.close()
+
+    assert len(TAXIIHandler.connections) == 2
+
+
+def test_connection_pool_idle_timeout():
+    created = []
+
+    class FakeConnection(object):
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    def factory():
+        created.append(FakeConnection())
+        return created[-1]
+
+    pool = ConnectionPool(factory, max_size=1, idle_timeout=60)
+    conn, reused = pool.get()
+    assert not reused
+    pool.put(conn)
+    assert pool.get() == (conn, True)
+
+    # Only max_size idle connections are kept
+    other, _ = pool.get()
+    pool.put(conn)
+    pool.put(other)
+    assert other.closed
+
+    pool.idle_timeout = 0
+    time.sleep(0.01)
+    new_conn, reused = pool.get()
+    assert not reused and conn.closed and new_conn is not conn
+
+
+def test_ssl_contexts_are_shared():
+    clear_ssl_context_cache()
+    conn1 = VerifiableHTTPSConnection('localhost', 443, verify_server=False)
+    conn2 = VerifiableHTTPSConnection('localhost', 443, verify_server=False)
+    assert conn1.context is conn2.context
+    assert conn1.context is get_ssl_context(verify_server=False)
+    assert get_ssl_context(verify_server=True) is not conn1.context
+
+    clear_ssl_context_cache()
+    assert get_ssl_context(verify_server=False) is not conn1.context
+
+
+def test_tls_sessions_through_proxy(monkeypatch):
+    class FakeContext(object):
+        def wrap_socket(self, sock, server_hostname, session=None):
+            sock.session = (server_hostname, session)
+            return sock
+
+    class FakeSocket(object):
+        session = None
+
+    clear_ssl_context_cache()
+    monkeypatch.setattr(socket, 'create_connection', lambda *args: FakeSocket())
+    monkeypatch.setattr(clients, '_SSL_SESSIONS_MAX_SIZE', 2)
+    context = FakeContext()
+    for host in ('a.example.com', 'b.example.com', 'c.example.com'):
+        conn = VerifiableHTTPSConnection('proxy.example.com', 3128, verify_server=False)
+        conn.context = context
+        conn.set_tunnel(host, 8443)
+        monkeypatch.setattr(conn, '_tunnel', lambda: None)
+        conn.connect()
+
+    # Sessions are kept for the servers at the end of the tunnel, and only
+    # the most recently used ones are kept
+    assert sorted(clients._SSL_SESSIONS) == [(context, 'b.example.com', 8443), (context, 'c.example.com', 8443)]
+    clear_ssl_context_cache()
+
+
+def test_http_client_concurrent_calls(monkeypatch):
+    credentials = [{'username': 'alice', 'password': 'a'}, {'username': 'bob', 'password': 'b'}]
+    client = HttpClient(HttpClient.AUTH_BASIC, credentials[0])
+    client.set_proxy(HttpClient.NO_PROXY)
+    errors = []
+
+    def install_opener(opener):
+        raise AssertionError('HttpClient must not change the global urllib opener')
+
+    monkeypatch.setattr(urllib.request, 'install_opener', install_opener)
+
+    def call(thread_id):
+        try:
+            for i in range(20):
+                message_id = '%s-%s' % (thread_id, i)
+                response = client.call_taxii_service2('127.0.0.1', '/discovery/', VID_TAXII_XML_11,
+                                                      DiscoveryRequest(message_id=message_id).to_xml(),
+                                                      port=server.server_port, timeout=10)
+                msg = get_message_from_http_response(response, message_id)
+                assert msg.in_response_to == message_id
+        except Exception as e:
+            errors.append(e)
+
+    def change_settings():
+        for i in range(200):
+            client.set_auth_credentials(credentials[i % 2])
+            client.set_verify_server(bool(i % 2), 'ca.pem' if i % 2 else None)
+
+    with taxii_server() as server:
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(8)]
+        threads.append(threading.Thread(target=change_settings))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert not errors
+    assert TAXIIHandler.authorizations <= set('Basic ' + b64 for b64 in ('YWxpY2U6YQ==', 'Ym9iOmI='))
+
+
+def test_http_compression():
+    message = InboxMessage(message_id='1', content_blocks=[ContentBlock(CB_STIX_XML_111, 'indicator ' * 1000)])
+    for client_class in (HttpClient, PooledHttpClient):
+        CompressingHandler.request_encodings = []
+        with taxii_server(CompressingHandler) as server:
+            client = client_class()
+            client.set_compression(accept_compressed=True, compress_requests=True)
+            http_response = client.call_taxii_service2('127.0.0.1', '/inbox/', VID_TAXII_XML_11, message.to_xml(),
+                                                       port=server.server_port)
+            response = get_message_from_http_response(http_response, '1')
+
+            # Small requests are not worth compressing
+            client.call_taxii_service2('127.0.0.1', '/inbox/', VID_TAXII_XML_11,
+                                       DiscoveryRequest(message_id='3').to_xml(), port=server.server_port).read()
+
+        assert response.content_blocks[0].content == 'indicator ' * 1000
+        assert CompressingHandler.request_encodings == ['gzip', None]
+        stats = http_response.compression_stats
+        assert stats.encoding == 'deflate'
+        assert stats.ratio > 10
+        assert stats.bytes_saved == stats.uncompressed_bytes - stats.compressed_bytes > 0
+
+
+def test_http_compression_content_length():
+    # A Content-Length given for the uncompressed body is not sent
+    body = InboxMessage(message_id='1', content_blocks=[ContentBlock(CB_STIX_XML_111, 'indicator ' * 1000)]).to_xml()
+    for client_class in (HttpClient, PooledHttpClient):
+        CompressingHandler.request_encodings = []
+        with taxii_server(CompressingHandler) as server:
+            client = client_class()
+            client.set_compression(compress_requests=True)
+            http_response = client.call_taxii_service2('127.0.0.1', '/inbox/', VID_TAXII_XML_11, body,
+                                                       port=server.server_port, timeout=10,
+                                                       headers={'Content-Length': str(len(body))})
+            response = get_message_from_http_response(http_response, '1')
+
+        assert CompressingHandler.request_encodings == ['gzip']
+        assert response.content_blocks[0].content == 'indicator ' * 1000
+
+
+def test_http_compression_disabled():
+    CompressingHandler.request_encodings = []
+    message = InboxMessage(message_id='1', content_blocks=[ContentBlock(CB_STIX_XML_111, 'indicator ' * 1000)])
+    with taxii_server(CompressingHandler) as server:
+        http_response = HttpClient().call_taxii_service2('127.0.0.1', '/inbox/', VID_TAXII_XML_11, message.to_xml(),
+                                                         port=server.server_port)
+        response = get_message_from_http_response(http_response, '1')
+
+    assert CompressingHandler.request_encodings == [None]
+    assert not hasattr(http_response, 'compression_stats')
+    assert response.content_blocks[0].content == 'indicator ' * 1000
+
+
+def _gzip(data):
+    gzipped = io.BytesIO()
+    with gzip.GzipFile(fileobj=gzipped, mode='wb') as f:
+        f.write(data)
+    return gzipped.getvalue()
+
+
+def test_decompressing_reader():
+    data = b'0123456789' * 20000
+    raw_deflate = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    encoded = [('gzip', _gzip(data)),
+               ('deflate', zlib.compress(data)),
+               ('deflate', raw_deflate.compress(data) + raw_deflate.flush())]
+
+    for encoding, body in encoded:
+        reader = _DecompressingReader(io.BytesIO(body), encoding)
+        assert reader.read(10) == b'0123456789'
+        assert reader.read() == data[10:]
+        assert reader.read(10) == b''
+        assert reader.stats.compressed_bytes == len(body)
+        assert reader.stats.uncompressed_bytes == len(data)
+
+
+def test_decompressing_reader_multiple_gzip_members():
+    # e.g., a body gzipped in pieces, padded with zeros between them
+    body = _gzip(b'first ') + b'\x00\x00' + _gzip(b'second')
+    for chunk_size in (1, 3, 64 * 1024):
+        reader = _DecompressingReader(io.BytesIO(body), 'gzip')
+        reader._CHUNK_SIZE = chunk_size
+        assert reader.read() == b'first second'
+
+
+def test_decompressing_reader_max_size():
+    body = zlib.compress(b'0' * 1000000)
+    assert len(_DecompressingReader(io.BytesIO(body), 'deflate', max_size=1000000).read()) == 1000000
+    reader = _DecompressingReader(io.BytesIO(body), 'deflate', max_size=999999)
+    with pytest.raises(DecompressedSizeError):
+        reader.read()
+    # Decompression stopped at the limit
+    assert reader.stats.uncompressed_bytes == 1000000
+
+    set_max_decompressed_size(1000)
+    try:
+        with taxii_server(CompressingHandler) as server:
+            client = HttpClient()
+            client.set_compression(True)
+            message = InboxMessage(message_id='1', content_blocks=[ContentBlock(CB_STIX_XML_111, 'x' * 10000)])
+            http_response = client.call_taxii_service2('127.0.0.1', '/inbox/', VID_TAXII_XML_11, message.to_xml(),
+                                                       port=server.server_port)
+            with pytest.raises(DecompressedSizeError):
+                get_message_from_http_response(http_response, '1')
+    finally:
+        set_max_decompressed_size(None)
+    assert get_max_decompressed_size() is None
+
+
+def _content_blocks(count):
+    for i in range(count):
+        yield ContentBlock(CB_STIX_XML_111, '%s ' % i * 1000)
+
+
+def test_send_inbox_message_streamed():
+    for client_class in (HttpClient, PooledHttpClient):
+        for compress_requests in (False, True):
+            CompressingHandler.request_encodings = []
+            CompressingHandler.transfer_encodings = []
+            with taxii_server(CompressingHandler) as server:
+                client = client_class()
+                client.set_compression(compress_requests=compress_requests)
+                response = client.send_inbox_message('127.0.0.1', '/inbox/', InboxMessage(message_id='1'),
+                                                     content_blocks=_content_blocks(5), port=server.server_port)
+
+            assert isinstance(response, InboxMessage)
+            assert [cb.content for cb in response.content_blocks] == ['%s ' % i * 1000 for i in range(5)]
+            assert CompressingHandler.transfer_encodings == ['chunked' if _CAN_STREAM_BODY else None]
+            assert CompressingHandler.request_encodings == ['gzip' if compress_requests else None]
+
+
+def test_call_taxii_service2_file_body():
+    message = InboxMessage(message_id='1', content_blocks=list(_content_blocks(3)))
+    for client_class in (HttpClient, PooledHttpClient):
+        CompressingHandler.transfer_encodings = []
+        with tempfile.TemporaryFile() as f, taxii_server(CompressingHandler) as server:
+            message.write_xml(f)
+            f.seek(0)
+            http_response = client_class().call_taxii_service2('127.0.0.1', '/inbox/', VID_TAXII_XML_11, f,
+                                                               port=server.server_port)
+            response = get_message_from_http_response(http_response, '1')
+
+        # The length of a regular file is known, so it isn't sent chunked
+        assert CompressingHandler.transfer_encodings == [None]
+        assert len(response.content_blocks) == 3
+
+
+class _BinaryHandler(TAXIIHandler):
+    """Echoes Inbox Messages, in the binary Message Binding when the client
+    accepts it."""
+    accept_headers = []
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.headers['X-TAXII-Content-Type'] == VID_LIBTAXII_BINARY_11:
+            request = get_message_from_binary(body)
+        else:
+            request = get_message_from_xml(body)
+        accept = self.headers.get('X-TAXII-Accept', '')
+        self.accept_headers.append(accept)
+
+        response = InboxMessage(message_id='2', content_blocks=request.content_blocks)
+        if VID_LIBTAXII_BINARY_11 in accept:
+            binding, body = VID_LIBTAXII_BINARY_11, response.to_binary()
+        else:
+            binding, body = VID_TAXII_XML_11, response.to_xml()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('X-TAXII-Content-Type', binding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_binary_message_binding():
+    message = InboxMessage(message_id='1', content_blocks=[ContentBlock(CB_STIX_XML_111, '<Package id="1"/>')])
+    _BinaryHandler.accept_headers = []
+    with taxii_server(_BinaryHandler) as server:
+        client = HttpClient()
+        for accept_binary in (False, True):
+            client.set_accept_binary(accept_binary)
+            http_response = client.call_taxii_service2('127.0.0.1', '/inbox/', VID_TAXII_XML_11, message.to_xml(),
+                                                       port=server.server_port)
+            assert http_response.info()['X-TAXII-Content-Type'] == (VID_LIBTAXII_BINARY_11 if accept_binary
+                                                                   else VID_TAXII_XML_11)
+            response = get_message_from_http_response(http_response, '1')
+            assert response.message_id == '2'
+            assert etree.fromstring(response.content_blocks[0].content).get('id') == '1'
+
+        # Messages can be sent in the binary binding too
+        http_response = client.call_taxii_service2('127.0.0.1', '/inbox/', VID_LIBTAXII_BINARY_11,
+                                                   message.to_binary(), port=server.server_port)
+        assert get_message_from_http_response(http_response, '1').message_id == '2'
+
+    assert _BinaryHandler.accept_headers == [VID_TAXII_XML_11,
+                                             '%s, %s' % (VID_LIBTAXII_BINARY_11, VID_TAXII_XML_11),
+                                             VID_LIBTAXII_BINARY_11]
+
+
+def test_iter_message_from_http_response():
+    for client_class in (HttpClient, PooledHttpClient):
+        for accept_compressed in (False, True):
+            SlowPollHandler.first_block_parsed.clear()
+            SlowPollHandler.waited = []
+            with taxii_server(SlowPollHandler) as server:
+                client = client_class()
+                client.set_compression(accept_compressed=accept_compressed)
+                http_response = client.call_taxii_service2('127.0.0.1', '/poll/', VID_TAXII_XML_11,
+                                                           DiscoveryRequest(message_id='1').to_xml(),
+                                                           port=server.server_port)
+                items = iter_message_from_http_response(http_response, '1')
+                poll_response = next(items)
+                assert poll_response.collection_name == 'default'
+                assert poll_response.content_blocks == []
+                assert next(items).content == '0' * 10000
+                SlowPollHandler.first_block_parsed.set()
+                assert [cb.content for cb in items] == ['1' * 10000, '2' * 10000]
+
+            # The first Content Block was parsed before the server sent the rest
+            # (Python 2 HTTP responses can't return a partial read)
+            assert SlowPollHandler.waited == [not six.PY2]
+            assert hasattr(http_response, 'compression_stats') == accept_compressed
+
+
+def test_iter_message_from_http_response_reuses_connection():
+    for accept_compressed in (False, True):
+        SlowPollHandler.first_block_parsed.set()
+        with taxii_server(SlowPollHandler) as server:
+            with PooledHttpClient() as client:
+                client.set_compression(accept_compressed=accept_compressed)
+                for _ in range(3):
+                    http_response = client.call_taxii_service2('127.0.0.1', '/poll/', VID_TAXII_XML_11,
+                                                               DiscoveryRequest(message_id='1').to_xml(),
+                                                               port=server.server_port)
+                    assert len(list(iter_message_from_http_response(http_response, '1'))) == 4
+
+        assert len(SlowPollHandler.connections) == 1
+
+
+class _SlowJSONPollHandler(SlowPollHandler):
+    """Like SlowPollHandler, with a TAXII 1.0 Poll Response in the CERT EU
+    JSON Message Binding."""
+    message_binding = VID_CERT_EU_JSON_10
+
+    def get_parts(self, request_body):
+        body = tm10.PollResponse(message_id='2', in_response_to='1', feed_name='default',
+                                 inclusive_end_timestamp_label=datetime.datetime.now(tzutc()),
+                                 content_blocks=[tm10.ContentBlock(CB_STIX_XML_10, '%s' % i * 10000)
+                                                 for i in range(3)]).to_json().encode('utf-8')
+        split = body.index(b'1' * 10000)
+        return [body[:split], body[split:]]
+
+
+def test_iter_message_from_http_response_json():
+    _SlowJSONPollHandler.first_block_parsed.clear()
+    _SlowJSONPollHandler.waited = []
+    with taxii_server(_SlowJSONPollHandler) as server:
+        http_response = HttpClient().call_taxii_service2('127.0.0.1', '/poll/', VID_CERT_EU_JSON_10, b'{}',
+                                                         port=server.server_port)
+        items = iter_message_from_http_response(http_response, '1')
+        poll_response = next(items)
+        assert poll_response.feed_name == 'default'
+        assert next(items).content == '0' * 10000
+        _SlowJSONPollHandler.first_block_parsed.set()
+        assert [cb.content for cb in items] == ['1' * 10000, '2' * 10000]
+
+    assert _SlowJSONPollHandler.waited == [not six.PY2]
+
+
+def test_iter_message_from_http_response_other_message():
+    with taxii_server() as server:
+        http_response = HttpClient().call_taxii_service2('127.0.0.1', '/discovery/', VID_TAXII_XML_11,
+                                                         DiscoveryRequest(message_id='1').to_xml(),
+                                                         port=server.server_port)
+        items = list(iter_message_from_http_response(http_response, '1'))
+    assert len(items) == 1
+    assert isinstance(items[0], DiscoveryResponse)
+    assert items[0].in_response_to == '1'
@@ -0,0 +1,209 @@
+from __future__ import unicode_literals
+
+import datetime
+import threading
+import time
+
+from dateutil.tz import tzutc
+from six.moves import queue
+
+import libtaxii.messages_10 as tm10
+import libtaxii.messages_11 as tm11
+from libtaxii.clients import HttpClient, StatusMessageError
+from libtaxii.constants import *
+from libtaxii.polling import AsyncPollScheduler, PollOrchestrator, PollResultIterator, PollTarget
+from libtaxii.test.http_server import TAXIIHandler, taxii_server
+
+
+class _PollHandler(TAXIIHandler):
+    """Answers Poll Requests for the 'one-part' and 'two-parts' collections,
+    tracking how many requests are handled at once."""
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+
+    def do_POST(self):
+        cls = self.__class__
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        try:
+            time.sleep(0.02)
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            if self.headers['X-TAXII-Content-Type'] == VID_TAXII_XML_10:
+                response = self.poll_10(tm10.get_message_from_xml(body))
+            else:
+                response = self.poll_11(tm11.get_message_from_xml(body))
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+        body = response.to_xml()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('X-TAXII-Content-Type', response.version)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def poll_10(self, request):
+        return tm10.PollResponse(message_id='2', in_response_to=request.message_id, feed_name=request.feed_name,
+                                 inclusive_end_timestamp_label=datetime.datetime.now(tzutc()),
+                                 content_blocks=[tm10.ContentBlock(CB_STIX_XML_10, request.feed_name)])
+
+    def poll_11(self, request):
+        if request.collection_name not in ('one-part', 'two-parts'):
+            return tm11.StatusMessage(message_id='2', in_response_to=request.message_id,
+                                      status_type=ST_NOT_FOUND)
+
+        part = 1 if request.message_type == MSG_POLL_REQUEST else request.result_part_number
+        more = request.collection_name == 'two-parts' and part == 1
+        content = '%s %s' % (request.collection_name, part)
+        return tm11.PollResponse(message_id='2', in_response_to=request.message_id,
+                                 collection_name=request.collection_name, result_id='result',
+                                 result_part_number=part, more=more,
+                                 content_blocks=[tm11.ContentBlock(CB_STIX_XML_111, content)])
+
+
+class _MultiPartHandler(_PollHandler):
+    """Answers TAXII 1.1 polls with a result of 5 parts of 2 Content Blocks."""
+    parts = 5
+    requested_parts = []
+
+    def poll_11(self, request):
+        response_kwargs = dict(message_id='2', in_response_to=request.message_id,
+                               collection_name=request.collection_name, result_id='result')
+        if request.message_type == MSG_POLL_REQUEST:
+            if request.poll_parameters.response_type == RT_COUNT_ONLY:
+                return tm11.PollResponse(record_count=tm11.RecordCount(2 * self.parts), **response_kwargs)
+            part = 1
+        else:
+            part = request.result_part_number
+        self.requested_parts.append(part)
+        if part > self.parts:
+            return tm11.StatusMessage(message_id='2', in_response_to=request.message_id, status_type=ST_NOT_FOUND)
+
+        return tm11.PollResponse(result_part_number=part, more=part < self.parts,
+                                 content_blocks=[tm11.ContentBlock(CB_STIX_XML_111, '%s.%s' % (part, i))
+                                                 for i in range(2)],
+                                 **response_kwargs)
+
+
+def _poll_request():
+    return tm11.PollRequest(message_id='1', collection_name='default', poll_parameters=tm11.PollParameters())
+
+
+def test_poll_result_iterator():
+    _MultiPartHandler.requested_parts = []
+    _MultiPartHandler.max_in_flight = 0
+    with taxii_server(_MultiPartHandler) as server:
+        content_blocks = PollResultIterator.poll(HttpClient(), '127.0.0.1', '/poll/', _poll_request(),
+                                                 port=server.server_port, max_concurrent=3)
+        contents = [cb.content for cb in content_blocks]
+
+    assert contents == ['%s.%s' % (part, i) for part in range(1, 6) for i in range(2)]
+    assert content_blocks.response_count == 5
+    assert _MultiPartHandler.max_in_flight <= 3
+    # Parts past the end may have been requested, but not more than max_concurrent ahead
+    assert sorted(_MultiPartHandler.requested_parts)[:5] == [1, 2, 3, 4, 5]
+    assert max(_MultiPartHandler.requested_parts) <= 5 + 3
+
+
+def test_poll_result_iterator_count_first():
+    _MultiPartHandler.requested_parts = []
+    with taxii_server(_MultiPartHandler) as server:
+        content_blocks = PollResultIterator.poll(HttpClient(), '127.0.0.1', '/poll/', _poll_request(),
+                                                 port=server.server_port, max_concurrent=10, count_first=True)
+        assert len(list(content_blocks)) == 10
+
+    # The record count limits the read-ahead to the parts that exist
+    assert sorted(_MultiPartHandler.requested_parts) == [1, 2, 3, 4, 5]
+
+
+def test_poll_orchestrator():
+    received = queue.Queue()
+    with taxii_server(_PollHandler) as server:
+        port = server.server_port
+        targets = [PollTarget('127.0.0.1', '/poll/', 'one-part', port=port),
+                   PollTarget('127.0.0.1', '/poll/', 'two-parts', port=port),
+                   PollTarget('127.0.0.1', '/poll/', 'feed', port=port, version=VID_TAXII_XML_10),
+                   PollTarget('127.0.0.1', '/poll/', 'missing', port=port)]
+        results = PollOrchestrator(queue=received).run(targets)
+
+    assert [r.target for r in results] == targets
+    assert [r.content_block_count for r in results] == [1, 2, 1, 0]
+    assert [r.response_count for r in results] == [1, 2, 1, 0]
+    assert results[0].error is None
+    assert isinstance(results[3].error, StatusMessageError)
+
+    blocks = set()
+    while not received.empty():
+        target, content_block = received.get()
+        blocks.add((target.collection_name, content_block.content))
+    assert blocks == set([('one-part', 'one-part 1'), ('two-parts', 'two-parts 1'), ('two-parts', 'two-parts 2'),
+                          ('feed', 'feed')])
+
+
+def test_poll_orchestrator_per_host_limit():
+    _PollHandler.max_in_flight = 0
+    received = []
+    with taxii_server(_PollHandler) as server:
+        targets = [PollTarget('127.0.0.1', '/poll/', 'one-part', port=server.server_port) for _ in range(12)]
+        orchestrator = PollOrchestrator(HttpClient(), max_workers=6, max_per_host=2,
+                                        callback=lambda target, block: received.append(block))
+        results = orchestrator.run(targets)
+
+    assert all(r.error is None for r in results)
+    assert len(received) == 12
+    assert _PollHandler.max_in_flight <= 2
+
+
+class _AsyncPollHandler(_PollHandler):
+    """Answers asynchronous polls with PENDING twice before the result is ready."""
+    estimated_wait = 0
+    pending = {}
+
+    def poll_11(self, request):
+        if request.message_type == MSG_POLL_REQUEST:
+            assert request.poll_parameters.allow_asynch
+            result_id = str('result-' + request.collection_name)
+            self.pending[result_id] = 1
+        else:
+            result_id = str(request.result_id)
+            self.pending[result_id] -= 1
+
+        if self.pending[result_id] >= 0:
+            return tm11.StatusMessage(message_id='2', in_response_to=request.message_id, status_type=ST_PENDING,
+                                      status_detail={SD_RESULT_ID: result_id, SD_WILL_PUSH: False,
+                                                     SD_ESTIMATED_WAIT: self.estimated_wait})
+        return tm11.PollResponse(message_id='2', in_response_to=request.message_id,
+                                 collection_name=request.collection_name, result_id=result_id, more=False,
+                                 content_blocks=[tm11.ContentBlock(CB_STIX_XML_111, request.collection_name)])
+
+
+def test_async_poll_scheduler():
+    received = []
+    with taxii_server(_AsyncPollHandler) as server:
+        targets = [PollTarget('127.0.0.1', '/poll/', 'collection-%s' % i, port=server.server_port)
+                   for i in range(30)]
+        scheduler = AsyncPollScheduler(max_workers=4, max_per_host=4,
+                                       callback=lambda target, block: received.append(block.content))
+        results = scheduler.run(targets)
+
+    assert all(r.error is None for r in results)
+    assert [r.result_id for r in results] == ['result-' + t.collection_name for t in targets]
+    assert sorted(received) == sorted(t.collection_name for t in targets)
+
+
+def test_async_poll_scheduler_max_wait():
+    _AsyncPollHandler.estimated_wait = 600
+    try:
+        with taxii_server(_AsyncPollHandler) as server:
+            targets = [PollTarget('127.0.0.1', '/poll/', 'slow', port=server.server_port)]
+            results = AsyncPollScheduler(max_wait=60).run(targets)
+    finally:
+        _AsyncPollHandler.estimated_wait = 0
+
+    assert isinstance(results[0].error, StatusMessageError)
+    assert results[0].error.status_message.status_type == ST_PENDING
+    assert results[0].result_id == 'result-slow'
@@ -0,0 +1,112 @@
+from __future__ import unicode_literals
+
+import socket
+
+import pytest
+
+import libtaxii.messages_11 as tm11
+from libtaxii.clients import HttpClient
+from libtaxii.constants import *
+from libtaxii.retry import RetryPolicy
+from libtaxii.test.http_server import TAXIIHandler, taxii_server
+
+
+class _RetryHandler(TAXIIHandler):
+    """Answers with a RETRY Status Message while ``retries`` is positive."""
+    retries = 0
+    requests = 0
+    estimated_wait = 3
+
+    def do_POST(self):
+        cls = self.__class__
+        cls.requests += 1
+        request = tm11.get_message_from_xml(self.rfile.read(int(self.headers['Content-Length'])))
+        if cls.retries > 0:
+            cls.retries -= 1
+            response = tm11.StatusMessage(message_id='2', in_response_to=request.message_id, status_type=ST_RETRY,
+                                          status_detail={SD_ESTIMATED_WAIT: self.estimated_wait})
+        else:
+            response = tm11.DiscoveryResponse(message_id='2', in_response_to=request.message_id)
+
+        body = response.to_xml()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('X-TAXII-Content-Type', VID_TAXII_XML_11)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _RecordingRetryPolicy(RetryPolicy):
+
+    def __init__(self, *args, **kwargs):
+        super(_RecordingRetryPolicy, self).__init__(*args, **kwargs)
+        self.sleeps = []
+
+    def _sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+
+class _FlakyClient(HttpClient):
+    """Fails the first ``failures`` calls with a socket error."""
+
+    def __init__(self, failures):
+        super(_FlakyClient, self).__init__()
+        self.failures = failures
+
+    def call_taxii_service2(self, *args, **kwargs):
+        if self.failures > 0:
+            self.failures -= 1
+            raise socket.error('Connection reset by peer')
+        return super(_FlakyClient, self).call_taxii_service2(*args, **kwargs)
+
+
+def _send(policy, message, client=None, retries=0, estimated_wait=3):
+    _RetryHandler.retries = retries
+    _RetryHandler.requests = 0
+    _RetryHandler.estimated_wait = estimated_wait
+    with taxii_server(_RetryHandler) as server:
+        return policy.send_message(client or HttpClient(), '127.0.0.1', '/taxii/', message, port=server.server_port)
+
+
+def test_retry_honors_estimated_wait():
+    policy = _RecordingRetryPolicy(backoff_base=0.5)
+    response = _send(policy, tm11.DiscoveryRequest(message_id='1'), retries=2)
+    assert response.message_type == MSG_DISCOVERY_RESPONSE
+    assert _RetryHandler.requests == 3
+    assert len(policy.sleeps) == 2
+    assert all(seconds >= 3 for seconds in policy.sleeps)
+
+
+def test_retry_not_idempotent():
+    policy = _RecordingRetryPolicy()
+    response = _send(policy, tm11.InboxMessage(message_id='1'), retries=1)
+    assert response.status_type == ST_RETRY
+    assert _RetryHandler.requests == 1
+    assert policy.sleeps == []
+
+
+def test_retry_transport_error():
+    policy = _RecordingRetryPolicy(backoff_base=2, backoff_max=3)
+    response = _send(policy, tm11.DiscoveryRequest(message_id='1'), client=_FlakyClient(2))
+    assert response.message_type == MSG_DISCOVERY_RESPONSE
+    assert len(policy.sleeps) == 2
+    assert 0 <= policy.sleeps[0] <= 2 and 0 <= policy.sleeps[1] <= 3
+
+    policy = _RecordingRetryPolicy(max_attempts=2)
+    with pytest.raises(socket.error):
+        _send(policy, tm11.DiscoveryRequest(message_id='1'), client=_FlakyClient(2))
+
+
+def test_retry_limits():
+    # The estimated wait is longer than max_elapsed
+    policy = _RecordingRetryPolicy(max_elapsed=60)
+    response = _send(policy, tm11.DiscoveryRequest(message_id='1'), retries=1, estimated_wait=600)
+    assert response.status_type == ST_RETRY
+    assert policy.sleeps == []
+
+    # The host's retry budget is used up
+    policy = _RecordingRetryPolicy(host_budget=1, host_budget_refill=0)
+    response = _send(policy, tm11.DiscoveryRequest(message_id='1'), retries=3, estimated_wait=0)
+    assert response.status_type == ST_RETRY
+    assert _RetryHandler.requests == 2
@@ -1,8 +1,11 @@
 from __future__ import unicode_literals
 
+import threading
+
+import six
 from lxml import etree
 
-from libtaxii.common import parse_xml_string
+from libtaxii.common import get_xml_parser, parse_xml_string, set_xml_parser
 from libtaxii.constants import CB_STIX_XML_111
 from libtaxii.messages_10 import ContentBlock as ContentBlock10
 from libtaxii.messages_11 import get_message_from_xml, ContentBlock as ContentBlock11
@@ -107,3 +110,73 @@ def test_content_block_10_unicode():
     # Content is always in bytes
     assert isinstance(content_block._content, etree._Element)
     assert b"Indicator-ba1d406e-937c-414f-9231-6e1dbe64fe8b" in content_block.content
+
+
+def test_get_xml_from_byte_string_with_invalid_utf8():
+    # Undecodable bytes are replaced rather than rejected, as before the
+    # bytes fast path was added.
+    xml = discovery_request_with_encoding_bytes.replace(b'message_id="331b', b'message_id="\xff331b')
+    req = get_message_from_xml(xml)
+
+    assert req.message_id == "\ufffd331bf15a-76a0-4e29-8444-6e986e514e29"
+
+
+def _http_response(content_type):
+    from six.moves import http_client
+    from libtaxii.constants import VID_TAXII_XML_11
+
+    class FakeSocket(object):
+        def __init__(self, data):
+            self.data = data
+
+        def makefile(self, *args, **kwargs):
+            return six.BytesIO(self.data)
+
+    response = (b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: " + content_type + b"\r\n"
+                b"X-TAXII-Content-Type: " + VID_TAXII_XML_11.encode('ascii') + b"\r\n"
+                b"Content-Length: %d\r\n\r\n" % len(discovery_request_with_encoding_bytes) +
+                discovery_request_with_encoding_bytes)
+    http_response = http_client.HTTPResponse(FakeSocket(response))
+    http_response.begin()
+    return http_response
+
+
+def test_get_message_from_http_response_bytes():
+    from libtaxii import get_message_from_http_response
+
+    req = get_message_from_http_response(_http_response(b"application/xml; charset=utf-8"), '0')
+    assert req.message_id == "331bf15a-76a0-4e29-8444-6e986e514e29"
+
+
+def test_get_message_from_http_response_unknown_charset():
+    from libtaxii import get_message_from_http_response
+
+    # An unknown charset is treated as UTF-8
+    req = get_message_from_http_response(_http_response(b"application/xml; charset=bogus"), '0')
+    assert req.message_id == "331bf15a-76a0-4e29-8444-6e986e514e29"
+
+
+def test_xml_parser_per_thread():
+    main_parser = get_xml_parser()
+    assert get_xml_parser() is main_parser
+
+    other_parsers = []
+    t = threading.Thread(target=lambda: other_parsers.append(get_xml_parser()))
+    t.start()
+    t.join()
+    assert other_parsers[0] is not main_parser
+
+
+def test_set_xml_parser_replaces_thread_parsers():
+    old_parser = get_xml_parser()
+    try:
+        set_xml_parser(etree.XMLParser(remove_blank_text=True, resolve_entities=False))
+        x = parse_xml_string(b"<foo>\n  <bar />\n</foo>")
+        assert get_xml_parser() is not old_parser
+        assert x[0].tail is None
+    finally:
+        set_xml_parser(None)
+
+    x = parse_xml_string(b"<foo>\n  <bar />\n</foo>")
+    assert x[0].tail == "\n"
@@ -1,9 +1,15 @@
 # Copyright (c) 2017, The MITRE Corporation
 # For license information, see the LICENSE.txt file
 
+import json
+import threading
 import unittest
 
-from libtaxii.validation import do_check, message_id_regex_10
+import libtaxii.messages_10 as tm10
+import libtaxii.messages_11 as tm11
+from libtaxii.validation import (do_check, message_id_regex_10, uri_regex, get_validation_level,
+                                 set_validation_level, local_validation_level, VALIDATION_FULL,
+                                 VALIDATION_STRUCTURAL, VALIDATION_NONE)
 
 
 class ValidationTests(unittest.TestCase):
@@ -19,6 +25,87 @@ class ValidationTests(unittest.TestCase):
         kwargs = {'regex_tuple': message_id_regex_10}
         self.assertRaises(ValueError, do_check, *args, **kwargs)
 
+    def test_list_item_name_in_error(self):
+        try:
+            do_check([1, 2, 'three'], 'values', type=int)
+        except ValueError as e:
+            self.assertTrue('values[2]' in str(e))
+        else:
+            self.fail('ValueError not raised')
+
+    def test_uncompiled_regex_tuple(self):
+        regex_tuple = message_id_regex_10._replace(regex='^[0-9]+$')
+        do_check("12345", "Test Value", regex_tuple=regex_tuple)
+        self.assertRaises(ValueError, do_check, "abc", "Test Value", regex_tuple=regex_tuple)
+
+
+class ValidationLevelTests(unittest.TestCase):
+
+    def tearDown(self):
+        set_validation_level(VALIDATION_FULL)
+
+    def test_structural_skips_regex(self):
+        with local_validation_level(VALIDATION_STRUCTURAL):
+            do_check("12345abcd", "Message ID", regex_tuple=message_id_regex_10)
+            self.assertRaises(ValueError, do_check, None, "Message ID", regex_tuple=uri_regex)
+            self.assertRaises(ValueError, do_check, 1, "Message ID", type=str)
+            self.assertRaises(ValueError, do_check, 'x', "Value", value_tuple=(True, False))
+
+    def test_none_skips_everything(self):
+        with local_validation_level(VALIDATION_NONE):
+            do_check(None, "Message ID", regex_tuple=uri_regex)
+            do_check(1, "Message ID", type=str)
+        self.assertRaises(ValueError, do_check, None, "Message ID", regex_tuple=uri_regex)
+
+    def test_global_level(self):
+        set_validation_level(VALIDATION_NONE)
+        self.assertEqual(VALIDATION_NONE, get_validation_level())
+        do_check(None, "Message ID")
+        with local_validation_level(VALIDATION_FULL):
+            self.assertRaises(ValueError, do_check, None, "Message ID")
+        self.assertRaises(ValueError, set_validation_level, 'some')
+
+    def test_local_level_is_per_thread(self):
+        levels = []
+        with local_validation_level(VALIDATION_NONE):
+            t = threading.Thread(target=lambda: levels.append(get_validation_level()))
+            t.start()
+            t.join()
+        self.assertEqual([VALIDATION_FULL], levels)
+
+    def test_trusted_deserialization(self):
+        d = tm11.DiscoveryRequest(message_id='1').to_dict()
+        d['message_id'] = None
+        self.assertRaises(ValueError, tm11.get_message_from_dict, d)
+
+        msg = tm11.get_message_from_dict(d, validation_level=VALIDATION_NONE)
+        self.assertIsNone(msg.message_id)
+        self.assertEqual(VALIDATION_FULL, get_validation_level())
+
+    def test_parsed_input_follows_level(self):
+        # A TAXII 1.0 message ID must be numeric, which is a regex check
+        xml = tm10.DiscoveryRequest(message_id='1').to_xml().replace(b'message_id="1"', b'message_id="abc"')
+        d = tm10.get_message_from_xml(xml, validation_level=VALIDATION_STRUCTURAL).to_dict()
+        parsers = [(tm10.get_message_from_xml, xml), (tm10.get_message_from_json, json.dumps(d)),
+                   (tm10.get_message_from_dict, d)]
+        for parse, data in parsers:
+            self.assertRaises(ValueError, parse, data)
+            self.assertEqual('abc', parse(data, validation_level=VALIDATION_STRUCTURAL).message_id)
+
+        set_validation_level(VALIDATION_STRUCTURAL)
+        for parse, data in parsers:
+            self.assertEqual('abc', parse(data).message_id)
+            self.assertRaises(ValueError, parse, data, validation_level=VALIDATION_FULL)
+
+        # A missing message ID is found at every level but VALIDATION_NONE
+        d = tm11.DiscoveryRequest(message_id='1').to_dict()
+        d['message_id'] = None
+        data = tm11.DiscoveryRequest(message_id='1').to_binary().replace(b'S\x00\x00\x00\x011', b'N')
+        for parse, data in [(tm11.get_message_from_json, json.dumps(d)), (tm11.get_message_from_binary, data)]:
+            self.assertRaises(ValueError, parse, data)
+            with local_validation_level(VALIDATION_NONE):
+                self.assertIsNone(parse(data).message_id)
+                self.assertRaises(ValueError, parse, data, validation_level=VALIDATION_FULL)
 
 if __name__ == '__main__':
     unittest.main()
@@ -7,10 +7,12 @@ Common data validation functions used across libtaxii
 
 
 import collections
+import contextlib
 import re
 import datetime
 from lxml import etree
 import os
+import threading
 
 from .common import (parse, parse_datetime_string)
 import six
@@ -19,15 +21,80 @@ import six
 
 RegexTuple = collections.namedtuple('_RegexTuple', ['regex', 'title'])
 # URI regex per http://tools.ietf.org/html/rfc3986
-uri_regex = RegexTuple("(([^:/?#]+):)?(//([^/?#]*))?([^?#]*)(\?([^#]*))?(#(.*))?", "URI Format")
-message_id_regex_10 = RegexTuple("^[0-9]+$", "Numbers only")
-targeting_expression_regex = RegexTuple("^(@?\w+|\*{1,2})(/(@?\w+|\*{1,2}))*$", "Targeting Expression Syntax")
+uri_regex = RegexTuple(re.compile(r"(([^:/?#]+):)?(//([^/?#]*))?([^?#]*)(\?([^#]*))?(#(.*))?"), "URI Format")
+message_id_regex_10 = RegexTuple(re.compile(r"^[0-9]+$"), "Numbers only")
+targeting_expression_regex = RegexTuple(re.compile(r"^(@?\w+|\*{1,2})(/(@?\w+|\*{1,2}))*$"),
+                                        "Targeting Expression Syntax")
 
 _none_error = "%s is not allowed to be None and the provided value was None"
 _type_error = "%s must be of type %s. The incorrect value was of type %s"
 _regex_error = "%s must be a string conforming to %s. The incorrect value was: %s"
 _tuple_error = "%s must be one of %s. The incorrect value was %s"
 
+#: Perform every check. This is the default.
+VALIDATION_FULL = 'full'
+#: Check for missing values, types and allowed values, but skip regex checks.
+VALIDATION_STRUCTURAL = 'structural'
+#: Perform no checks. Only use this for input that is known to be valid.
+VALIDATION_NONE = 'none'
+
+_VALIDATION_LEVELS = (VALIDATION_FULL, VALIDATION_STRUCTURAL, VALIDATION_NONE)
+
+_validation_level = VALIDATION_FULL
+_thread_local = threading.local()
+
+
+def get_validation_level():
+    """Return the validation level in effect for the current thread.
+
+    This is the level set with :py:func:`local_validation_level`, if any, and
+    otherwise the global level set with :py:func:`set_validation_level`.
+    """
+    return getattr(_thread_local, 'level', None) or _validation_level
+
+
+def set_validation_level(level):
+    """Set the global validation level.
+
+    Args:
+        level (str): One of ``VALIDATION_FULL``, ``VALIDATION_STRUCTURAL``
+            or ``VALIDATION_NONE``
+    """
+    global _validation_level
+    if level not in _VALIDATION_LEVELS:
+        raise ValueError(_tuple_error % ('level', _VALIDATION_LEVELS, level))
+    _validation_level = level
+
+
+@contextlib.contextmanager
+def local_validation_level(level):
+    """Use a different validation level in the current thread, within a
+    ``with`` block.
+
+    Args:
+        level (str): One of ``VALIDATION_FULL``, ``VALIDATION_STRUCTURAL``,
+            ``VALIDATION_NONE``, or None to leave the level unchanged
+
+    Example:
+        .. code-block:: python
+
+            with local_validation_level(VALIDATION_NONE):
+                msg = tm11.get_message_from_xml(trusted_xml)
+    """
+    if level is None:
+        yield
+        return
+
+    if level not in _VALIDATION_LEVELS:
+        raise ValueError(_tuple_error % ('level', _VALIDATION_LEVELS, level))
+
+    previous = getattr(_thread_local, 'level', None)
+    _thread_local.level = level
+    try:
+        yield
+    finally:
+        _thread_local.level = previous
+
 
 def do_check(var, varname, type=None, regex_tuple=None, value_tuple=None, can_be_none=False):
     """
@@ -41,40 +108,64 @@ def do_check(var, varname, type=None, regex_tuple=None, value_tuple=None, can_be
     5. If a regex is specified, and the var doesn't match the regex, raise ValueError
     6. If a value_tuple is specified, and the var is not in the value_tuple, raise ValueError
 
+    No checks are performed if the validation level is ``VALIDATION_NONE``,
+    and step 5 is skipped if it is ``VALIDATION_STRUCTURAL``.
+
     varname is used in the error messages
 
     """
+    level = get_validation_level()
+    if level == VALIDATION_NONE:
+        return
+    if level == VALIDATION_STRUCTURAL:
+        regex_tuple = None
 
-    if isinstance(var, list) or isinstance(var, set) or isinstance(var, tuple):
+    if isinstance(var, (list, set, tuple)):
+        for x, item in enumerate(var):
+            _check_item(item, varname, x, type, regex_tuple, value_tuple, can_be_none)
+        return
 
-        x = 0
-        for item in var:
-            do_check(item, "%s[%s]" % (varname, x), type, regex_tuple, value_tuple, can_be_none)
-            x = x + 1
+    _check_item(var, varname, None, type, regex_tuple, value_tuple, can_be_none)
 
-        return
 
-    if var is None and can_be_none:
+def _check_item(var, varname, index, type, regex_tuple, value_tuple, can_be_none):
+    """Check a single value for do_check(). To keep checking lists cheap, the
+    item's name is only built if there is an error."""
+    if isinstance(var, (list, set, tuple)):  # A list of lists
+        for x, item in enumerate(var):
+            _check_item(item, _item_name(varname, index), x, type, regex_tuple, value_tuple, can_be_none)
         return
 
-    if var is None and not can_be_none:
-        raise ValueError(_none_error % varname)
+    if var is None:
+        if can_be_none:
+            return
+        raise ValueError(_none_error % _item_name(varname, index))
 
     if type is not None:
         if not isinstance(var, type):
             bad_type = var.__class__.__name__
-            raise ValueError(_type_error % (varname, type, bad_type))
+            raise ValueError(_type_error % (_item_name(varname, index), type, bad_type))
 
     if regex_tuple is not None:
         if not isinstance(var, six.string_types):
-            raise ValueError('%s was about to undergo a regex check, but is not of type basestring! Regex check was not performed' % (varname))
-        if re.match(regex_tuple.regex, var) is None:
-            raise ValueError(_regex_error % (varname, regex_tuple.title, var))
+            raise ValueError('%s was about to undergo a regex check, but is not of type basestring! Regex check was not performed' % (_item_name(varname, index)))
+        regex = regex_tuple.regex
+        if isinstance(regex, six.string_types):
+            match = re.match(regex, var)
+        else:
+            match = regex.match(var)
+        if match is None:
+            raise ValueError(_regex_error % (_item_name(varname, index), regex_tuple.title, var))
 
     if value_tuple is not None:
         if var not in value_tuple:
-            raise ValueError(_tuple_error % (varname, value_tuple, var))
-    return
+            raise ValueError(_tuple_error % (_item_name(varname, index), value_tuple, var))
+
+
+def _item_name(varname, index):
+    if index is None:
+        return varname
+    return "%s[%s]" % (varname, index)
 
 
 def check_timestamp_label(timestamp_label, varname, can_be_none=False):
@@ -87,8 +178,15 @@ def check_timestamp_label(timestamp_label, varname, can_be_none=False):
     3. If the timestamp_label arg is a string, convert to datetime
     4. If the timestamp_label does not have a tzinfo attribute, Fail
     5. Pass
+
+    Only step 3 is performed if the validation level is ``VALIDATION_NONE``.
     """
 
+    if get_validation_level() == VALIDATION_NONE:
+        if isinstance(timestamp_label, six.string_types):
+            timestamp_label = parse_datetime_string(timestamp_label)
+        return timestamp_label
+
     if timestamp_label is None and can_be_none:
         return
 